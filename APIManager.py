@@ -1,44 +1,648 @@
-from fastapi import FastAPI
-from utils.Locator import Locator
+import asyncio
+import json
+import os
+import secrets
+import signal
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, Query, Response
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel
+from typing import Annotated, List, Optional
+from utils.Locator import Coordinates, GeocodeCache, LocationError, \
+    Locator, close_geocoders, geocode_cache, get_async_geocoder, get_geocoder
+from utils.CoverageCache import CoverageCache
+from utils.Metrics import errors_total, registry, requests_total, \
+    stage_seconds
 from utils.TowerManager import TowerManager
+from utils.TowerStore import get_tower_store, reload_tower_store, \
+    tower_store_listeners, tower_store_ready, tower_store_update, \
+    warm_tower_store
+
+# Threads where the tower search runs, out of the event loop
+executor = ThreadPoolExecutor(thread_name_prefix='JG-towers')
+
+# Coverage already answered, by snapped location
+coverage_cache = CoverageCache()
+
+# Answers computed from a replaced tower database are not valid anymore
+tower_store_listeners.append(lambda store: coverage_cache.invalidate())
+
+# Seconds between two checks of the tower database file, 0 to never
+# reload it, and token allowing to reload it through the API, which is
+# disabled if there is none
+reload_interval = float(os.environ.get('JG_RELOAD_INTERVAL', 60))
+admin_token = os.environ.get('JG_ADMIN_TOKEN')
+
+# Maximum number of items of a batch call
+max_batch_items = int(os.environ.get('JG_MAX_BATCH_ITEMS', 1000))
+
+# Counters of the caches, read when the metrics are exported
+registry.counter('jg_cache_hits_total', "Answers found in the caches",
+                 label='cache',
+                 callback=lambda: {'geocode': geocode_cache.hits,
+                                   'coverage': coverage_cache.hits})
+registry.counter('jg_cache_misses_total', "Answers not found in the caches",
+                 label='cache',
+                 callback=lambda: {'geocode': geocode_cache.misses,
+                                   'coverage': coverage_cache.misses})
+
+
+@asynccontextmanager
+async def lifespan(api):
+    """
+    Load the shared tower database, build its index and create the
+    geocoders once, in the background so that the process answers the
+    health checks while warming, and close the geocoder connections at
+    the end. Processes forked from a warm one (see server.py) have
+    nothing left to do. The tower database file is watched while the
+    API runs.
+    """
+    global warming
+    if not tower_store_ready():
+        warming = asyncio.get_running_loop().run_in_executor(executor,
+                                                             warm_up)
+        warming.add_done_callback(report_warm_up)
+    watcher = None
+    if reload_interval > 0:
+        watcher = asyncio.create_task(watch_tower_store(reload_interval))
+    yield
+    if watcher is not None:
+        watcher.cancel()
+    await close_geocoders()
+
 
-app = FastAPI()
+# Warm up running in the background, if any
+warming = None
+
+
+def report_warm_up(future):
+    """
+    Report the error of a warm up that failed, the process stays not
+    ready
+    """
+    if not future.cancelled() and future.exception() is not None:
+        print("Warm up failed: {!r}".format(future.exception()),
+              file=sys.stderr)
+
+
+def warm_up():
+    """
+    Load the shared tower database, build its index and create the
+    geocoders, which may load a local address file
+    """
+    warm_tower_store()
+    get_geocoder()
+    get_async_geocoder()
+
+
+async def watch_tower_store(interval):
+    """
+    Reload the tower database when its file changes. A file is only
+    loaded once it has not changed for an interval, so that it is not
+    read while it is being written.
+
+    Parameters:
+    -----------
+    interval: (float)
+        Seconds between two checks of the file
+    """
+    loop = asyncio.get_running_loop()
+    previous = None
+    while True:
+        await asyncio.sleep(interval)
+        update = tower_store_update()
+        if update is not None and update == previous:
+            try:
+                await loop.run_in_executor(executor, reload_tower_store,
+                                           update[0])
+            except Exception:
+                # The current store keeps answering, the file is tried
+                # again on the next check
+                pass
+        previous = update
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+class BatchItem(BaseModel):
+    """
+    Item of a batch: an address or the coordinates of a location
+    """
+    address: Optional[str] = None
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+
+
+class BatchRequest(BaseModel):
+    """
+    Body of a batch call
+    """
+    items: List[BatchItem]
 
 
 class APIManager:
     """
     Manager to handle the API.
     """
+    # When True, coverages are answered with the cached JSON bytes
+    # instead of a dict, which skips encoding them again. Set
+    # JG_RAW_RESPONSES to 0 to answer dicts.
+    raw_responses = os.environ.get('JG_RAW_RESPONSES', '1') != '0'
+
     @staticmethod
     @app.get("/JG-papernest-API")
-    def get_towers_coverage(address=None):
+    async def get_towers_coverage(
+            address=None, lat: Optional[float] = None,
+            lon: Optional[float] = None,
+            operators: Annotated[Optional[List[str]], Query()] = None,
+            networks: Annotated[Optional[List[str]], Query()] = None):
         """
         Main function for the API. Receives the call from the URL and
-        processes the data from it
+        processes the data from it. The address is geocoded without
+        blocking the event loop and the towers are searched in the
+        executor. When coordinates are given instead of an address,
+        the geocoder is not needed at all. The coverage and the
+        distances are computed at the location of the cache key, the
+        location rounded to the precision of the CoverageCache (about
+        10 metres), so every location of a key gets the same answer.
 
         Parameters:
         -----------
         Address: (str)
             An actual address that can be located
+        lat: (float)
+            Latitude of the location, used with lon if no address is
+            provided
+        lon: (float)
+            Longitude of the location, used with lat if no address is
+            provided
+        operators: (list of str)
+            Operators searched, by name or code. If none are provided,
+            all of them are searched.
+        networks: (list of str)
+            Networks answered. When provided, the closest tower of every
+            operator that provides all of them is searched. Operators
+            without any such tower are answered with every network
+            'false' and a null 'distance'.
 
         Return:
         -------
-        In the case of an error: (str) error description
-        In any other case: (dict) Operators and their coverage
+        In the case of an error: (fastapi.responses.JSONResponse) the
+        'error' description and its 'code', see error_response()
+        In any other case: Operators and their coverage, see respond():
+        (fastapi.Response) with the JSON bytes, as by default, or
+        (dict) if raw_responses is False (JG_RAW_RESPONSES=0)
+        """
+        requests_total.inc('coverage')
+        filters = APIManager.filters(operators, networks)
+        with stage_seconds.time('request'):
+            # Coordinates do not need the geocoder
+            if address is None and (lat is not None or lon is not None):
+                try:
+                    location = Coordinates(lat, lon)
+                except AttributeError as error:
+                    return APIManager.error_response(error)
+            else:
+                # Let the Locator handle the location
+                with stage_seconds.time('geocode'):
+                    location = await APIManager.locate(address)
+                if isinstance(location, AttributeError):
+                    return APIManager.error_response(location)
+
+            # Only search the towers if the answer is not cached
+            cached = APIManager.cached_coverage(location, *filters)
+            if cached is not None:
+                return cached
+
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                executor, APIManager.compute_coverage, location, filters)
+
+    @staticmethod
+    def filters(operators=None, networks=None):
+        """
+        Get the filters of a search, as the options of the cache keys
+
+        Parameters:
+        -----------
+        operators: (list of str)
+            Operators searched, by name or code
+        networks: (list of str)
+            Networks the towers must provide
+
+        Return:
+        -------
+        tuple: empty if nothing is filtered, otherwise the operators and
+        the networks
+        """
+        if not operators and not networks:
+            return ()
+        operators = None if not operators else tuple(
+            int(op) if op.isdigit() else op for op in operators)
+        networks = None if not networks else tuple(networks)
+        return operators, networks
+
+    @staticmethod
+    def location_coverage(location, filters=()):
         """
-        # Let the Locator handle the location
+        Get the coverage of the towers closest to a location
+
+        Parameters:
+        -----------
+        location: (utils.Coordinates)
+            A location already checked
+
+        [OPTIONALS]
+        filters: (tuple)
+            Operators and networks searched, given by filters()
+
+        Return:
+        -------
+        In the case of an error: (fastapi.responses.JSONResponse) see
+        error_response()
+        In any other case: (fastapi.Response or dict) Operators and
+        their coverage, see respond()
+        """
+        cached = APIManager.cached_coverage(location, *filters)
+        if cached is not None:
+            return cached
+        return APIManager.compute_coverage(location, filters)
+
+    @staticmethod
+    def compute_coverage(location, filters=()):
+        """
+        Same as location_coverage() without looking at the cache first
+        """
+        operators, networks = filters or (None, None)
+        location = APIManager.snapped(location)
+
+        # Let the TowerManager handle the context for the location
         try:
-            location = Locator(address)
+            tower_mgr = TowerManager(
+                location, networks=networks and list(networks),
+                operators=operators and list(operators),
+                required_networks=networks and list(networks))
         except AttributeError as error:
-            return error.args[0]
+            return APIManager.error_response(error)
 
-        # Let the TowerManager handle the context for the location
+        # Let the TowerManager get the coverage for the location, and
+        # keep the answer for the next calls around the location
+        result = tower_mgr.location_coverage_result()
+        content = result.to_json()
+        coverage_cache.set(tower_mgr.tower_store, coverage_cache.key(
+            location.latitude, location.longitude, *filters), content)
+        return APIManager.respond(content, result.to_dict)
+
+    @staticmethod
+    def compute_nearby_coverage(location, k, radius, filters=()):
+        """
+        Get the coverage of the towers nearby a location, see
+        TowerManager.location_nearby_coverage()
+        """
+        operators, networks = filters or (None, None)
+        location = APIManager.snapped(location)
         try:
-            tower_mgr = TowerManager(location)
+            tower_mgr = TowerManager(
+                location, networks=networks and list(networks),
+                operators=operators and list(operators),
+                required_networks=networks and list(networks))
+            tower_mgr.location_nearby_coverage(k=k, radius=radius)
         except AttributeError as error:
-            return error.args[0]
+            return APIManager.error_response(error)
+
+        content = json.dumps(tower_mgr.nearby_coverage).encode()
+        coverage_cache.set(tower_mgr.tower_store, coverage_cache.key(
+            location.latitude, location.longitude, 'nearby', k, radius,
+            *filters), content)
+        return APIManager.respond(content,
+                                  lambda: tower_mgr.nearby_coverage)
+
+    @staticmethod
+    def snapped(location):
+        """
+        Get the location of the cache key of a location, so that the
+        answer of a key does not depend on which of its locations was
+        asked first
+
+        Return:
+        -------
+        utils.Coordinates: the snapped location
+        """
+        snapped = Coordinates.__new__(Coordinates)
+        snapped.latitude, snapped.longitude = coverage_cache.snap(
+            location.latitude, location.longitude)
+        return snapped
 
-        # Let the TowerManager get the coverage for the location
-        tower_mgr.location_coverage()
+    @staticmethod
+    def cached_coverage(location, *options):
+        """
+        Look for the coverage of a location in the cache
+
+        Parameters:
+        -----------
+        location: (utils.Coordinates)
+            A location already checked
+        options: (hashable)
+            Anything else the coverage depends on
 
-        return tower_mgr.towers_coverage
+        Return:
+        -------
+        None if it is not cached, the answer of respond() otherwise
+        """
+        # Nothing is cached while the store is warming, and the event
+        # loop must not wait for it
+        if not tower_store_ready():
+            return None
+        content = coverage_cache.get(get_tower_store(), coverage_cache.key(
+            location.latitude, location.longitude, *options))
+        return None if content is None else APIManager.respond(content)
+
+    @staticmethod
+    def respond(content, coverage=None):
+        """
+        Get the answer for a coverage serialised into JSON
+
+        Parameters:
+        -----------
+        content: (bytes)
+            The coverage serialised into JSON
+
+        [OPTIONALS]
+        coverage: (function)
+            Function giving the coverage as a dict, to avoid decoding
+            the JSON when it is at hand
+
+        Return:
+        -------
+        If raw_responses: (fastapi.Response) the JSON bytes
+        In any other case: (dict) Operators and their coverage
+        """
+        if APIManager.raw_responses:
+            return Response(content, media_type='application/json')
+        if coverage is not None:
+            return coverage()
+        return json.loads(content)
+
+    @staticmethod
+    @app.get("/JG-papernest-API/nearby")
+    async def get_nearby_towers_coverage(
+            address=None, lat: Optional[float] = None,
+            lon: Optional[float] = None, k: Optional[int] = None,
+            radius: Optional[float] = None,
+            operators: Annotated[Optional[List[str]], Query()] = None,
+            networks: Annotated[Optional[List[str]], Query()] = None):
+        """
+        Function for the nearby API. Same as get_towers_coverage(), but
+        looks at the k nearest towers of every operator, or at all of
+        them within a radius, instead of only the closest one
+
+        Parameters:
+        -----------
+        Address, lat, lon, operators, networks: same as
+        get_towers_coverage()
+        k: (int)
+            Maximum number of towers of every operator
+        radius: (float)
+            Maximum distance to the towers, in metres
+
+        Return:
+        -------
+        In the case of an error: (fastapi.responses.JSONResponse) see
+        error_response()
+        In any other case: Operators with the coverage of any of their
+        nearby towers and the list of those 'towers', as a
+        (fastapi.Response) or a (dict), same as get_towers_coverage()
+        """
+        requests_total.inc('nearby')
+        filters = APIManager.filters(operators, networks)
+        with stage_seconds.time('nearby_request'):
+            if address is None and (lat is not None or lon is not None):
+                try:
+                    location = Coordinates(lat, lon)
+                except AttributeError as error:
+                    return APIManager.error_response(error)
+            else:
+                with stage_seconds.time('geocode'):
+                    location = await APIManager.locate(address)
+                if isinstance(location, AttributeError):
+                    return APIManager.error_response(location)
+
+            cached = APIManager.cached_coverage(location, 'nearby', k, radius,
+                                                *filters)
+            if cached is not None:
+                return cached
+
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                executor, APIManager.compute_nearby_coverage, location, k,
+                radius, filters)
+
+    @staticmethod
+    @app.post("/JG-papernest-API/batch")
+    async def get_batch_towers_coverage(batch: BatchRequest):
+        """
+        Function for the batch API. Receives many addresses or
+        coordinates, geocodes every different address only once and
+        finds the closest towers of all of them in a single query
+
+        Parameters:
+        -----------
+        batch: (BatchRequest)
+            Items to get the coverage from
+
+        Return:
+        -------
+        In the case of too many items: (fastapi.responses.JSONResponse)
+        the 'error' description and its 'code', with a 413 status
+        In any other case: (dict) 'results' with, for every item and in
+        the same order, a dict with its 'coverage' or the 'error' it
+        raised
+        """
+        requests_total.inc('batch')
+        if len(batch.items) > max_batch_items:
+            return APIManager.error_response(LocationError(
+                "Sorry, a batch can not have more than {} items".format(
+                    max_batch_items), status=413, code='batch_too_large'))
+        results = [None] * len(batch.items)
+
+        # Group the items with the same address to geocode them once,
+        # items with coordinates do not need it
+        addresses = dict()
+        for i, item in enumerate(batch.items):
+            if item.address is None \
+                    and (item.lat is not None or item.lon is not None):
+                try:
+                    results[i] = Coordinates(item.lat, item.lon)
+                except AttributeError as error:
+                    results[i] = APIManager.error(error)
+            else:
+                key = None if item.address is None \
+                    else GeocodeCache.normalise(item.address)
+                addresses.setdefault(key, []).append(i)
+
+        with stage_seconds.time('batch_geocode'):
+            located = await asyncio.gather(*[
+                APIManager.locate(batch.items[items[0]].address)
+                for items in addresses.values()])
+        for items, location in zip(addresses.values(), located):
+            if isinstance(location, AttributeError):
+                location = APIManager.error(location)
+            for i in items:
+                results[i] = location
+
+        # Closest towers of all the located items at once
+        valid = [i for i, result in enumerate(results)
+                 if not isinstance(result, str)]
+        loop = asyncio.get_running_loop()
+        with stage_seconds.time('batch_coverage'):
+            coverages = await loop.run_in_executor(
+                executor, TowerManager.batch_coverage,
+                [results[i] for i in valid])
+        for i, coverage in zip(valid, coverages):
+            results[i] = coverage
+
+        return {'results': [{'error': result} if isinstance(result, str)
+                            else {'coverage': result}
+                            for result in results]}
+
+    @staticmethod
+    async def locate(address):
+        """
+        Locate an address without raising
+
+        Return:
+        -------
+        In the case of an error: (AttributeError) the error, a
+        LocationError with a 503 status if the geocoder failed
+        In any other case: (utils.Locator) the location
+        """
+        try:
+            return await Locator.locate(address)
+        except AttributeError as error:
+            return error
+        except Exception:
+            return LocationError(
+                "Sorry, we were not able to look for your address right "
+                "now, please try again later", status=503,
+                code='geocoder_unavailable')
+
+    @staticmethod
+    def error(error):
+        """
+        Count an error and get the description to answer with
+
+        Parameters:
+        -----------
+        error: (AttributeError)
+            The error raised
+
+        Return:
+        -------
+        str: error description
+        """
+        errors_total.inc(error.args[0])
+        return error.args[0]
+
+    @staticmethod
+    def error_response(error):
+        """
+        Count an error and get the answer for it, with the HTTP status
+        of the error, 400 for the ones that do not give one
+
+        Parameters:
+        -----------
+        error: (AttributeError)
+            The error raised
+
+        Return:
+        -------
+        fastapi.responses.JSONResponse: the 'error' description and its
+        'code'
+        """
+        return JSONResponse(
+            {'error': APIManager.error(error),
+             'code': getattr(error, 'code', 'invalid_request')},
+            status_code=getattr(error, 'status', 400))
+
+    @staticmethod
+    @app.get("/health/live")
+    def get_liveness():
+        """
+        Liveness check: the process answers
+        """
+        return {'status': 'alive'}
+
+    @staticmethod
+    @app.get("/health/ready")
+    def get_readiness():
+        """
+        Readiness check: the towers are loaded and indexed, so requests
+        are answered without waiting. Answers 503 until then, with the
+        status 'failed' if the warm up raised.
+        """
+        if not tower_store_ready():
+            failed = warming is not None and warming.done() \
+                and not warming.cancelled() \
+                and warming.exception() is not None
+            return JSONResponse({'status': 'failed' if failed
+                                 else 'warming'}, status_code=503)
+        return {'status': 'ready'}
+
+    @staticmethod
+    @app.post("/admin/reload")
+    async def post_reload(force: bool = False,
+                          x_admin_token: Annotated[Optional[str],
+                                                   Header()] = None):
+        """
+        Reload the tower database if its file has changed, without
+        stopping the requests. Only allowed with the admin token. When
+        served by the workers of server.py, the reload is left to their
+        parent, which is sent a SIGHUP, so that every worker answers
+        from the same towers.
+
+        Parameters:
+        -----------
+        force: (bool)
+            If True, the file is loaded even if it has not changed
+        x_admin_token: (str)
+            The admin token, given in the X-Admin-Token header
+
+        Return:
+        -------
+        dict: 'status', 'reloaded' or 'unchanged', and the number of
+        'towers' of the database, or 'reloading' with a 202 status when
+        the reload is left to the parent of the workers
+        """
+        if admin_token is None or x_admin_token is None \
+                or not secrets.compare_digest(x_admin_token, admin_token):
+            return JSONResponse({'error': "Reload is not allowed!"},
+                                status_code=403)
+
+        server_pid = os.environ.get('JG_SERVER_PID')
+        if server_pid is not None and int(server_pid) != os.getpid():
+            os.kill(int(server_pid), signal.SIGHUP)
+            return JSONResponse({'status': 'reloading'}, status_code=202)
+
+        previous = get_tower_store()
+        loop = asyncio.get_running_loop()
+        try:
+            store = await loop.run_in_executor(
+                executor, lambda: reload_tower_store(force=force))
+        except Exception as error:
+            return JSONResponse({'error': "Reload failed: {}".format(error)},
+                                status_code=500)
+        return {'status': 'unchanged' if store is previous else 'reloaded',
+                'towers': len(store)}
+
+    @staticmethod
+    @app.get("/metrics")
+    def get_metrics():
+        """
+        Export the metrics of the process in the Prometheus text format
+        """
+        return PlainTextResponse(registry.render(),
+                                 media_type='text/plain; version=0.0.4')
@@ -0,0 +1,330 @@
+"""
+Benchmark of the coverage pipeline.
+
+Measures every stage of the pipeline (geocoding, closest towers search
+and coverage) with a stubbed geocoder, so no network is needed, over
+the bundled database or synthetic databases of any size. Each engine
+answering the closest towers is measured on the same locations, so
+they can be compared against each other and against a previous run.
+
+Launch it from the root of the repository:
+
+    python -m benchmarks.bench_coverage --rows 1000000 --output run.json
+    python -m benchmarks.bench_coverage --baseline run.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from math import sqrt
+from databases.datascripts import csv_name, operator_code
+from utils.Locator import CachedLocation, GeocodeCache, Locator
+from utils.TowerManager import TowerManager
+from utils.TowerStore import TowerStore
+
+
+class StubGeocoder:
+    """
+    Geocoder answering instantly with the coordinates it was given
+    """
+    def __init__(self, locations):
+        self.locations = locations
+
+    def geocode(self, address):
+        return self.locations[address]
+
+
+def synthetic_database(rows, seed=0):
+    """
+    Create a database of random towers over France, with the operators
+    and networks of the real one
+
+    Parameters:
+    -----------
+    rows: (int)
+        Number of towers
+    seed: (int)
+        Seed of the random generator
+
+    Return:
+    -------
+    pandas.DataFrame: the database
+    """
+    generator = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Operateur': generator.choice(list(operator_code), rows),
+        'Latitude': generator.uniform(42.3, 51.0, rows),
+        'Longitude': generator.uniform(-4.5, 8.2, rows),
+        '2G': generator.integers(0, 2, rows),
+        '3G': generator.integers(0, 2, rows),
+        '4G': generator.integers(0, 2, rows)})
+
+
+def legacy_closest_towers(database, latitude, longitude):
+    """
+    Closest towers as they were searched before the index: the
+    database is reduced to a box around the location, widened until
+    every operator is in it, and then scanned row by row.
+    """
+    area = 1
+    while True:
+        reduced = database.loc[(database['Latitude'] > latitude - area)
+                               & (database['Latitude'] < latitude + area)
+                               & (database['Longitude'] > longitude - area)
+                               & (database['Longitude'] < longitude + area)]
+        if len(set(reduced['Operateur'])) >= 4:
+            break
+        area += 1
+
+    minimums = {op: (100.0, 0) for op in set(reduced['Operateur'])}
+    for index, row in reduced.iterrows():
+        dist = sqrt((latitude - row['Latitude']) ** 2
+                    + (longitude - row['Longitude']) ** 2)
+        if dist < minimums[int(row['Operateur'])][0]:
+            minimums[int(row['Operateur'])] = (dist, index)
+    return minimums
+
+
+def measure(function, arguments, repeat=1, memory_calls=50):
+    """
+    Call a function once per argument and measure it. Memory is traced
+    in a second pass over a few calls, as tracing slows down the calls:
+    the peak of the whole pass and the memory allocated by every call
+    on top of what it started with.
+
+    Parameters:
+    -----------
+    function: (function)
+        Function to measure
+    arguments: (list)
+        Argument of every call
+    repeat: (int)
+        Number of items handled by each call, to compute the throughput
+    memory_calls: (int)
+        Number of calls of the memory pass
+
+    Return:
+    -------
+    dict: latency percentiles in milliseconds, throughput in items
+    per second, peak memory in MB and memory allocated per call in KB
+    """
+    latencies = []
+    start = time.perf_counter()
+    for argument in arguments:
+        call = time.perf_counter()
+        function(argument)
+        latencies.append(time.perf_counter() - call)
+    total = time.perf_counter() - start
+
+    peak, allocated = 0, []
+    tracemalloc.start()
+    for argument in arguments[:memory_calls]:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        function(argument)
+        _, call_peak = tracemalloc.get_traced_memory()
+        peak = max(peak, call_peak)
+        allocated.append(call_peak - before)
+    tracemalloc.stop()
+
+    latencies = np.array(latencies) * 1000
+    return {'calls': len(arguments),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            'throughput': len(arguments) * repeat / total,
+            'peak_mb': peak / 1024 / 1024,
+            'alloc_kb': float(np.mean(allocated)) / 1024 if allocated
+            else 0.0}
+
+
+def run(store, locations, legacy_calls, batch_size):
+    """
+    Measure every stage and engine over a set of locations
+
+    Return:
+    -------
+    dict: stage name as key and the result of measure() as value
+    """
+    results = dict()
+    points = [Locator.__new__(Locator) for _ in locations]
+    for point, (latitude, longitude) in zip(points, locations):
+        point.set_location(CachedLocation(latitude, longitude))
+
+    # Geocoding, with the cache missing and hitting
+    addresses = {'{} rue de Paris'.format(i): CachedLocation(*location)
+                 for i, location in enumerate(locations)}
+    geocoder = StubGeocoder(addresses)
+    cache = GeocodeCache(maxsize=len(addresses))
+    results['locator_miss'] = measure(
+        lambda address: Locator(address, geocoder=geocoder, cache=cache),
+        list(addresses))
+    results['locator_hit'] = measure(
+        lambda address: Locator(address, geocoder=geocoder, cache=cache),
+        list(addresses))
+
+    # Engines finding the closest towers
+    database = store.database
+    results['legacy_closest_towers'] = measure(
+        lambda point: legacy_closest_towers(database, point.latitude,
+                                            point.longitude),
+        points[:legacy_calls], memory_calls=1)
+    store.index
+    results['index_closest_towers'] = measure(
+        lambda point: store.index.closest_towers(point.latitude,
+                                                 point.longitude),
+        points)
+    if store.grid is not None:
+        # The grid alone does not answer every operator: its share of
+        # the searches is reported with it, and the operators it misses
+        # are searched with the index as the TowerManager does
+        grid = store.grid
+        operators = len(store.index.trees)
+        answered = [grid.closest_towers(point.latitude, point.longitude)
+                    for point in points]
+        results['grid_closest_towers'] = measure(
+            lambda point: grid.closest_towers(point.latitude,
+                                              point.longitude), points)
+        results['grid_closest_towers']['hit_rate'] = sum(
+            len(closest or ()) for closest in answered) \
+            / (operators * len(points))
+
+        def grid_with_fallback(point):
+            closest = grid.closest_towers(point.latitude,
+                                          point.longitude) or dict()
+            missing = [op for op in store.index.trees if op not in closest]
+            if missing:
+                closest.update(store.index.closest_towers(
+                    point.latitude, point.longitude, operators=missing))
+            return closest
+
+        results['grid_with_fallback'] = measure(grid_with_fallback, points)
+    batches = [points[i:i + batch_size]
+               for i in range(0, len(points), batch_size)]
+    results['batch_closest_towers'] = measure(
+        lambda batch: store.index.closest_towers_many(
+            np.array([point.latitude for point in batch]),
+            np.array([point.longitude for point in batch])),
+        batches, repeat=batch_size)
+
+    # Stages of the TowerManager
+    def manager(point):
+        tower_mgr = TowerManager(point, database=database)
+        tower_mgr.tower_store = store
+        return tower_mgr
+
+    results['reduced_database'] = measure(
+        lambda point: manager(point).reduced_database(),
+        points[:legacy_calls], memory_calls=1)
+    results['locate_closest_towers'] = measure(
+        lambda point: manager(point).locate_closest_towers(), points)
+    located = []
+    for point in points:
+        tower_mgr = manager(point)
+        tower_mgr.locate_closest_towers()
+        located.append(tower_mgr)
+    results['find_towers_coverage'] = measure(
+        lambda tower_mgr: tower_mgr.find_towers_coverage(), located)
+    results['location_coverage'] = measure(
+        lambda point: manager(point).location_coverage(), points)
+
+    # Answer of the API, through the dicts or straight from the arrays
+    def coverage_dicts(point):
+        tower_mgr = manager(point)
+        tower_mgr.location_coverage()
+        return json.dumps(tower_mgr.towers_coverage).encode()
+
+    results['answer_dicts'] = measure(coverage_dicts, points)
+    results['answer_result'] = measure(
+        lambda point: manager(point).location_coverage_result()
+        .to_json(), points)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare the p50 latency of every stage against a previous run
+
+    Return:
+    -------
+    list of str: description of the stages that got slower
+    """
+    regressions = []
+    for stage, result in results.items():
+        if stage not in baseline:
+            continue
+        before = baseline[stage]['p50_ms']
+        if result['p50_ms'] > before * (1 + tolerance):
+            regressions.append("{}: {:.4f} ms -> {:.4f} ms".format(
+                stage, before, result['p50_ms']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=None,
+                        help="towers of a synthetic database, instead of "
+                             "the bundled one")
+    parser.add_argument('--locations', type=int, default=2000,
+                        help="random locations measured")
+    parser.add_argument('--legacy-calls', type=int, default=20,
+                        help="locations measured with the slow stages")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="file to write the results to")
+    parser.add_argument('--baseline',
+                        help="results of a previous run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="slowdown allowed against the baseline")
+    args = parser.parse_args(argv)
+
+    if args.rows is None:
+        path = os.path.join(os.getcwd(), 'databases', csv_name)
+        store = TowerStore.from_csv(path)
+    else:
+        store = TowerStore.from_data_frame(
+            synthetic_database(args.rows, seed=args.seed))
+
+    # Grid of the bundled database, only if it has been built
+    if store.grid is None and args.rows is None:
+        print("No coverage grid found, build it with "
+              "databases.datascripts.build_coverage_grid()")
+
+    generator = np.random.default_rng(args.seed)
+    locations = list(zip(generator.uniform(42.3, 51.0, args.locations),
+                         generator.uniform(-4.5, 8.2, args.locations)))
+    results = run(store, locations, args.legacy_calls, args.batch_size)
+
+    print("{} towers, {} locations".format(len(store), len(locations)))
+    print("{:<24}{:>10}{:>10}{:>10}{:>14}{:>10}{:>12}{:>10}".format(
+        'stage', 'p50 ms', 'p95 ms', 'p99 ms', 'items/s', 'peak MB',
+        'KB/call', 'hit rate'))
+    for stage, result in results.items():
+        hit_rate = '{:.1%}'.format(result['hit_rate']) \
+            if 'hit_rate' in result else ''
+        print("{:<24}{:>10.4f}{:>10.4f}{:>10.4f}{:>14.0f}{:>10.2f}"
+              "{:>12.1f}{:>10}".format(
+                  stage, result['p50_ms'], result['p95_ms'],
+                  result['p99_ms'], result['throughput'],
+                  result['peak_mb'], result['alloc_kb'], hit_rate))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,294 @@
+"""
+Coverage of a file of addresses or coordinates, without the API.
+
+The input is a csv file with a header, or a JSONL file (one JSON object
+per line), whose records have an address or the latitude and longitude
+of a location. It is read by chunks: the addresses of a chunk are
+geocoded by a pool of threads, each different address only once, and
+the closest towers of all its locations are searched with a single
+query to the index. The results are appended to the output as JSONL,
+in the order of the input, and a checkpoint is written after every
+chunk, so the memory used does not depend on the size of the input and
+an interrupted run can be resumed.
+
+Launch it from the root of the repository:
+
+    python bulk_coverage.py customers.csv coverage.jsonl --workers 4
+    python bulk_coverage.py customers.csv coverage.jsonl --resume
+
+Every line of the output has the 'row' of the record in the input, its
+'id' if an id column is given, and its 'coverage' or the 'error' it
+raised.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from utils.Locator import GeocodeCache, Locator, Coordinates, set_geocoders
+from utils.TowerManager import TowerManager
+from utils.TowerStore import load_tower_store
+
+
+def read_records(path, delimiter=','):
+    """
+    Read the records of a csv or JSONL file one by one
+
+    Parameters:
+    -----------
+    path: (str)
+        Path to the file. Files ending with .jsonl or .json are read as
+        JSONL, any other one as csv.
+
+    [OPTIONALS]
+    delimiter: (str)
+        Delimiter of the csv file
+
+    Return:
+    -------
+    generator of dict: the records
+    """
+    with open(path, newline='', encoding='utf-8') as file:
+        if path.endswith(('.jsonl', '.json')):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(file, delimiter=delimiter)
+
+
+def chunks(records, size):
+    """
+    Group records into lists of a given size
+    """
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def value(record, column):
+    """
+    Get a value of a record, None if it is missing or empty
+    """
+    content = record.get(column)
+    if content is None or (isinstance(content, str) and not content.strip()):
+        return None
+    return content
+
+
+def locate(address):
+    """
+    Locate an address
+
+    Return:
+    -------
+    In the case of an error: (str) error description
+    In any other case: (utils.Locator) the location
+    """
+    try:
+        return Locator(address)
+    except AttributeError as error:
+        return error.args[0]
+    except Exception:
+        return ("Sorry, we were not able to look for your address right "
+                "now, please try again later")
+
+
+def process_chunk(records, pool, columns, networks=None,
+                  metric='haversine'):
+    """
+    Get the coverage of a chunk of records
+
+    Parameters:
+    -----------
+    records: (list of dict)
+        Records of the chunk
+    pool: (concurrent.futures.ThreadPoolExecutor)
+        Threads geocoding the addresses
+    columns: (dict)
+        Name of the 'address', 'lat', 'lon' and 'id' columns
+
+    [OPTIONALS]
+    networks, metric: same as TowerManager.batch_coverage()
+
+    Return:
+    -------
+    list of dict: result of every record, in the same order
+    """
+    results = [None] * len(records)
+
+    # Group the records with the same address to geocode them once,
+    # records with coordinates do not need it
+    addresses = dict()
+    for i, record in enumerate(records):
+        address = value(record, columns['address'])
+        lat = value(record, columns['lat'])
+        lon = value(record, columns['lon'])
+        if address is None and (lat is not None or lon is not None):
+            try:
+                results[i] = Coordinates(lat, lon)
+            except AttributeError as error:
+                results[i] = error.args[0]
+        else:
+            key = None if address is None else GeocodeCache.normalise(
+                str(address))
+            addresses.setdefault(key, (address, []))[1].append(i)
+
+    located = pool.map(locate, [address for address, _ in
+                                addresses.values()])
+    for (_, items), location in zip(addresses.values(), located):
+        for i in items:
+            results[i] = location
+
+    # Closest towers of all the located records at once
+    valid = [i for i, result in enumerate(results)
+             if not isinstance(result, str)]
+    coverages = TowerManager.batch_coverage([results[i] for i in valid],
+                                            networks=networks, metric=metric)
+    for i, coverage in zip(valid, coverages):
+        results[i] = coverage
+
+    return [{'error': result} if isinstance(result, str)
+            else {'coverage': result} for result in results]
+
+
+def read_checkpoint(path):
+    """
+    Read a checkpoint
+
+    Return:
+    -------
+    dict: 'rows' of the input done and 'offset' of the output where
+    their results end, or None if there is no checkpoint
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def write_checkpoint(path, rows, offset):
+    """
+    Write a checkpoint, replacing the previous one at once
+    """
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as file:
+        json.dump({'rows': rows, 'offset': offset}, file)
+    os.replace(temporary, path)
+
+
+def run(input_path, output_path, chunk_size=1000, workers=4, resume=False,
+        columns=None, delimiter=',', networks=None, metric='haversine'):
+    """
+    Write the coverage of every record of a file
+
+    Parameters:
+    -----------
+    input_path: (str)
+        Path to the csv or JSONL file with the records
+    output_path: (str)
+        Path to the JSONL file with the results
+
+    [OPTIONALS]
+    chunk_size: (int)
+        Number of records processed at once
+    workers: (int)
+        Number of threads geocoding the addresses
+    resume: (bool)
+        If True, start after the records of the checkpoint of the
+        output, otherwise start from the beginning
+    columns: (dict)
+        Name of the 'address', 'lat', 'lon' and 'id' columns
+    delimiter: (str)
+        Delimiter of the csv file
+    networks, metric: same as TowerManager.batch_coverage()
+
+    Return:
+    -------
+    int: number of records of the input done
+    """
+    columns = dict({'address': 'address', 'lat': 'lat', 'lon': 'lon',
+                    'id': None}, **(columns or {}))
+    checkpoint_path = output_path + '.checkpoint'
+
+    # Drop the results written after the checkpoint, they are computed
+    # again
+    done, offset = 0, 0
+    checkpoint = read_checkpoint(checkpoint_path) if resume else None
+    if checkpoint is not None:
+        done, offset = checkpoint['rows'], checkpoint['offset']
+    with open(output_path, 'ab') as output:
+        output.truncate(offset)
+
+    records = islice(read_records(input_path, delimiter=delimiter), done,
+                     None)
+    with ThreadPoolExecutor(max_workers=workers) as pool, \
+            open(output_path, 'ab') as output:
+        for chunk in chunks(records, chunk_size):
+            results = process_chunk(chunk, pool, columns,
+                                    networks=networks, metric=metric)
+            lines = []
+            for i, (record, result) in enumerate(zip(chunk, results)):
+                line = {'row': done + i}
+                if columns['id'] is not None:
+                    line['id'] = record.get(columns['id'])
+                line.update(result)
+                lines.append(json.dumps(line) + '\n')
+            output.write(''.join(lines).encode())
+            output.flush()
+            os.fsync(output.fileno())
+
+            done += len(chunk)
+            write_checkpoint(checkpoint_path, done, output.tell())
+    return done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('input', help="csv or JSONL file with the records")
+    parser.add_argument('output', help="JSONL file with the results")
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=4,
+                        help="threads geocoding the addresses")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue from the checkpoint of the output")
+    parser.add_argument('--address-column', default='address')
+    parser.add_argument('--lat-column', default='lat')
+    parser.add_argument('--lon-column', default='lon')
+    parser.add_argument('--id-column', default=None,
+                        help="column copied into the results")
+    parser.add_argument('--delimiter', default=',')
+    parser.add_argument('--networks', nargs='+', default=None)
+    parser.add_argument('--metric', default='haversine')
+    parser.add_argument('--database', default=None,
+                        help="tower database, instead of the default one")
+    parser.add_argument('--addresses', default=None,
+                        help="BAN-style address file to geocode locally")
+    parser.add_argument('--no-fallback', action='store_true',
+                        help="do not send the addresses missing from the "
+                             "address file to Nominatim")
+    args = parser.parse_args(argv)
+
+    if args.database is not None:
+        load_tower_store(args.database)
+    if args.addresses is not None:
+        set_geocoders(args.addresses, fallback=not args.no_fallback)
+    done = run(args.input, args.output, chunk_size=args.chunk_size,
+               workers=args.workers, resume=args.resume,
+               columns={'address': args.address_column,
+                        'lat': args.lat_column, 'lon': args.lon_column,
+                        'id': args.id_column},
+               delimiter=args.delimiter, networks=args.networks,
+               metric=args.metric)
+    print("{} records done, results in {}".format(done, args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""
+Coverage maps of a whole region, without the API.
+
+The region is split into cells of the given resolution and the closest
+tower of every operator is searched for the centre of every cell, a
+band of cells at a time and on every core. The map is written into a
+compressed NumPy file (.npz) with, for every operator, the networks
+covering each cell and the distance to its closest tower, and
+optionally into one PNG image per operator and network.
+
+Launch it from the root of the repository:
+
+    python coverage_map.py france.npz --resolution 1000 --png maps
+    python coverage_map.py paris.npz --bounds 48.8 48.92 2.22 2.47 \
+        --resolution 100
+
+Load the map with utils.CoverageMap.CoverageMap.load().
+"""
+import argparse
+import os
+import sys
+
+from databases.datascripts import operator_code
+from utils.CoverageMap import CoverageMap
+from utils.TowerStore import get_tower_store, load_tower_store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('output', help="npz file with the map")
+    parser.add_argument('--bounds', type=float, nargs=4, default=None,
+                        metavar=('LAT_MIN', 'LAT_MAX', 'LON_MIN', 'LON_MAX'),
+                        help="region of the map, metropolitan France if "
+                             "not given")
+    parser.add_argument('--resolution', type=float, default=1000,
+                        help="size of the cells, in metres")
+    parser.add_argument('--png', default=None,
+                        help="directory where a PNG image of every "
+                             "operator and network is written")
+    parser.add_argument('--workers', type=int, default=-1,
+                        help="threads searching the closest towers, all "
+                             "the cores if not given")
+    parser.add_argument('--database', default=None,
+                        help="tower database, instead of the default one")
+    args = parser.parse_args(argv)
+
+    store = get_tower_store() if args.database is None \
+        else load_tower_store(args.database)
+    coverage_map = CoverageMap.build(store, bounds=args.bounds,
+                                     resolution=args.resolution,
+                                     workers=args.workers)
+    coverage_map.save(args.output)
+
+    if args.png is not None:
+        os.makedirs(args.png, exist_ok=True)
+        for operator in coverage_map.operators:
+            name = operator_code.get(operator, str(operator))
+            for network in coverage_map.networks:
+                coverage_map.save_png(
+                    os.path.join(args.png, '{}_{}.png'.format(name,
+                                                              network)),
+                    operator, network)
+
+    print("Map of {} x {} cells written in {}".format(
+        coverage_map.flags.shape[1], coverage_map.flags.shape[2],
+        args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,25 @@
+import os
+import time
+import numpy as np
 import pandas as pd
 import pyproj
 
+from functools import lru_cache
+
 # Name that will be used by default in all the classes when a database
 # is needed but not provided. CSV MUST be in the same folder as this
 # file
 csv_name = '2018_01_Sites_mobiles_2G_3G_4G_France_metropolitaine_L93.csv'
 
+# Name of the compact binary version of the csv. It is built by
+# build_binary_database() and, when it is newer than the csv, it is
+# loaded instead. It MUST be in the same folder as the csv
+binary_name = '2018_01_Sites_mobiles_2G_3G_4G_France_metropolitaine_L93.bin'
+
+# Name of the precomputed coverage grid of the csv. It is built by
+# build_coverage_grid() and MUST be in the same folder as the csv
+grid_name = 'coverage_grid.bin'
+
 # Operators that are coded. When a decoder is needed, this dict is
 # imported
 operator_code = {20801: 'Orange',
@@ -14,6 +28,24 @@ operator_code = {20801: 'Orange',
                  20820: 'Bouygue'}
 
 
+def valid_rows(data_frame):
+    """
+    Get which rows of a database have numeric 'x' and 'y' values
+
+    Parameters:
+    -----------
+    data_frame: (pandas.DataFrame)
+        Database with 'x' and 'y' columns
+
+    Return:
+    -------
+    pandas.Series: boolean mask of the valid rows
+    """
+    x = pd.to_numeric(data_frame['x'], errors='coerce')
+    y = pd.to_numeric(data_frame['y'], errors='coerce')
+    return np.isfinite(x) & np.isfinite(y)
+
+
 def remove_na_values(path):
     """
     Function created to clean and rewrite the database in case at some
@@ -26,31 +58,38 @@ def remove_na_values(path):
         CSV path file
     """
     data_frame = pd.read_csv(path, sep=';')
-    index_to_delete = []
-    for index, row in data_frame.iterrows():
-        try:
-            int(row['x'])
-            int(row['y'])
-        except ValueError:
-            index_to_delete.append(index)
+    data_frame = data_frame[valid_rows(data_frame)]
+    data_frame.to_csv(path, index=False, sep=';')
 
-    for i in index_to_delete:
-        data_frame = data_frame.drop(index=i)
 
-    data_frame.to_csv(path, index=False, sep=';')
+@lru_cache(maxsize=None)
+def lambert93_transformer():
+    """
+    Transformer from lambert93 to gps coordinates. It is only created
+    once, as it is expensive to build.
+
+    Return:
+    -------
+    pyproj.Transformer: transformer taking (x, y) and giving
+    (longitude, latitude)
+    """
+    lambert = pyproj.Proj('+proj=lcc +lat_1=49 +lat_2=44 +lat_0=46.5 +lon_0=3 +x_0=700000 +y_0=6600000 +ellps=GRS80 +towgs84=0,0,0,0,0,0,0 +units=m +no_defs')
+    wgs84 = pyproj.Proj('+proj=longlat +ellps=WGS84 +datum=WGS84 +no_defs')
+    return pyproj.Transformer.from_proj(lambert, wgs84, always_xy=True)
 
 
 def lamber93_to_gps(x, y):
     """
     Function provided by the question.
     Given two variables regarding a location in lamber93 format, returns
-    that same location in gps latitude and longitude
+    that same location in gps latitude and longitude. Whole arrays of
+    locations can be given at once.
 
     Parameters:
     -----------
-    x: (int)
+    x: (int or numpy.ndarray)
         first value regarding the location
-    y: (int)
+    y: (int or numpy.ndarray)
         second value regarding the location
 
     Return:
@@ -59,9 +98,7 @@ def lamber93_to_gps(x, y):
         first value on the tuple is the latitude
         second value on the tuple is the longitude
     """
-    lambert = pyproj.Proj('+proj=lcc +lat_1=49 +lat_2=44 +lat_0=46.5 +lon_0=3 +x_0=700000 +y_0=6600000 +ellps=GRS80 +towgs84=0,0,0,0,0,0,0 +units=m +no_defs')
-    wgs84 = pyproj.Proj('+proj=longlat +ellps=WGS84 +datum=WGS84 +no_defs')
-    long, lat = pyproj.transform(lambert, wgs84, x, y)
+    long, lat = lambert93_transformer().transform(x, y)
     return lat, long
 
 
@@ -77,10 +114,115 @@ def lamber93_to_gps_on_file(path):
         Path to the csv file
     """
     data_frame = pd.read_csv(path, sep=';')
-    for index, row in data_frame.iterrows():
-        lat, long = lamber93_to_gps(row['x'], row['y'])
-        data_frame.at[index, 'x'] = lat
-        data_frame.at[index, 'y'] = long
-
-    data_frame.rename(columns={'x': 'Latitude', 'y': 'Longitude'}, inplace=True)
+    data_frame = convert_chunk(data_frame)
     data_frame.to_csv(path, index=False, sep=';')
+
+
+def convert_chunk(data_frame):
+    """
+    Change the 'x' and 'y' columns of a database into 'Latitude' and
+    'Longitude', all the rows at once
+
+    Parameters:
+    -----------
+    data_frame: (pandas.DataFrame)
+        Database with valid 'x' and 'y' columns
+
+    Return:
+    -------
+    pandas.DataFrame: the database with gps coordinates
+    """
+    lat, long = lamber93_to_gps(data_frame['x'].to_numpy(dtype=float),
+                                data_frame['y'].to_numpy(dtype=float))
+    data_frame = data_frame.assign(x=lat, y=long)
+    return data_frame.rename(columns={'x': 'Latitude', 'y': 'Longitude'})
+
+
+def rebuild_database(source, path, chunksize=100000, report=print):
+    """
+    Function that builds the database used by the API from a source
+    csv in lamber93 format (such as the ones published by ARCEP). The
+    source is read by chunks, so its size does not matter, and every
+    chunk is cleaned and converted at once. The database is only
+    replaced when it is complete.
+
+    Parameters:
+    -----------
+    source: (str)
+        Path to the source csv file, with 'x' and 'y' columns
+    path: (str)
+        Path of the csv file to write. It can be the source itself.
+    chunksize: (int)
+        Number of rows read at once
+    report: (function)
+        Function receiving the progress messages, None to be silent
+
+    Return:
+    -------
+    int: number of rows written
+    """
+    start = time.perf_counter()
+    read = written = 0
+    temporary = path + '.tmp'
+    try:
+        with open(temporary, 'w', newline='') as file:
+            first_chunk = True
+            for chunk in pd.read_csv(source, sep=';', chunksize=chunksize):
+                read += len(chunk)
+                chunk = convert_chunk(chunk[valid_rows(chunk)])
+                chunk.to_csv(file, index=False, sep=';', header=first_chunk)
+                first_chunk = False
+                written += len(chunk)
+                if report is not None:
+                    report("{} rows read, {} kept ({:.2f} s)".format(
+                        read, written, time.perf_counter() - start))
+        os.replace(temporary, path)
+    except BaseException:
+        # Do not leave a partial database behind
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+    if report is not None:
+        report("Database rebuilt: {} of {} rows in {:.2f} s".format(
+            written, read, time.perf_counter() - start))
+    return written
+
+
+def build_binary_database(path):
+    """
+    Function that writes the compact binary version of a csv file next
+    to it, where the TowerStore will look for it.
+
+    Parameters:
+    -----------
+    path: (str)
+        Path to the csv file
+    """
+    # Imported here as utils depends on the names of this file
+    from utils.TowerStore import TowerStore
+
+    store = TowerStore.from_csv(path)
+    store.save_binary(os.path.join(os.path.dirname(path), binary_name))
+
+
+def build_coverage_grid(path, cell_size=500):
+    """
+    Function that precomputes the towers that can be the closest ones
+    of every cell of a grid over France and writes them next to the csv
+    file, where the TowerManager will look for them.
+
+    Parameters:
+    -----------
+    path: (str)
+        Path to the csv or binary file
+    cell_size: (float)
+        Size of the side of a cell, in metres
+    """
+    # Imported here as utils depends on the names of this file
+    from utils.CoverageGrid import CoverageGrid
+    from utils.TowerStore import TowerStore
+
+    grid = CoverageGrid.build(TowerStore.from_file(path),
+                              cell_size=cell_size)
+    grid.save(os.path.join(os.path.dirname(path), grid_name))
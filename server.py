@@ -0,0 +1,212 @@
+"""
+Production entry point of the API.
+
+The towers are loaded and indexed once in the parent process, which
+then forks the workers. Every worker starts warm and shares the memory
+of the towers, the index and the coverage grid with the others, so the
+memory of each worker does not grow with their number. The parent
+restarts the workers that die and stops all of them on SIGTERM or
+SIGINT.
+
+On SIGHUP, the parent reloads the tower database and, if it has
+changed, forks a warm worker sharing the new towers for every worker
+and then sends SIGTERM to all the old ones at once. The new workers
+accept connections on the shared socket right away, while the old
+ones finish the requests they have started. The parent also watches
+the database file every JG_RELOAD_INTERVAL seconds (60 by default, 0
+to never) and reloads it the same way once it has changed, and POST
+/admin/reload sends it a SIGHUP. The workers never reload the database
+on their own, so they always share the same towers.
+
+Launch it from the root of the repository:
+
+    python server.py --workers 4 --host 0.0.0.0 --port 8000
+
+Health checks, answered by every worker:
+
+    /health/live    the worker answers
+    /health/ready   the towers are loaded and indexed (503 until then)
+
+Where fork is not available, a single process is served.
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import uvicorn
+
+import APIManager as api
+
+from APIManager import app, warm_up
+from utils.TowerStore import get_tower_store, reload_tower_store, \
+    tower_store_update
+
+
+def preload():
+    """
+    Load and index the towers and create the geocoders in the current
+    process, and move every object created so far out of the garbage
+    collector so that forked workers do not copy their pages when it
+    runs
+    """
+    warm_up()
+    gc.freeze()
+
+
+def bind(host, port, backlog=2048):
+    """
+    Create the listening socket shared by the workers
+
+    Return:
+    -------
+    socket.socket: the bound socket
+    """
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def serve(sock, log_level):
+    """
+    Serve the API on a socket until the process is stopped
+    """
+    config = uvicorn.Config(app, log_level=log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def spawn(sock, log_level):
+    """
+    Fork a worker serving the API
+
+    Return:
+    -------
+    int: pid of the worker
+    """
+    pid = os.fork()
+    if pid == 0:
+        # The worker handles its signals as uvicorn does
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, signal.SIG_IGN)
+        try:
+            serve(sock, log_level)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--log-level', default='info')
+    args = parser.parse_args(argv)
+
+    preload()
+    sock = bind(args.host, args.port)
+    if args.workers <= 1 or not hasattr(os, 'fork'):
+        serve(sock, args.log_level)
+        return 0
+
+    # The workers leave the reloads of the database to the parent
+    interval = api.reload_interval
+    api.reload_interval = 0
+    os.environ['JG_SERVER_PID'] = str(os.getpid())
+
+    workers = {spawn(sock, args.log_level) for _ in range(args.workers)}
+    retired = set()
+    stopping = False
+    reloading = False
+    previous_update = None
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        for pid in workers | retired:
+            os.kill(pid, signal.SIGTERM)
+
+    def reload(signum, frame):
+        # Signals received during a reload run their handlers in the
+        # middle of it
+        nonlocal reloading
+        if stopping or reloading:
+            return
+        reloading = True
+        try:
+            roll()
+        finally:
+            reloading = False
+
+    def roll():
+        # The previous towers reference each other, so they can only be
+        # freed by the garbage collector once they are not frozen
+        gc.unfreeze()
+        gc.collect()
+
+        # The old workers keep answering until the new towers are warm
+        previous = get_tower_store()
+        try:
+            store = reload_tower_store()
+        except Exception as error:
+            print("Reload failed: {}".format(error), file=sys.stderr)
+            gc.freeze()
+            return
+        gc.collect()
+        gc.freeze()
+        if store is previous:
+            return
+
+        # Fork all the new workers, then stop all the old ones, which
+        # exit once their requests are answered
+        old = set(workers)
+        workers.clear()
+        workers.update(spawn(sock, args.log_level) for _ in old)
+        retired.update(old)
+        for pid in old:
+            os.kill(pid, signal.SIGTERM)
+
+    def watch(signum, frame):
+        # A file is only loaded once it has not changed for an interval,
+        # so that it is not read while it is being written
+        nonlocal previous_update
+        if reloading:
+            return
+        update = tower_store_update()
+        if update is not None and update == previous_update:
+            reload(signum, frame)
+            update = None
+        previous_update = update
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, reload)
+    if interval > 0:
+        signal.signal(signal.SIGALRM, watch)
+        signal.setitimer(signal.ITIMER_REAL, interval, interval)
+
+    # Replace the workers that die until the server is stopped
+    while workers or retired:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        if pid in retired:
+            retired.discard(pid)
+            continue
+        workers.discard(pid)
+        if not stopping:
+            workers.add(spawn(sock, args.log_level))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+import unittest
+
+from utils.CoverageCache import CoverageCache
+
+
+class TestCoverageCache(unittest.TestCase):
+    """
+    Test for the CoverageCache class.
+    """
+    def setUp(self):
+        super().setUp()
+        self.store = object()
+        self.cache = CoverageCache(precision=3, maxsize=2)
+
+    # Test for the methods
+    def test_snapped_key(self):
+        self.assertEqual(self.cache.key(47.31137, 5.03926),
+                         self.cache.key(47.31141, 5.03931))
+        self.assertNotEqual(self.cache.key(47.31137, 5.03926),
+                            self.cache.key(47.31237, 5.03926))
+        self.assertNotEqual(self.cache.key(47.31137, 5.03926, ('4G',)),
+                            self.cache.key(47.31137, 5.03926, ('3G',)))
+
+    def test_get_and_set(self):
+        key = self.cache.key(47.31137, 5.03926)
+        self.assertIsNone(self.cache.get(self.store, key))
+        self.cache.set(self.store, key, b'{}')
+        self.assertEqual(self.cache.get(self.store, key), b'{}')
+        self.assertEqual(self.cache.stats(),
+                         {'hits': 1, 'misses': 1, 'size': 1,
+                          'bytes': 2 + CoverageCache.entry_overhead})
+
+    def test_lru(self):
+        self.cache.set(self.store, ('a',), b'1')
+        self.cache.set(self.store, ('b',), b'2')
+        self.cache.get(self.store, ('a',))
+        self.cache.set(self.store, ('c',), b'3')
+        self.assertEqual(list(self.cache.entries), [('a',), ('c',)])
+
+    def test_max_bytes(self):
+        cache = CoverageCache(max_bytes=2 * CoverageCache.entry_overhead
+                              + 10)
+        cache.set(self.store, ('a',), b'12345')
+        cache.set(self.store, ('b',), b'12345')
+        cache.set(self.store, ('c',), b'1')
+        self.assertEqual(list(cache.entries), [('b',), ('c',)])
+        self.assertLessEqual(cache.size, cache.max_bytes)
+
+    def test_new_store(self):
+        self.cache.set(self.store, ('a',), b'1')
+        self.assertIsNone(self.cache.get(object(), ('a',)))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_invalidate(self):
+        self.cache.set(self.store, ('a',), b'1')
+        self.cache.invalidate()
+        self.assertIsNone(self.cache.get(self.store, ('a',)))
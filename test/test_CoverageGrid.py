@@ -0,0 +1,137 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+
+from databases.datascripts import csv_name
+from utils.CoverageGrid import CoverageGrid
+from utils.Locator import Coordinates
+from utils.TowerManager import TowerManager
+from utils.TowerStore import TowerStore
+
+
+class TestCoverageGrid(unittest.TestCase):
+    """
+    Test for the CoverageGrid class.
+    """
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Small database and big cells, for speed purposes
+        db_dir = os.path.join(os.getcwd(), 'databases')
+        cls.store = TowerStore.from_csv(os.path.join(db_dir, csv_name))
+        cls.grid = CoverageGrid.build(cls.store, cell_size=5000)
+
+    # Test for the methods
+    def test_closest_towers(self):
+        # When the grid knows the answer, it is the one of the index
+        generator = np.random.default_rng(0)
+        latitudes = generator.uniform(41.6, 51.0, 500)
+        longitudes = generator.uniform(-4.6, 9.4, 500)
+        found = 0
+        for latitude, longitude in zip(latitudes, longitudes):
+            closest = self.grid.closest_towers(latitude, longitude)
+            if closest is None:
+                continue
+            expected = self.store.index.closest_towers(latitude, longitude)
+            for operator, tower in closest.items():
+                self.assertEqual(tower, expected[operator])
+            found += len(closest)
+        self.assertGreater(found, 0)
+
+    def test_binary_store(self):
+        # The grid of the csv answers for its binary version, whose
+        # coordinates are rounded to float32
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'towers.bin')
+            self.store.save_binary(path)
+            store = TowerStore.from_binary(path)
+            grid = CoverageGrid(self.grid.header, self.grid.cells,
+                                self.grid.sets, self.grid.blocks,
+                                store=store)
+            self.assertTrue(grid.matches(store))
+
+            generator = np.random.default_rng(1)
+            for latitude, longitude in zip(
+                    generator.uniform(41.6, 51.0, 500),
+                    generator.uniform(-4.6, 9.4, 500)):
+                closest = grid.closest_towers(latitude, longitude)
+                if closest is None:
+                    continue
+                expected = store.index.closest_towers(latitude, longitude)
+                for operator, (_, row) in closest.items():
+                    self.assertEqual(row, expected[operator][1])
+
+    def test_city_hit_rate(self):
+        # Centre of Toulouse, where the towers are the densest: the
+        # cells are split and nearly every operator is answered by the
+        # grid
+        grid = CoverageGrid.build(self.store,
+                                  bounds=(43.55, 43.66, 1.37, 1.51))
+        generator = np.random.default_rng(2)
+        hits, searches = 0, 0
+        for latitude, longitude in zip(generator.uniform(43.58, 43.63, 500),
+                                       generator.uniform(1.40, 1.48, 500)):
+            closest = grid.closest_towers(latitude, longitude)
+            expected = self.store.index.closest_towers(latitude, longitude)
+            for operator, found in closest.items():
+                self.assertEqual(found, expected[operator])
+            hits += len(closest)
+            searches += len(expected)
+        self.assertGreater(hits / searches, 0.95)
+
+    def test_unknown_operators(self):
+        # Without subcells and with a single tower per cell, most
+        # operators are unknown and searched with the index instead
+        grid = CoverageGrid.build(self.store,
+                                  bounds=(43.55, 43.66, 1.37, 1.51),
+                                  candidates=1, subdivisions=1)
+        self.assertLess(len(grid.closest_towers(43.6, 1.44)),
+                        len(grid.operators))
+
+        database = self.store.database
+        try:
+            self.store._grid, self.store._grid_loaded = grid, True
+            for latitude, longitude in [(43.6, 1.44), (43.61, 1.45)]:
+                tower_mgr = TowerManager(Coordinates(latitude, longitude),
+                                         database=database)
+                tower_mgr.tower_store = self.store
+                tower_mgr.locate_closest_towers()
+                expected = self.store.index.closest_towers(latitude,
+                                                           longitude)
+                self.assertEqual(tower_mgr.tower_rows,
+                                 {op: row for op, (_, row)
+                                  in expected.items()})
+        finally:
+            self.store._grid, self.store._grid_loaded = None, False
+
+    def test_out_of_grid(self):
+        self.assertIsNone(self.grid.closest_towers(40.0, 2.0))
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'grid.bin')
+            self.grid.save(path)
+            loaded = CoverageGrid.load(path, store=self.store)
+            np.testing.assert_array_equal(loaded.cells, self.grid.cells)
+            np.testing.assert_array_equal(loaded.sets, self.grid.sets)
+            np.testing.assert_array_equal(loaded.blocks, self.grid.blocks)
+            self.assertEqual(loaded.operators, self.grid.operators)
+            self.assertTrue(loaded.matches(self.store))
+
+    def test_load_wrong_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'grid.bin')
+            with open(path, 'wb') as file:
+                file.write(b'NotAGrid' * 20)
+            with self.assertRaises(AttributeError) as context:
+                CoverageGrid.load(path)
+
+        self.assertEqual("File is not a coverage grid!",
+                         context.exception.args[0])
+
+    def test_grid_of_other_towers(self):
+        database = pd.DataFrame({'Operateur': [20801], 'Latitude': [48.0],
+                                 'Longitude': [2.0], '4G': [1]})
+        self.assertFalse(self.grid.matches(TowerStore.from_data_frame(database)))
@@ -0,0 +1,95 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+
+from databases.datascripts import csv_name
+from utils.CoverageMap import CoverageMap
+from utils.TowerStore import TowerStore
+
+
+class TestCoverageMap(unittest.TestCase):
+    """
+    Test for the CoverageMap class.
+    """
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Small region, for speed purposes
+        db_dir = os.path.join(os.getcwd(), 'databases')
+        cls.store = TowerStore.from_csv(os.path.join(db_dir, csv_name))
+        cls.map = CoverageMap.build(cls.store,
+                                    bounds=(48.8, 48.92, 2.22, 2.47),
+                                    resolution=500, chunk=7)
+
+    # Test for the methods
+    def test_build(self):
+        self.assertEqual(self.map.operators, sorted(self.store.index.trees))
+        self.assertEqual(self.map.networks, list(self.store.networks))
+        self.assertEqual(self.map.flags.shape, self.map.distances.shape)
+
+        # Every cell has the closest tower of the index
+        i, j = 5, 11
+        latitude = self.map.bounds[0] + (i + 0.5) * self.map.lat_step
+        longitude = self.map.bounds[2] + (j + 0.5) * self.map.ln_step
+        closest = self.store.index.closest_towers(latitude, longitude)
+        for position, operator in enumerate(self.map.operators):
+            dist, row = closest[operator]
+            self.assertAlmostEqual(
+                float(self.map.distances[position, i, j]), dist, delta=0.5)
+            for net in self.map.networks:
+                self.assertEqual(
+                    self.map.covered(operator, net)[i, j],
+                    self.store.networks[net][row] == 1)
+
+    def test_towers_at_same_location(self):
+        # Around Toulouse, towers of the same operator share masts: the
+        # cells get the flags of the tower the API answers, where the
+        # KD-tree alone gives one of them arbitrarily
+        coverage_map = CoverageMap.build(self.store,
+                                         bounds=(43.5, 43.7, 1.3, 1.6),
+                                         resolution=1000)
+        for i in range(coverage_map.flags.shape[1]):
+            latitude = coverage_map.bounds[0] \
+                + (i + 0.5) * coverage_map.lat_step
+            for j in range(coverage_map.flags.shape[2]):
+                longitude = coverage_map.bounds[2] \
+                    + (j + 0.5) * coverage_map.ln_step
+                closest = self.store.index.closest_towers(latitude,
+                                                          longitude)
+                for operator, (_, row) in closest.items():
+                    for net in coverage_map.networks:
+                        self.assertEqual(
+                            coverage_map.covered(operator, net)[i, j],
+                            self.store.networks[net][row] == 1)
+
+    def test_empty_region(self):
+        with self.assertRaises(AttributeError) as context:
+            CoverageMap.build(self.store, bounds=(48.9, 48.8, 2.2, 2.4))
+        self.assertEqual(context.exception.args[0],
+                         "The region of the map is empty!")
+
+    def test_covered_wrong_network(self):
+        with self.assertRaises(AttributeError):
+            self.map.covered(self.map.operators[0], '5G')
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'map.npz')
+            self.map.save(path)
+            loaded = CoverageMap.load(path)
+            np.testing.assert_array_equal(loaded.flags, self.map.flags)
+            np.testing.assert_array_equal(loaded.distances,
+                                          self.map.distances)
+            self.assertEqual(loaded.operators, self.map.operators)
+            self.assertEqual(loaded.networks, self.map.networks)
+            self.assertEqual(loaded.bounds, self.map.bounds)
+
+    def test_save_png(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'map.png')
+            self.map.save_png(path, self.map.operators[0], '4G')
+            with open(path, 'rb') as file:
+                content = file.read()
+            self.assertTrue(content.startswith(b'\x89PNG\r\n\x1a\n'))
+            self.assertTrue(content.endswith(b'IEND\xaeB`\x82'))
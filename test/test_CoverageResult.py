@@ -0,0 +1,50 @@
+import json
+import unittest
+import numpy as np
+
+from utils.CoverageResult import CoverageResult
+
+
+class TestCoverageResult(unittest.TestCase):
+    """
+    Test for the CoverageResult class.
+    """
+    def setUp(self):
+        super().setUp()
+        self.result = CoverageResult(['Orange', 'Free'], [331.94, 12.0],
+                                     ['2G', '4G'], [(1, 1), (0, 1)])
+
+    # Test for the methods
+    def test_to_dict(self):
+        self.assertEqual(self.result.to_dict(), {
+            'Orange': {'2G': 'true', '4G': 'true', 'distance': 331.9},
+            'Free': {'2G': 'false', '4G': 'true', 'distance': 12.0}})
+
+    def test_to_json(self):
+        # Same bytes as serialising the dict
+        self.assertEqual(self.result.to_json(),
+                         json.dumps(self.result.to_dict()).encode())
+
+    def test_no_networks(self):
+        result = CoverageResult(['SFR'], [5.0], [], [()])
+        self.assertEqual(result.to_json(),
+                         json.dumps(result.to_dict()).encode())
+
+    def test_numpy_distances(self):
+        result = CoverageResult(['Orange', 'Free'],
+                                [np.float64(331.94), np.float64(np.inf)],
+                                ['4G'], [(1,), (0,)])
+        self.assertEqual(json.loads(result.to_json()), {
+            'Orange': {'4G': 'true', 'distance': 331.9},
+            'Free': {'4G': 'false', 'distance': None}})
+        self.assertIs(type(result.to_dict()['Orange']['distance']), float)
+
+    def test_float_flags(self):
+        result = CoverageResult(['Orange'], [5.0], ['2G', '4G'],
+                                [(1.0, 0.0)])
+        self.assertEqual(result.to_dict(), {
+            'Orange': {'2G': 'true', '4G': 'false', 'distance': 5.0}})
+
+    def test_slots(self):
+        with self.assertRaises(AttributeError):
+            self.result.other = 1
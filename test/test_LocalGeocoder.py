@@ -0,0 +1,164 @@
+import asyncio
+import os
+import unittest
+import pandas as pd
+
+from utils.LocalGeocoder import LocalGeocoder
+from utils import Locator as locator_module
+from utils.Locator import AsyncFallbackGeocoder, CachedLocation, \
+    FallbackGeocoder, GeocodeCache, Locator, get_geocoder, set_geocoders
+
+
+class FakeGeocoder:
+    """
+    Geocoder answering the same location for every address
+    """
+    def __init__(self, location):
+        self.location = location
+        self.calls = []
+
+    def geocode(self, address):
+        self.calls.append(address)
+        return self.location
+
+
+class FakeAsyncGeocoder(FakeGeocoder):
+    """
+    Same as the FakeGeocoder, asynchronous
+    """
+    async def geocode(self, address):
+        return FakeGeocoder.geocode(self, address)
+
+
+class TestLocalGeocoder(unittest.TestCase):
+    """
+    Test for the LocalGeocoder class.
+    """
+    def setUp(self):
+        super().setUp()
+        db_dir = os.path.join(os.getcwd(), 'databases')
+        self.geocoder = LocalGeocoder.from_csv(
+            os.path.join(db_dir, 'adresses_test.csv'))
+
+    # Test for the methods
+    def test_normalise(self):
+        self.assertEqual(LocalGeocoder.normalise("Rue de la Durantière"),
+                         "rue durantiere")
+        self.assertEqual(LocalGeocoder.normalise("Av. Georges-Pompidou"),
+                         "avenue georges pompidou")
+        self.assertEqual(LocalGeocoder.normalise("Pl. St Michel"),
+                         "place saint michel")
+
+    def test_geocode(self):
+        self.assertEqual(
+            self.geocoder.geocode("47 Rue Charles Dumont, Dijon"),
+            CachedLocation(47.311375, 5.039264))
+        self.assertEqual(
+            self.geocoder.geocode("47 rue de la durantiere 44100 NANTES"),
+            CachedLocation(47.213287, -1.601594))
+        self.assertEqual(
+            self.geocoder.geocode("1 Av Georges Pompidou Toulouse"),
+            CachedLocation(43.612066, 1.457871))
+        self.assertEqual(
+            self.geocoder.geocode("10 pl. St-Michel, 75005 Paris, France"),
+            CachedLocation(48.8532, 2.3439))
+
+    def test_geocode_postcode_only(self):
+        self.assertEqual(self.geocoder.geocode("45 Rue Charles Dumont 21000"),
+                         CachedLocation(47.31132, 5.03921))
+
+    def test_geocode_closest_number(self):
+        # Unknown numbers get the closest known one of the street
+        self.assertEqual(self.geocoder.geocode("50 Rue Charles Dumont Dijon"),
+                         CachedLocation(47.31147, 5.039301))
+        self.assertEqual(self.geocoder.geocode("3bis Av Georges Pompidou "
+                                               "Toulouse"),
+                         CachedLocation(43.61215, 1.45799))
+
+    def test_geocode_repetition(self):
+        geocoder = LocalGeocoder.from_data_frame(pd.DataFrame({
+            'number': [3, 3, 3], 'repetition': ['ter', None, 'bis'],
+            'street': ['Rue Haute'] * 3, 'postcode': ['21000'] * 3,
+            'city': ['Dijon'] * 3, 'latitude': [47.1, 47.2, 47.3],
+            'longitude': [5.1, 5.2, 5.3]}))
+        self.assertEqual(geocoder.geocode("3 bis rue Haute Dijon"),
+                         CachedLocation(47.3, 5.3))
+        self.assertEqual(geocoder.geocode("3TER rue Haute Dijon"),
+                         CachedLocation(47.1, 5.1))
+        self.assertEqual(geocoder.geocode("3 rue Haute Dijon"),
+                         CachedLocation(47.2, 5.2))
+
+    def test_geocode_same_city_name(self):
+        # Saint-Denis (Seine-Saint-Denis) and Saint-Denis (La Réunion),
+        # with two spellings of the same street in the first one
+        geocoder = LocalGeocoder.from_data_frame(pd.DataFrame({
+            'number': [2, 4, 2],
+            'street': ['Rue de la République', 'Rue de la Republique',
+                       'Rue de la République'],
+            'postcode': ['93200', '93200', '97400'],
+            'insee': ['93066', '93066', '97411'],
+            'city': ['Saint-Denis'] * 3, 'latitude': [48.93, 48.94, -20.88],
+            'longitude': [2.35, 2.36, 55.45]}))
+        self.assertEqual(len(geocoder), 3)
+        self.assertEqual(
+            geocoder.geocode("2 rue de la Republique 93200 Saint-Denis"),
+            CachedLocation(48.93, 2.35))
+        self.assertEqual(
+            geocoder.geocode("4 rue de la République 93200 Saint-Denis"),
+            CachedLocation(48.94, 2.36))
+        self.assertEqual(
+            geocoder.geocode("rue de la Republique 93200 Saint-Denis"),
+            CachedLocation(48.935, 2.355))
+        self.assertEqual(
+            geocoder.geocode("2 rue de la Republique 97400 St Denis"),
+            CachedLocation(-20.88, 55.45))
+
+        # Without the postcode, the commune is not known
+        self.assertIsNone(
+            geocoder.geocode("2 rue de la Republique Saint-Denis"))
+
+    def test_geocode_street_misspelled(self):
+        self.assertEqual(self.geocoder.geocode("47 Charles Dumont Dijon"),
+                         CachedLocation(47.311375, 5.039264))
+
+    def test_geocode_not_found(self):
+        self.assertIsNone(self.geocoder.geocode("1 Rue Inconnue Dijon"))
+        self.assertIsNone(self.geocoder.geocode("47 Rue Charles Dumont "
+                                                "Lyon"))
+        self.assertIsNone(self.geocoder.geocode(""))
+
+    def test_fallback(self):
+        nominatim = FakeGeocoder(CachedLocation(45.76, 4.83))
+        geocoder = FallbackGeocoder(self.geocoder, nominatim)
+        cache = GeocodeCache()
+
+        # Only the addresses missing locally are sent to the fallback
+        Locator("47 Rue Charles Dumont, Dijon", geocoder=geocoder,
+                cache=cache)
+        self.assertEqual(nominatim.calls, [])
+        location = Locator("1 Rue de la République, Lyon",
+                           geocoder=geocoder, cache=cache)
+        self.assertEqual(nominatim.calls, ["1 Rue de la République, Lyon"])
+        self.assertEqual(location.latitude, 45.76)
+
+    def test_async_fallback(self):
+        nominatim = FakeAsyncGeocoder(None)
+        geocoder = AsyncFallbackGeocoder(self.geocoder, nominatim)
+        location = asyncio.run(geocoder.geocode("47 Rue Charles Dumont, "
+                                                "Dijon"))
+        self.assertEqual(location, CachedLocation(47.311375, 5.039264))
+        self.assertIsNone(asyncio.run(geocoder.geocode("Nowhere")))
+        self.assertEqual(nominatim.calls, ["Nowhere"])
+
+    def test_set_geocoders(self):
+        previous = (locator_module._geocoder, locator_module.async_geocoder)
+        try:
+            set_geocoders(os.path.join(os.getcwd(), 'databases',
+                                       'adresses_test.csv'), fallback=False)
+            geocoder = get_geocoder()
+            self.assertIsInstance(geocoder.primary, LocalGeocoder)
+            self.assertIsNone(geocoder.fallback)
+            self.assertEqual(len(geocoder.primary), 7)
+        finally:
+            locator_module._geocoder, locator_module.async_geocoder = \
+                previous
@@ -1,6 +1,44 @@
+import asyncio
+import os
+import tempfile
 import unittest
 
-from utils.Locator import Locator
+from utils.Locator import CachedLocation, Coordinates, GeocodeCache, \
+    LocationError, Locator
+
+
+class FakeGeocoder:
+    """
+    Local stand-in for Nominatim that counts the calls it receives
+    """
+    def __init__(self, locations):
+        self.locations = locations
+        self.calls = 0
+
+    def geocode(self, address):
+        self.calls += 1
+        return self.locations.get(address)
+
+
+class FakeAsyncGeocoder(FakeGeocoder):
+    """
+    Asynchronous version of the FakeGeocoder, slow enough to receive
+    concurrent calls
+    """
+    async def geocode(self, address):
+        await asyncio.sleep(0.01)
+        return super().geocode(address)
+
+
+class FakeClock:
+    """
+    Clock that only moves when told to
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
 
 
 class TestLocator(unittest.TestCase):
@@ -27,6 +65,21 @@ class TestLocator(unittest.TestCase):
             "another closer one",
             context.exception.args[0])
 
+    def test_init_invalid_address(self):
+        # Rejected without calling the geocoder
+        geocoder = FakeGeocoder({})
+        for address in ["", " , ", "12345 678", "xkcdqwrtz Paris",
+                        "a" * 201, "Calle Mayor 1, Madrid, Espana"]:
+            with self.assertRaises(LocationError) as context:
+                Locator(address, geocoder=geocoder, cache=GeocodeCache())
+            self.assertIn(context.exception.status, (400, 422))
+        self.assertEqual(geocoder.calls, 0)
+
+        # Errors of the checks are still AttributeError
+        with self.assertRaises(AttributeError) as context:
+            Locator("Calle Mayor 1, Madrid, Spain", geocoder=geocoder)
+        self.assertEqual(context.exception.code, 'out_of_france')
+
     def test_init_Out_of_France(self):
         address = "1 Av Diagonal Barcelona"
         with self.assertRaises(AttributeError) as context:
@@ -71,3 +124,167 @@ class TestLocator(unittest.TestCase):
         # longitude: 1.4577933548025355
         # The difference is around 10 meters.
 
+
+
+class TestCoordinates(unittest.TestCase):
+    """
+    Test for Coordinates class
+    """
+    def test_init_not_numbers(self):
+        for latitude, longitude in [(None, 2.0), ('a', 2.0),
+                                    (float('nan'), 2.0)]:
+            with self.assertRaises(AttributeError) as context:
+                Coordinates(latitude, longitude)
+
+            self.assertEqual(
+                "Sorry, the coordinates provided are not valid, check "
+                "the url!",
+                context.exception.args[0])
+
+    def test_init_Out_of_France(self):
+        with self.assertRaises(AttributeError) as context:
+            Coordinates(41.3870, 2.1700)
+
+        self.assertEqual(
+            "Sorry, your location must be in France to return a "
+            "precise result",
+            context.exception.args[0])
+
+    def test_value(self):
+        coordinates = Coordinates('47.3113753', 5.0392644)
+        self.assertEqual(coordinates.latitude, 47.3113753)
+        self.assertEqual(coordinates.longitude, 5.0392644)
+
+
+class TestGeocodeCache(unittest.TestCase):
+    """
+    Test for GeocodeCache class, without reaching the network
+    """
+    def setUp(self):
+        super().setUp()
+        self.geocoder = FakeGeocoder({
+            "47 Rue Charles Dumont, Dijon":
+                CachedLocation(47.3113753, 5.0392644),
+            "1 Av Diagonal Barcelona": CachedLocation(41.3870, 2.1700)})
+        self.clock = FakeClock()
+        self.cache = GeocodeCache(clock=self.clock)
+
+    def test_normalise(self):
+        self.assertEqual(
+            GeocodeCache.normalise("  47, Rue de la  Durantière NANTES "),
+            "47 rue de la durantiere nantes")
+
+    def test_locator_uses_cache(self):
+        for _ in range(3):
+            locator = Locator("47 Rue Charles Dumont, Dijon",
+                              geocoder=self.geocoder, cache=self.cache)
+        self.assertEqual(locator.latitude, 47.3113753)
+        self.assertEqual(locator.longitude, 5.0392644)
+        self.assertEqual(self.geocoder.calls, 1)
+        self.assertEqual(self.cache.stats(),
+                         {'hits': 2, 'misses': 1, 'size': 1})
+
+    def test_normalised_keys(self):
+        Locator("47 Rue Charles Dumont, Dijon", geocoder=self.geocoder,
+                cache=self.cache)
+        Locator("47 rue charles dumont dijon", geocoder=self.geocoder,
+                cache=self.cache)
+        self.assertEqual(self.geocoder.calls, 1)
+
+    def test_negative_cache(self):
+        for _ in range(2):
+            with self.assertRaises(AttributeError):
+                Locator("ThisIsNotAnAddress", geocoder=self.geocoder,
+                        cache=self.cache)
+        self.assertEqual(self.geocoder.calls, 1)
+
+        # Not found addresses expire sooner
+        self.clock.now += self.cache.negative_ttl + 1
+        with self.assertRaises(AttributeError):
+            Locator("ThisIsNotAnAddress", geocoder=self.geocoder,
+                    cache=self.cache)
+        self.assertEqual(self.geocoder.calls, 2)
+
+    def test_cached_out_of_france(self):
+        # Locations out of France are cached, but still rejected
+        for _ in range(2):
+            with self.assertRaises(AttributeError):
+                Locator("1 Av Diagonal Barcelona", geocoder=self.geocoder,
+                        cache=self.cache)
+        self.assertEqual(self.geocoder.calls, 1)
+
+    def test_ttl(self):
+        self.cache.geocode("47 Rue Charles Dumont, Dijon", self.geocoder)
+        self.clock.now += self.cache.ttl + 1
+        self.cache.geocode("47 Rue Charles Dumont, Dijon", self.geocoder)
+        self.assertEqual(self.geocoder.calls, 2)
+
+    def test_lru(self):
+        cache = GeocodeCache(maxsize=1, clock=self.clock)
+        cache.geocode("47 Rue Charles Dumont, Dijon", self.geocoder)
+        cache.geocode("1 Av Diagonal Barcelona", self.geocoder)
+        cache.geocode("47 Rue Charles Dumont, Dijon", self.geocoder)
+        self.assertEqual(self.geocoder.calls, 3)
+        self.assertEqual(cache.stats()['size'], 1)
+
+    def test_disk_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'geocodes.sqlite')
+            cache = GeocodeCache(path=path, clock=self.clock)
+            cache.geocode("47 Rue Charles Dumont, Dijon", self.geocoder)
+            cache.geocode("ThisIsNotAnAddress", self.geocoder)
+            cache.connection.close()
+
+            # A new cache, as after a restart, finds both addresses
+            cache = GeocodeCache(path=path, clock=self.clock)
+            location = cache.geocode("47 Rue Charles Dumont, Dijon",
+                                     self.geocoder)
+            self.assertIsNone(cache.geocode("ThisIsNotAnAddress",
+                                            self.geocoder))
+            cache.connection.close()
+
+        self.assertEqual(location, CachedLocation(47.3113753, 5.0392644))
+        self.assertEqual(self.geocoder.calls, 2)
+
+    def test_disk_cache_async(self):
+        geocoder = FakeAsyncGeocoder(self.geocoder.locations)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'geocodes.sqlite')
+            cache = GeocodeCache(path=path, clock=self.clock)
+            asyncio.run(cache.geocode_async("47 Rue Charles Dumont, Dijon",
+                                            geocoder))
+            cache.connection.close()
+
+            cache = GeocodeCache(path=path, clock=self.clock)
+            location = asyncio.run(cache.geocode_async(
+                "47 Rue Charles Dumont, Dijon", geocoder))
+            cache.connection.close()
+
+        self.assertEqual(location, CachedLocation(47.3113753, 5.0392644))
+        self.assertEqual(geocoder.calls, 1)
+
+    def test_locate_async(self):
+        geocoder = FakeAsyncGeocoder(self.geocoder.locations)
+
+        async def locate_many():
+            # Concurrent calls for the same address
+            return await asyncio.gather(*[
+                Locator.locate("47 Rue Charles Dumont, Dijon",
+                               geocoder=geocoder, cache=self.cache)
+                for _ in range(10)])
+
+        locators = asyncio.run(locate_many())
+        self.assertEqual(geocoder.calls, 1)
+        self.assertEqual({(loc.latitude, loc.longitude)
+                          for loc in locators},
+                         {(47.3113753, 5.0392644)})
+        self.assertEqual(self.cache.pending, {})
+
+    def test_locate_async_not_found(self):
+        geocoder = FakeAsyncGeocoder(self.geocoder.locations)
+        with self.assertRaises(AttributeError):
+            asyncio.run(Locator.locate("ThisIsNotAnAddress",
+                                       geocoder=geocoder, cache=self.cache))
+        with self.assertRaises(AttributeError):
+            asyncio.run(Locator.locate(None, geocoder=geocoder,
+                                       cache=self.cache))
@@ -0,0 +1,75 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from utils.Metrics import MetricsRegistry
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    Test for the metrics classes.
+    """
+    def setUp(self):
+        super().setUp()
+        self.registry = MetricsRegistry()
+
+    # Test for the methods
+    def test_counter(self):
+        counter = self.registry.counter('requests', "Requests",
+                                        label='endpoint')
+        counter.inc('coverage')
+        counter.inc('coverage')
+        counter.inc('batch', value=3)
+        self.assertEqual(counter.values, {'coverage': 2, 'batch': 3})
+
+    def test_counter_callback(self):
+        self.registry.counter('hits', "Hits", label='cache',
+                              callback=lambda: {'geocode': 5})
+        self.assertIn('hits{cache="geocode"} 5', self.registry.render())
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('seconds', "Seconds",
+                                            label='stage',
+                                            buckets=(0.1, 1.0))
+        histogram.observe(0.05, 'geocode')
+        histogram.observe(0.5, 'geocode')
+        histogram.observe(2.0, 'geocode')
+        with histogram.time('search'):
+            pass
+
+        lines = self.registry.render().splitlines()
+        self.assertIn('# TYPE seconds histogram', lines)
+        self.assertIn('seconds_bucket{stage="geocode",le="0.1"} 1', lines)
+        self.assertIn('seconds_bucket{stage="geocode",le="1.0"} 2', lines)
+        self.assertIn('seconds_bucket{stage="geocode",le="+Inf"} 3', lines)
+        self.assertIn('seconds_sum{stage="geocode"} 2.55', lines)
+        self.assertIn('seconds_count{stage="geocode"} 3', lines)
+        self.assertIn('seconds_count{stage="search"} 1', lines)
+
+    def test_escaped_labels(self):
+        counter = self.registry.counter('errors', "Errors", label='message')
+        counter.inc('Say "hi"\n')
+        self.assertIn('errors{message="Say \\"hi\\"\\n"} 1',
+                      self.registry.render())
+
+    def test_disabled(self):
+        registry = MetricsRegistry(enabled=False)
+        counter = registry.counter('requests', "Requests")
+        histogram = registry.histogram('seconds', "Seconds")
+        counter.inc()
+        histogram.observe(1.0)
+        with histogram.time():
+            pass
+        self.assertEqual(counter.values, {})
+        self.assertEqual(histogram.values, {})
+
+    def test_disabled_by_environment(self):
+        # The registry of the process reads JG_METRICS when imported
+        code = "from utils.Metrics import registry; print(registry.enabled)"
+        for value, expected in [('0', 'False'), ('1', 'True')]:
+            env = dict(os.environ, JG_METRICS=value,
+                       PYTHONPATH=os.path.join(os.getcwd(), '..'))
+            output = subprocess.run([sys.executable, '-c', code], env=env,
+                                    capture_output=True, text=True).stdout
+            self.assertEqual(output.strip(), expected)
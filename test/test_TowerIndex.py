@@ -0,0 +1,113 @@
+import os
+import unittest
+import numpy as np
+
+from databases.datascripts import csv_name
+from utils.TowerStore import TowerStore
+from utils.distances import haversine
+
+
+class TestTowerIndex(unittest.TestCase):
+    """
+    Test for the TowerIndex class.
+    """
+    def setUp(self):
+        super().setUp()
+        db_dir = os.path.join(os.getcwd(), '../databases')
+        self.store = TowerStore.from_csv(os.path.join(db_dir, csv_name))
+
+    def brute_force(self, latitude, longitude):
+        # Closest tower of every operator going through all the towers
+        dist = haversine(latitude, longitude,
+                         self.store.latitudes, self.store.longitudes)
+        closest = dict()
+        for operator in np.unique(self.store.operators):
+            rows = np.flatnonzero(self.store.operators == operator)
+            closest[int(operator)] = rows[np.argmin(dist[rows])]
+        return closest
+
+    # Test for the methods
+    def test_one_tree_per_operator(self):
+        self.assertEqual(set(self.store.index.trees),
+                         {20801, 20810, 20815, 20820})
+
+    def test_closest_towers(self):
+        # Compare the index against a full scan on random locations
+        # of France
+        generator = np.random.default_rng(0)
+        latitudes = generator.uniform(41.6, 51.0, 50)
+        longitudes = generator.uniform(-4.6, 9.4, 50)
+        for latitude, longitude in zip(latitudes, longitudes):
+            closest = self.store.index.closest_towers(latitude, longitude)
+            self.assertEqual(
+                {op: row for op, (_, row) in closest.items()},
+                self.brute_force(latitude, longitude))
+
+    def test_closest_towers_distance(self):
+        # Distances are given in metres
+        closest = self.store.index.closest_towers(47.3113753, 5.0392644)
+        for dist, row in closest.values():
+            self.assertAlmostEqual(
+                dist, haversine(47.3113753, 5.0392644,
+                                self.store.latitudes[row],
+                                self.store.longitudes[row]))
+            self.assertLess(dist, 5000)
+
+    def test_closest_towers_many(self):
+        # Many locations at once give the same towers as one by one
+        generator = np.random.default_rng(1)
+        latitudes = generator.uniform(41.6, 51.0, 50)
+        longitudes = generator.uniform(-4.6, 9.4, 50)
+        closest = self.store.index.closest_towers_many(latitudes,
+                                                       longitudes)
+        for i, (latitude, longitude) in enumerate(zip(latitudes,
+                                                      longitudes)):
+            single = self.store.index.closest_towers(latitude, longitude)
+            for operator, (dist, row) in single.items():
+                self.assertEqual(row, closest[operator][1][i])
+                self.assertAlmostEqual(dist, closest[operator][0][i])
+
+    def test_nearest_towers(self):
+        # The k nearest towers and the ones within a radius are the
+        # ones of a full scan
+        latitude, longitude = 48.8566, 2.3522
+        dist = haversine(latitude, longitude,
+                         self.store.latitudes, self.store.longitudes)
+        by_k = self.store.index.nearest_towers(latitude, longitude, k=5)
+        by_radius = self.store.index.nearest_towers(latitude, longitude,
+                                                    radius=1000)
+        for operator in self.store.index.trees:
+            rows = np.flatnonzero(self.store.operators == operator)
+            order = rows[np.lexsort((rows, dist[rows]))]
+            np.testing.assert_array_equal(by_k[operator][1], order[:5])
+            np.testing.assert_allclose(by_k[operator][0], dist[order[:5]])
+
+            within = order[dist[order] <= 1000]
+            np.testing.assert_array_equal(by_radius[operator][1], within)
+
+    def test_nearest_towers_k_and_radius(self):
+        nearest = self.store.index.nearest_towers(48.8566, 2.3522, k=2,
+                                                  radius=150)
+        for dist, rows in nearest.values():
+            self.assertLessEqual(len(rows), 2)
+            self.assertTrue((dist <= 150).all())
+
+    def test_closest_towers_filtered(self):
+        # Only the partition of the operator is searched, among the
+        # towers providing the networks
+        latitude, longitude = 47.3113753, 5.0392644
+        closest = self.store.index.closest_towers(
+            latitude, longitude, operators=[20815], networks=['4G'])
+        self.assertEqual(list(closest), [20815])
+
+        dist = haversine(latitude, longitude,
+                         self.store.latitudes, self.store.longitudes)
+        rows = np.flatnonzero((self.store.operators == 20815)
+                              & (self.store.networks['4G'] == 1))
+        self.assertEqual(closest[20815][1], rows[np.argmin(dist[rows])])
+
+    def test_closest_towers_no_partition(self):
+        # Free does not provide 2G anywhere
+        closest = self.store.index.closest_towers(
+            47.3113753, 5.0392644, operators=[20815], networks=['2G'])
+        self.assertEqual(closest, {})
@@ -5,8 +5,9 @@ import pandas as pd
 from unittest.mock import Mock
 
 from databases.datascripts import csv_name
+from utils import TowerStore as tower_store_module
 from utils.TowerManager import TowerManager
-from utils.Locator import Locator
+from utils.Locator import Coordinates, Locator
 
 
 class TestTowerManager(unittest.TestCase):
@@ -31,6 +32,14 @@ class TestTowerManager(unittest.TestCase):
             "The location provided is not a Locator!",
             context.exception.args[0])
 
+    def test_init_coordinates(self):
+        # Coordinates are accepted as a location
+        location = Coordinates(self.location.latitude,
+                               self.location.longitude)
+        tower_mgr = TowerManager(location, database=self.database)
+        tower_mgr.location_coverage()
+        self.assertEqual(tower_mgr.tower_indexes[20801], 57807)
+
     def test_init_false_database(self):
         database = Mock()
         database.columns = ['a', 'b', 'c']
@@ -60,7 +69,25 @@ class TestTowerManager(unittest.TestCase):
             "Provided networks are not in the database!",
             context.exception.args[0])
 
+    def test_init_not_found_metric(self):
+        with self.assertRaises(AttributeError) as context:
+            TowerManager(self.location, database=self.database,
+                         metric='NotAMetric')
+
+        self.assertEqual(
+            "Provided metric is not available!",
+            context.exception.args[0])
+
     # Test for the methods
+    def test_init_not_found_operators(self):
+        with self.assertRaises(AttributeError) as context:
+            TowerManager(self.location, database=self.database,
+                         operators=['NotAnOperator'])
+
+        self.assertEqual(
+            "Provided operators are not available!",
+            context.exception.args[0])
+
     def test_reduced_database(self):
         # Generate a tower manager
         tower_mgr = TowerManager(self.location, database=self.database)
@@ -117,13 +144,185 @@ class TestTowerManager(unittest.TestCase):
         # Get the towers coverage and the expected tower coverage
         tower_mgr.find_towers_coverage()
         expected_tower_coverage = {
-            'Orange': {'2G': 'true', '3G': 'true', '4G': 'true'},
-            'SFR': {'2G': 'true', '3G': 'true', '4G': 'true'},
-            'Bouygue': {'2G': 'true', '3G': 'true', '4G': 'true'},
-            'Free': {'2G': 'false', '3G': 'true', '4G': 'true'}
+            'Orange': {'2G': 'true', '3G': 'true', '4G': 'true',
+                       'distance': 331.9},
+            'SFR': {'2G': 'true', '3G': 'true', '4G': 'true',
+                    'distance': 333.6},
+            'Bouygue': {'2G': 'true', '3G': 'true', '4G': 'true',
+                        'distance': 473.9},
+            'Free': {'2G': 'false', '3G': 'true', '4G': 'true',
+                     'distance': 331.3}
         }
 
         # Check that the towers coverage and the expected towers
         # coverage are the same
         self.assertEqual(expected_tower_coverage,
                          tower_mgr.towers_coverage)
+
+    def test_nearby_coverage(self):
+        tower_mgr = TowerManager(self.location, database=self.database)
+        tower_mgr.location_nearby_coverage(k=3)
+
+        for operator, towers in tower_mgr.nearby_towers.items():
+            # The nearest tower is the closest one, then the next ones
+            self.assertEqual(len(towers), 3)
+            self.assertEqual(towers[0][0], {20801: 57807, 20810: 57808,
+                                            20820: 57771,
+                                            20815: 57805}[operator])
+            dist = [d for _, d in towers]
+            self.assertEqual(dist, sorted(dist))
+
+        # A network is covered if any nearby tower provides it
+        for coverage in tower_mgr.nearby_coverage.values():
+            self.assertEqual(len(coverage['towers']), 3)
+            for net in ['2G', '3G', '4G']:
+                self.assertEqual(
+                    coverage[net] == 'true',
+                    any(tower[net] == 'true'
+                        for tower in coverage['towers']))
+
+    def test_nearby_coverage_radius(self):
+        tower_mgr = TowerManager(self.location, database=self.database)
+        tower_mgr.location_nearby_coverage(radius=400)
+
+        # Every closest tower but the Bouygue one is within 400 metres
+        self.assertEqual(tower_mgr.nearby_coverage['Bouygue'],
+                         {'2G': 'false', '3G': 'false', '4G': 'false',
+                          'towers': []})
+        for name in ['Orange', 'SFR', 'Free']:
+            towers = tower_mgr.nearby_coverage[name]['towers']
+            self.assertGreater(len(towers), 0)
+            self.assertTrue(all(t['distance'] <= 400 for t in towers))
+
+    def test_nearby_wrong_parameters(self):
+        tower_mgr = TowerManager(self.location, database=self.database)
+        with self.assertRaises(AttributeError) as context:
+            tower_mgr.location_nearby_coverage()
+
+        self.assertEqual("Either k or radius must be provided!",
+                         context.exception.args[0])
+
+        with self.assertRaises(AttributeError) as context:
+            tower_mgr.location_nearby_coverage(radius=-1)
+
+        self.assertEqual("radius must be a positive distance in metres!",
+                         context.exception.args[0])
+
+    def test_filtered_coverage(self):
+        # Closest Orange and Free towers providing 3G and 4G
+        tower_mgr = TowerManager(self.location, database=self.database,
+                                 networks=['4G'], operators=['Orange', 20815],
+                                 required_networks=['3G', '4G'])
+        tower_mgr.location_coverage()
+        self.assertEqual(set(tower_mgr.towers_coverage), {'Orange', 'Free'})
+        for index in tower_mgr.tower_indexes.values():
+            self.assertEqual(self.database.at[index, '3G'], 1)
+            self.assertEqual(self.database.at[index, '4G'], 1)
+
+        # The reduced database stops growing once it has those towers
+        reduced_db = tower_mgr.reduced_database()
+        self.assertEqual(set(reduced_db['Operateur']) & {20801, 20815},
+                         {20801, 20815})
+
+    def test_coverage_result(self):
+        # Same coverage as the dicts, read from the arrays of the store
+        tower_mgr = TowerManager(self.location, database=self.database)
+        result = tower_mgr.location_coverage_result()
+        tower_mgr.find_towers_coverage()
+        self.assertEqual(result.to_dict(), tower_mgr.towers_coverage)
+
+    def test_shared_database_not_built(self):
+        # The searches do not need the DataFrame of the shared store
+        tower_mgr = TowerManager(self.location)
+        store = tower_mgr.tower_store
+        store._database = None
+        try:
+            tower_mgr.location_coverage()
+            self.assertIsNone(store._database)
+            self.assertEqual(len(tower_mgr.towers_coverage), 4)
+        finally:
+            # Do not leak the modified store to other tests
+            tower_store_module._tower_store = None
+
+
+class TestTowerManagerCoordinates(unittest.TestCase):
+    """
+    Test for the TowerManager class on small databases around
+    coordinates, without any geocoding.
+    """
+    def test_reduced_database_closest_outside_box(self):
+        # Orange has a tower in the corner of the first box, and a
+        # closer one just outside of it
+        database = pd.DataFrame({
+            'Operateur': [20801, 20801, 20810, 20815, 20820],
+            'Latitude': [47.019, 47.0, 47.0, 47.0, 47.3],
+            'Longitude': [5.019, 5.025, 5.001, 5.002, 5.0],
+            '2G': [1, 1, 1, 1, 1], '3G': [1, 1, 1, 1, 1],
+            '4G': [1, 1, 1, 1, 1]})
+        location = Coordinates(47.0, 5.0)
+        tower_mgr = TowerManager(location, database=database)
+        reduced_db = tower_mgr.reduced_database()
+        self.assertIn(1, reduced_db.index)
+
+        # Bouygues is only found after doubling the box 4 times
+        self.assertEqual(tower_mgr.expansions, 4)
+
+        # Same closest towers as the whole database
+        tower_mgr.database = reduced_db
+        tower_mgr.locate_closest_towers()
+        self.assertEqual(tower_mgr.tower_indexes,
+                         {20801: 1, 20810: 2, 20815: 3, 20820: 4})
+
+    def test_reduced_database_not_found(self):
+        # No tower provides the required network, the whole database is
+        # given back once the box can not grow anymore
+        database = pd.DataFrame({
+            'Operateur': [20801, 20810], 'Latitude': [47.0, 47.1],
+            'Longitude': [5.0, 5.1], '2G': [0, 0], '3G': [1, 1],
+            '4G': [1, 1]})
+        tower_mgr = TowerManager(Coordinates(47.0, 5.0), database=database,
+                                 networks=['2G', '3G'],
+                                 operators=[20801, 20810],
+                                 required_networks=['2G'])
+        self.assertEqual(len(tower_mgr.reduced_database()), 2)
+        self.assertEqual(tower_mgr.expansions, TowerManager.max_expansions)
+
+    def test_float_flags(self):
+        # Network columns read as floats, as pandas does when a column
+        # has missing values
+        database = pd.DataFrame({
+            'Operateur': [20801, 20810], 'Latitude': [47.0, 47.1],
+            'Longitude': [5.0, 5.1], '2G': [1.0, 0.0], '3G': [0.0, 1.0],
+            '4G': [1.0, 1.0]})
+        location = Coordinates(47.0, 5.0)
+        expected = {'Orange': {'2G': 'true', '3G': 'false', '4G': 'true',
+                               'distance': 0.0},
+                    'SFR': {'2G': 'false', '3G': 'true', '4G': 'true',
+                            'distance': 13455.3}}
+
+        tower_mgr = TowerManager(location, database=database,
+                                 operators=[20801, 20810])
+        tower_mgr.location_coverage()
+        self.assertEqual(tower_mgr.towers_coverage, expected)
+
+        tower_mgr.location_nearby_coverage(k=1)
+        self.assertEqual(tower_mgr.nearby_coverage['SFR']['towers'],
+                         [{'2G': 'false', '3G': 'true', '4G': 'true',
+                           'distance': 13455.3}])
+
+    def test_operator_without_networks(self):
+        # SFR has no 2G tower, it is searched and not covered
+        database = pd.DataFrame({
+            'Operateur': [20801, 20810], 'Latitude': [47.0, 47.1],
+            'Longitude': [5.0, 5.1], '2G': [1, 0], '3G': [1, 1],
+            '4G': [1, 1]})
+        tower_mgr = TowerManager(Coordinates(47.0, 5.0), database=database,
+                                 networks=['2G'], operators=[20801, 20810],
+                                 required_networks=['2G'])
+        tower_mgr.location_coverage()
+        self.assertEqual(tower_mgr.towers_coverage,
+                         {'Orange': {'2G': 'true', 'distance': 0.0},
+                          'SFR': {'2G': 'false', 'distance': None}})
+        self.assertEqual(tower_mgr.location_coverage_result().to_json(),
+                         b'{"Orange": {"2G": "true", "distance": 0.0}, '
+                         b'"SFR": {"2G": "false", "distance": null}}')
@@ -0,0 +1,162 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+
+from unittest.mock import Mock
+
+from databases.datascripts import csv_name
+from utils import TowerStore as tower_store_module
+from utils.TowerStore import TowerStore, get_tower_store, load_tower_store, \
+    reload_tower_store, tower_store_listeners, tower_store_ready
+
+
+class TestTowerStore(unittest.TestCase):
+    """
+    Test for the TowerStore class.
+    """
+    def setUp(self):
+        super().setUp()
+        db_dir = os.path.join(os.getcwd(), '../databases')
+        self.db_path = os.path.join(db_dir, csv_name)
+
+    def tearDown(self):
+        # Do not leak the shared store between tests
+        tower_store_module._tower_store = None
+        super().tearDown()
+
+    # Test for all the checks that the class runs
+    def test_init_false_database(self):
+        database = Mock()
+        database.columns = ['a', 'b', 'c']
+
+        with self.assertRaises(AttributeError) as context:
+            TowerStore.from_data_frame(database)
+
+        self.assertEqual(
+            "Database does not contain the minimum expected columns!",
+            context.exception.args[0])
+
+    # Test for the methods
+    def test_read_only_columns(self):
+        store = TowerStore.from_csv(self.db_path)
+        self.assertEqual(len(store), 77147)
+        self.assertEqual(set(store.networks), {'2G', '3G', '4G'})
+
+        # None of the columns can be written
+        for column in [store.operators, store.latitudes,
+                       store.longitudes] + list(store.networks.values()):
+            with self.assertRaises(ValueError):
+                column[0] = 0
+
+    def test_shared_store(self):
+        # The store is loaded only once
+        store = load_tower_store(self.db_path)
+        self.assertIs(store, get_tower_store())
+        self.assertIs(get_tower_store(), get_tower_store())
+        self.assertFalse(store.is_outdated())
+
+    def test_warm_up(self):
+        load_tower_store(self.db_path)
+        self.assertFalse(tower_store_ready())
+        store = get_tower_store().warm_up()
+        self.assertTrue(tower_store_ready())
+        self.assertIsNotNone(store._index)
+
+    def test_reload(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, csv_name)
+            shutil.copy(self.db_path, path)
+            old = load_tower_store(path)
+
+            # Nothing is loaded while the file does not change
+            self.assertIs(reload_tower_store(path), old)
+
+            # A changed file is loaded, warmed and swapped in at once,
+            # and the listeners are told about it
+            replaced = []
+            tower_store_listeners.append(replaced.append)
+            try:
+                database = pd.read_csv(path, sep=";").iloc[:1000]
+                database.to_csv(path, sep=";", index=False)
+                os.utime(path, (0, old.mtime + 10))
+                store = reload_tower_store(path)
+            finally:
+                tower_store_listeners.remove(replaced.append)
+
+            self.assertIsNot(store, old)
+            self.assertIs(get_tower_store(), store)
+            self.assertTrue(store.ready)
+            self.assertEqual(len(store), 1000)
+            self.assertEqual(replaced, [store])
+
+            # The previous store is left untouched for its users
+            self.assertEqual(len(old), 77147)
+
+    def test_reload_wrong_file(self):
+        old = load_tower_store(self.db_path)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'towers.bin')
+            with open(path, 'wb') as file:
+                file.write(TowerStore.magic)
+            with self.assertRaises(Exception):
+                reload_tower_store(path)
+        self.assertIs(get_tower_store(), old)
+
+    def test_store_from_data_frame(self):
+        database = pd.DataFrame({'Operateur': [20801], 'Latitude': [48.0],
+                                 'Longitude': [2.0], '4G': [1]})
+        store = TowerStore.from_data_frame(database)
+        self.assertIsNone(store.source)
+        self.assertFalse(store.is_outdated())
+        self.assertEqual(list(store.networks), ['4G'])
+
+    def test_binary_file(self):
+        store = TowerStore.from_csv(self.db_path)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'towers.bin')
+            store.save_binary(path)
+            binary = TowerStore.from_file(path)
+
+            # Same towers, with coordinates in float32
+            self.assertEqual(len(binary), len(store))
+            np.testing.assert_array_equal(binary.operators, store.operators)
+            np.testing.assert_allclose(binary.latitudes, store.latitudes,
+                                       atol=1e-5)
+            np.testing.assert_allclose(binary.longitudes, store.longitudes,
+                                       atol=1e-5)
+            for net, column in store.networks.items():
+                np.testing.assert_array_equal(binary.networks[net], column)
+            self.assertEqual(binary.fingerprint(), store.fingerprint())
+            self.assertEqual(list(binary.database.columns),
+                             list(store.database.columns))
+
+            # Coordinates are memory-mapped and read-only
+            self.assertFalse(binary.latitudes.flags.owndata)
+            with self.assertRaises(ValueError):
+                binary.latitudes[0] = 0
+
+            # Operators and networks are read from the mapped bytes,
+            # without a copy of the columns in the process
+            self.assertIsInstance(binary.operators.positions, np.memmap)
+            flags = {id(column.flags) for column
+                     in binary.networks.values()}
+            self.assertEqual(len(flags), 1)
+            self.assertIsInstance(binary.networks['4G'].flags, np.memmap)
+            rows = np.array([0, 10, 100])
+            np.testing.assert_array_equal(binary.operators[rows],
+                                          store.operators[rows])
+            np.testing.assert_array_equal(binary.operators == 20815,
+                                          store.operators == 20815)
+            np.testing.assert_array_equal(binary.networks['3G'][rows],
+                                          store.networks['3G'][rows])
+            del binary
+
+    def test_binary_wrong_file(self):
+        with self.assertRaises(AttributeError) as context:
+            TowerStore.from_binary(self.db_path)
+
+        self.assertEqual("File is not a tower database!",
+                         context.exception.args[0])
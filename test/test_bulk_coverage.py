@@ -0,0 +1,73 @@
+import json
+import os
+import tempfile
+import unittest
+
+from bulk_coverage import chunks, read_checkpoint, run, write_checkpoint
+
+
+class TestBulkCoverage(unittest.TestCase):
+    """
+    Test for the bulk coverage tool.
+    """
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.input = os.path.join(self.directory.name, 'customers.csv')
+        self.output = os.path.join(self.directory.name, 'coverage.jsonl')
+        with open(self.input, 'w') as file:
+            file.write("id,lat,lon\n"
+                       "a,47.3113753,5.0392644\n"
+                       "b,48.8566,2.3522\n"
+                       "c,41.3870,2.1700\n"
+                       "d,notanumber,2.0\n"
+                       "e,43.6120665,1.457871\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+        super().tearDown()
+
+    def read_output(self):
+        with open(self.output) as file:
+            return [json.loads(line) for line in file]
+
+    # Test for the functions
+    def test_chunks(self):
+        self.assertEqual(list(chunks(range(5), 2)), [[0, 1], [2, 3], [4]])
+
+    def test_run(self):
+        done = run(self.input, self.output, chunk_size=2,
+                   columns={'id': 'id'})
+        self.assertEqual(done, 5)
+
+        lines = self.read_output()
+        self.assertEqual([line['row'] for line in lines], [0, 1, 2, 3, 4])
+        self.assertEqual([line['id'] for line in lines],
+                         ['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(set(lines[0]['coverage']),
+                         {'Orange', 'SFR', 'Free', 'Bouygue'})
+        self.assertEqual(lines[2]['error'],
+                         "Sorry, your location must be in France to "
+                         "return a precise result")
+        self.assertEqual(lines[3]['error'],
+                         "Sorry, the coordinates provided are not valid, "
+                         "check the url!")
+        self.assertEqual(read_checkpoint(self.output + '.checkpoint'),
+                         {'rows': 5, 'offset': os.path.getsize(self.output)})
+
+    def test_resume(self):
+        run(self.input, self.output, columns={'id': 'id'})
+        expected = self.read_output()
+
+        # Interrupted run: two records done and part of the next chunk
+        # written after the checkpoint
+        with open(self.output, 'rb') as file:
+            first = b''.join(file.readlines()[:2])
+        with open(self.output, 'wb') as file:
+            file.write(first + b'{"row": 2, "id"')
+        write_checkpoint(self.output + '.checkpoint', 2, len(first))
+
+        done = run(self.input, self.output, chunk_size=2, resume=True,
+                   columns={'id': 'id'})
+        self.assertEqual(done, 5)
+        self.assertEqual(self.read_output(), expected)
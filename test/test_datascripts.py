@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+import pandas as pd
+
+from databases.datascripts import lamber93_to_gps, rebuild_database
+
+
+class TestDatascripts(unittest.TestCase):
+    """
+    Test for the scripts that build the database
+    """
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, 'source.csv')
+        pd.DataFrame({'Operateur': [20801, 20810, 20815],
+                      'x': ['102980', '#N/A', '652469'],
+                      'y': [6847973, 6862035, 6862035],
+                      '2G': [1, 1, 0], '3G': [1, 1, 1], '4G': [0, 1, 1]}
+                     ).to_csv(self.source, sep=';', index=False)
+
+    def tearDown(self):
+        self.directory.cleanup()
+        super().tearDown()
+
+    def test_lamber93_to_gps(self):
+        lat, long = lamber93_to_gps(102980, 6847973)
+        self.assertAlmostEqual(lat, 48.4565745588299)
+        self.assertAlmostEqual(long, -5.08885611530134)
+
+    def test_rebuild_database(self):
+        path = os.path.join(self.directory.name, 'database.csv')
+        messages = []
+        written = rebuild_database(self.source, path, chunksize=2,
+                                   report=messages.append)
+        database = pd.read_csv(path, sep=';')
+
+        # The row without coordinates is dropped
+        self.assertEqual(written, 2)
+        self.assertEqual(list(database.columns),
+                         ['Operateur', 'Latitude', 'Longitude',
+                          '2G', '3G', '4G'])
+        self.assertEqual(list(database['Operateur']), [20801, 20815])
+        self.assertAlmostEqual(database['Latitude'][0], 48.4565745588299)
+        self.assertAlmostEqual(database['Longitude'][0],
+                               -5.08885611530134)
+
+        # One message per chunk and the final one
+        self.assertEqual(len(messages), 3)
+
+    def test_rebuild_database_invalid_first_chunk(self):
+        # A first chunk without valid rows still writes the header once
+        pd.DataFrame({'Operateur': [20801, 20810, 20815],
+                      'x': ['#N/A', '#N/A', '652469'],
+                      'y': [6847973, 6862035, 6862035],
+                      '2G': [1, 1, 0], '3G': [1, 1, 1], '4G': [0, 1, 1]}
+                     ).to_csv(self.source, sep=';', index=False)
+        path = os.path.join(self.directory.name, 'database.csv')
+        written = rebuild_database(self.source, path, chunksize=2,
+                                   report=None)
+        database = pd.read_csv(path, sep=';')
+        self.assertEqual(written, 1)
+        self.assertEqual(list(database['Operateur']), [20815])
+
+    def test_rebuild_database_error(self):
+        # The temporary file is removed and the database is untouched
+        path = os.path.join(self.directory.name, 'database.csv')
+        with self.assertRaises(FileNotFoundError):
+            rebuild_database(os.path.join(self.directory.name, 'none.csv'),
+                             path, report=None)
+        self.assertEqual(os.listdir(self.directory.name), ['source.csv'])
@@ -0,0 +1,31 @@
+import unittest
+import numpy as np
+
+from utils.distances import equirectangular, haversine
+
+
+class TestDistances(unittest.TestCase):
+    """
+    Test for the distance functions
+    """
+    def test_haversine(self):
+        # Paris - Lyon, around 391 km
+        dist = haversine(48.8566, 2.3522, np.array([45.7640]),
+                         np.array([4.8357]))
+        self.assertAlmostEqual(dist[0] / 1000, 391.5, delta=0.5)
+
+    def test_same_point(self):
+        dist = haversine(48.8566, 2.3522, np.array([48.8566]),
+                         np.array([2.3522]))
+        self.assertEqual(dist[0], 0)
+
+    def test_equirectangular(self):
+        # The approximation is close to the exact distance for the
+        # distances of the towers
+        generator = np.random.default_rng(0)
+        latitudes = 47.3 + generator.uniform(-0.1, 0.1, 1000)
+        longitudes = 5.0 + generator.uniform(-0.1, 0.1, 1000)
+        exact = haversine(47.3, 5.0, latitudes, longitudes)
+        approximated = equirectangular(47.3, 5.0, latitudes, longitudes)
+        self.assertEqual(exact.shape, approximated.shape)
+        np.testing.assert_allclose(approximated, exact, rtol=1e-3)
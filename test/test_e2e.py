@@ -1,5 +1,17 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import signal
 import unittest
-from APIManager import APIManager
+import APIManager as api_module
+
+from concurrent.futures import Future
+from unittest import mock
+from APIManager import APIManager, BatchRequest, max_batch_items
+from utils import TowerStore as tower_store_module
+from utils.TowerStore import warm_tower_store
 
 
 class TestApiManager(unittest.TestCase):
@@ -21,6 +33,164 @@ class TestApiManager(unittest.TestCase):
                                     '3G': "true",
                                     '4G': "true"}
                            }
-        result = APIManager.get_towers_coverage(address)
+        expected_distances = {'Orange': 258.2,
+                              'SFR': 296.9,
+                              'Bouygue': 180.5,
+                              'Free': 429.8}
+        result = json.loads(
+            asyncio.run(APIManager.get_towers_coverage(address)).body)
 
+        # Distances depend on the precision of the geocoder, so they
+        # are checked apart with some margin
+        distances = {operator: coverage.pop('distance')
+                     for operator, coverage in result.items()}
         self.assertEqual(result, expected_result)
+        for operator, distance in expected_distances.items():
+            self.assertAlmostEqual(distances[operator], distance,
+                                   delta=50)
+
+    def test_coordinates(self):
+        # Coordinates do not need the geocoder
+        # The distance is the one of the location of the cache key,
+        # (43.6121, 1.4579)
+        result = json.loads(asyncio.run(APIManager.get_towers_coverage(
+            lat=43.6120665, lon=1.457871)).body)
+        self.assertEqual(result['Bouygue'],
+                         {'2G': 'true', '3G': 'true', '4G': 'true',
+                          'distance': 183.2})
+
+        # Another location of the same key gets the same answer
+        other = json.loads(asyncio.run(APIManager.get_towers_coverage(
+            lat=43.61207, lon=1.45791)).body)
+        self.assertEqual(other, result)
+
+        response = asyncio.run(APIManager.get_towers_coverage(lat=43.6))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.body),
+                         {'error': "Sorry, the coordinates provided are "
+                                   "not valid, check the url!",
+                          'code': 'invalid_coordinates'})
+
+    def test_operator_not_covered(self):
+        # Free has no 2G tower: it is answered as not covered instead
+        # of being left out
+        result = json.loads(asyncio.run(APIManager.get_towers_coverage(
+            lat=43.6120665, lon=1.457871, operators=['Free', 'Orange'],
+            networks=['2G'])).body)
+        self.assertEqual(set(result), {'Free', 'Orange'})
+        self.assertEqual(result['Free'], {'2G': 'false', 'distance': None})
+        self.assertEqual(result['Orange']['2G'], 'true')
+
+        result = json.loads(asyncio.run(
+            APIManager.get_nearby_towers_coverage(
+                lat=43.6120665, lon=1.457871, k=2, operators=['Free'],
+                networks=['2G'])).body)
+        self.assertEqual(result, {'Free': {'2G': 'false', 'towers': []}})
+
+    def test_dict_responses(self):
+        # Coverages answered as dicts, computed or cached
+        APIManager.raw_responses = False
+        try:
+            for _ in range(2):
+                result = asyncio.run(APIManager.get_towers_coverage(
+                    lat=48.8566, lon=2.3522))
+                self.assertEqual(set(result),
+                                 {'Orange', 'SFR', 'Free', 'Bouygue'})
+        finally:
+            APIManager.raw_responses = True
+
+    def test_errors(self):
+        # Rejected before asking the geocoder
+        response = asyncio.run(APIManager.get_towers_coverage())
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.body)['code'],
+                         'missing_address')
+
+        response = asyncio.run(APIManager.get_towers_coverage(
+            "1 Carrer de Mallorca, Barcelona, Spain"))
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(json.loads(response.body)['code'], 'out_of_france')
+
+        response = asyncio.run(APIManager.get_nearby_towers_coverage(
+            lat=40.4168, lon=-3.7038, k=3))
+        self.assertEqual(response.status_code, 422)
+
+        response = asyncio.run(APIManager.get_towers_coverage(
+            lat=43.6120665, lon=1.457871, operators=['Unknown']))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.body),
+                         {'error': "Provided operators are not available!",
+                          'code': 'invalid_request'})
+
+    def test_batch(self):
+        # Only coordinates and wrong items, to avoid the geocoder
+        batch = BatchRequest(items=[{'lat': 43.6120665, 'lon': 1.457871},
+                                    {'lat': 40.4168, 'lon': -3.7038},
+                                    {'lat': 43.6120665},
+                                    {}])
+        result = asyncio.run(APIManager.get_batch_towers_coverage(batch))
+        results = result['results']
+
+        self.assertEqual(len(results), 4)
+        self.assertEqual(results[0]['coverage']['Orange'],
+                         {'2G': 'false', '3G': 'true', '4G': 'true',
+                          'distance': 258.2})
+        self.assertEqual(results[1]['error'],
+                         "Sorry, your location must be in France to "
+                         "return a precise result")
+        self.assertEqual(results[2]['error'],
+                         "Sorry, the coordinates provided are not "
+                         "valid, check the url!")
+        self.assertEqual(results[3]['error'],
+                         "Sorry, no address has been recognized, check "
+                         "the url!")
+
+    def test_batch_too_large(self):
+        batch = BatchRequest(items=[{'lat': 43.6120665, 'lon': 1.457871}]
+                             * (max_batch_items + 1))
+        response = asyncio.run(APIManager.get_batch_towers_coverage(batch))
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(json.loads(response.body)['code'],
+                         'batch_too_large')
+
+    def test_health(self):
+        self.assertEqual(APIManager.get_liveness(), {'status': 'alive'})
+
+        # Ready only once the towers are warm
+        tower_store_module._tower_store = None
+        self.assertEqual(APIManager.get_readiness().status_code, 503)
+        warm_tower_store()
+        self.assertEqual(APIManager.get_readiness(), {'status': 'ready'})
+
+    def test_warm_up_failed(self):
+        # A failed warm up is reported, and the process stays not ready
+        future = Future()
+        future.set_exception(OSError("No tower database"))
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            api_module.report_warm_up(future)
+        self.assertIn("No tower database", stderr.getvalue())
+
+        previous = api_module.warming
+        api_module.warming = future
+        tower_store_module._tower_store = None
+        try:
+            response = APIManager.get_readiness()
+        finally:
+            api_module.warming = previous
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(json.loads(response.body), {'status': 'failed'})
+
+    def test_reload_not_allowed(self):
+        response = asyncio.run(APIManager.post_reload(x_admin_token='x'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_reload_workers(self):
+        # Workers of server.py leave the reload to their parent
+        with mock.patch.object(api_module, 'admin_token', 'secret'), \
+                mock.patch.dict(os.environ, {'JG_SERVER_PID': '1'}), \
+                mock.patch('os.kill') as kill:
+            response = asyncio.run(
+                APIManager.post_reload(x_admin_token='secret'))
+        self.assertEqual(response.status_code, 202)
+        kill.assert_called_once_with(1, signal.SIGHUP)
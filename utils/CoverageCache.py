@@ -0,0 +1,156 @@
+import threading
+
+from collections import OrderedDict
+
+
+class CoverageCache:
+    """
+    Class to cache the coverage answered for a location, already
+    serialised into JSON. Locations are snapped to a given number of
+    decimals, so close locations share their answer. The least
+    recently used answers are dropped first when there are too many of
+    them or they take too much memory, and all of them are dropped when
+    the TowerStore they were computed from is replaced.
+
+    Parameters:
+    -----------
+    [OPTIONALS]
+    precision: (int)
+        Decimals of the coordinates kept in the keys. If none is
+        provided, 4 (around 10 metres) will be used.
+    maxsize: (int)
+        Maximum number of answers kept. If none is provided, 100000
+        will be used.
+    max_bytes: (int)
+        Maximum memory taken by the answers, in bytes. If none is
+        provided, 64 MB will be used.
+    """
+    # Approximate memory taken by an entry besides its answer
+    entry_overhead = 200
+
+    def __init__(self, precision=4, maxsize=100000,
+                 max_bytes=64 * 1024 * 1024):
+        self.precision = precision
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+
+        # Cached answers: key -> JSON bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+        # Store the answers were computed from
+        self.store = None
+
+        # Counters of the cache
+        self.hits = 0
+        self.misses = 0
+
+    def snap(self, latitude, longitude):
+        """
+        Get the location a key stands for: the coordinates rounded to
+        the precision of the cache
+
+        Return:
+        -------
+        tuple: (latitude, longitude) of the key
+        """
+        return (round(latitude, self.precision),
+                round(longitude, self.precision))
+
+    def key(self, latitude, longitude, *options):
+        """
+        Get the key of a location
+
+        Parameters:
+        -----------
+        latitude: (float)
+            Latitude of the location
+        longitude: (float)
+            Longitude of the location
+        options: (hashable)
+            Anything else the answer depends on (e.g. the networks)
+
+        Return:
+        -------
+        tuple: the key
+        """
+        return self.snap(latitude, longitude) + options
+
+    def get(self, store, key):
+        """
+        Look for an answer in the cache
+
+        Parameters:
+        -----------
+        store: (utils.TowerStore)
+            Store the answer must come from
+        key: (tuple)
+            Key given by key()
+
+        Return:
+        -------
+        bytes: the JSON answer, or None if it is not cached
+        """
+        with self.lock:
+            self.check_store(store)
+            content = self.entries.get(key)
+            if content is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return content
+
+    def set(self, store, key, content):
+        """
+        Store an answer
+
+        Parameters:
+        -----------
+        store: (utils.TowerStore)
+            Store the answer comes from
+        key: (tuple)
+            Key given by key()
+        content: (bytes)
+            The JSON answer
+        """
+        with self.lock:
+            self.check_store(store)
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous) + self.entry_overhead
+            self.entries[key] = content
+            self.size += len(content) + self.entry_overhead
+
+            # Drop the least recently used answers
+            while self.entries and (len(self.entries) > self.maxsize
+                                    or self.size > self.max_bytes):
+                _, dropped = self.entries.popitem(last=False)
+                self.size -= len(dropped) + self.entry_overhead
+
+    def check_store(self, store):
+        """
+        Drop every answer if they come from another store. The lock
+        must be held.
+        """
+        if store is not self.store:
+            self.entries.clear()
+            self.size = 0
+            self.store = store
+
+    def invalidate(self):
+        """
+        Drop every answer
+        """
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.store = None
+
+    def stats(self):
+        """
+        Counters of the cache
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.entries), 'bytes': self.size}
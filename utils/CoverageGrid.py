@@ -0,0 +1,387 @@
+import numpy as np
+
+from utils.Locator import france_bounds
+from utils.distances import EARTH_RADIUS, haversine, to_unit_vectors
+
+
+class CoverageGrid:
+    """
+    Class to answer in constant time which are the closest towers of a
+    location. France is split into a grid of cells and, for each cell
+    and operator, the rows of the TowerStore of the few towers that can
+    be the closest one of some point of the cell are precomputed. They
+    are scored exactly at query time, so the answer is the one of the
+    TowerIndex. Cells with too many such towers, as in the city
+    centres, are split into subcells, and the operators whose subcell
+    still has too many of them are searched with the index.
+
+    Parameters:
+    -----------
+    header: (numpy.ndarray)
+        Single element array of header_dtype describing the grid
+    cells: (numpy.ndarray)
+        Array of int32 with shape (operators, latitudes, longitudes).
+        The id of the set of towers of every cell, -1 if it is unknown
+        and -2 - id for the id of a block of subcells.
+    sets: (numpy.ndarray)
+        Array of int32 with shape (sets, candidates) with the rows of
+        the towers of every set, padded with -1
+    blocks: (numpy.ndarray)
+        Array of int32 with shape (blocks, subdivisions, subdivisions)
+        with the id of the set of towers of every subcell, or -1
+
+    [OPTIONALS]
+    store: (utils.TowerStore)
+        Store the rows of the sets refer to. Needed to compute the
+        distances in closest_towers().
+    """
+    magic = b'JGCG'
+    version = 3
+
+    # Metres a tower may move between the csv and the binary version of
+    # a database (float32 coordinates), which share the grid
+    tolerance = 2.0
+    header_dtype = np.dtype([('magic', 'S4'),
+                             ('version', '<u2'),
+                             ('n_operators', '<u2'),
+                             ('fingerprint', '<u4'),
+                             ('n_lat', '<u4'),
+                             ('n_ln', '<u4'),
+                             ('cell_size', '<f8'),
+                             ('latitude', '<f8'),
+                             ('longitude', '<f8'),
+                             ('lat_step', '<f8'),
+                             ('ln_step', '<f8'),
+                             ('operators', '<u4', (8,)),
+                             ('candidates', '<u2'),
+                             ('subdivisions', '<u2'),
+                             ('n_sets', '<u4'),
+                             ('n_blocks', '<u4')])
+
+    def __init__(self, header, cells, sets, blocks, store=None):
+        self.header = header
+        self.cells = cells
+        self.sets = sets
+        self.blocks = blocks
+        self.store = store
+
+        # Unpack the header for faster lookups
+        self.fingerprint = int(header['fingerprint'][0])
+        self.latitude = float(header['latitude'][0])
+        self.longitude = float(header['longitude'][0])
+        self.lat_step = float(header['lat_step'][0])
+        self.ln_step = float(header['ln_step'][0])
+        self.subdivisions = int(header['subdivisions'][0])
+        self.n_lat, self.n_ln = cells.shape[1:]
+        n_operators = int(header['n_operators'][0])
+        self.operators = [int(op) for op in
+                          header['operators'][0][:n_operators]]
+
+    @classmethod
+    def build(cls, store, cell_size=500, chunk=128, bounds=None,
+              candidates=8, subdivisions=8):
+        """
+        Build the grid of a store covering metropolitan France
+
+        Parameters:
+        -----------
+        store: (utils.TowerStore)
+            Store with the towers
+
+        [OPTIONALS]
+        cell_size: (float)
+            Size of the side of a cell, in metres. If none is provided,
+            500 will be used.
+        chunk: (int)
+            Number of rows of cells computed at once, to bound the
+            memory used by the build.
+        bounds: (tuple)
+            (latitude min, latitude max, longitude min, longitude max)
+            of the grid. If none are provided, metropolitan France will
+            be used.
+        candidates: (int)
+            Maximum number of towers of an operator kept for a cell or
+            a subcell. If none is provided, 8 will be used.
+        subdivisions: (int)
+            Number of subcells along each side of a cell with too many
+            towers. If none is provided, 8 will be used.
+
+        Return:
+        -------
+        CoverageGrid: the grid of the store
+        """
+        if bounds is None:
+            bounds = france_bounds['latitude'] + france_bounds['longitude']
+        lat_min, lat_max, ln_min, ln_max = bounds
+
+        # Size of the cells in degrees, the longitude one taken at the
+        # middle latitude of the grid
+        lat_step = np.degrees(cell_size / EARTH_RADIUS)
+        ln_step = lat_step / np.cos(np.radians((lat_min + lat_max) / 2))
+        n_lat = int(np.ceil((lat_max - lat_min) / lat_step))
+        n_ln = int(np.ceil((ln_max - ln_min) / ln_step))
+
+        index = store.index
+        operators = sorted(index.trees)
+        cells = np.full((len(operators), n_lat, n_ln), -1, dtype='<i4')
+
+        # Sets of towers of every chunk, merged once the grid is built,
+        # and blocks of subcells
+        chunk_sets, blocks = [], []
+        n_sets, n_blocks = 0, 0
+
+        # Go through the grid by chunks of rows of cells
+        centre_lns = ln_min + (np.arange(n_ln) + 0.5) * ln_step
+        offsets = (np.arange(subdivisions) + 0.5) / subdivisions - 0.5
+        for start in range(0, n_lat, chunk):
+            stop = min(start + chunk, n_lat)
+            centre_lats = lat_min \
+                + (np.arange(start, stop) + 0.5) * lat_step
+            lats, lns = np.meshgrid(centre_lats, centre_lns,
+                                    indexing='ij')
+            lats, lns = lats.ravel(), lns.ravel()
+
+            found = []
+            for operator in operators:
+                rows = cls.candidate_rows(store, index, operator, lats,
+                                          lns, lat_step, ln_step,
+                                          candidates, split=subdivisions)
+                split = rows[:, 0] == -2
+
+                # Cells with too many towers are split into subcells
+                sub_lats = (lats[split, None, None] + offsets[:, None]
+                            * lat_step).repeat(subdivisions, axis=2)
+                sub_lns = (lns[split, None, None] + offsets[None, :]
+                           * ln_step).repeat(subdivisions, axis=1)
+                sub_rows = cls.candidate_rows(
+                    store, index, operator, sub_lats.ravel(),
+                    sub_lns.ravel(), lat_step / subdivisions,
+                    ln_step / subdivisions, candidates)
+                found.append((rows, split, sub_rows))
+
+            # Give an id to every set of towers of the chunk
+            every_set = np.concatenate(
+                [rows for rows, _, _ in found]
+                + [sub_rows for _, _, sub_rows in found])
+            valid = every_set[:, 0] >= 0
+            unique, valid_ids = cls.unique_rows(every_set[valid])
+            ids = np.full(len(every_set), -1, dtype=np.int64)
+            ids[valid] = valid_ids + n_sets
+            chunk_sets.append(unique)
+            n_sets += len(unique)
+
+            position = 0
+            cell_ids = []
+            for rows, split, _ in found:
+                cell_ids.append(ids[position:position + len(rows)])
+                position += len(rows)
+            for operator, (rows, split, sub_rows) in enumerate(found):
+                n_split = int(split.sum())
+                cell_ids[operator][split] = -2 - n_blocks \
+                    - np.arange(n_split)
+                blocks.append(ids[position:position + len(sub_rows)]
+                              .reshape(n_split, subdivisions,
+                                       subdivisions))
+                position += len(sub_rows)
+                n_blocks += n_split
+                cells[operator, start:stop] = cell_ids[operator].reshape(
+                    stop - start, n_ln)
+
+        # Merge the sets of towers shared by the chunks
+        sets, ids = cls.unique_rows(np.concatenate(
+            chunk_sets + [np.empty((0, candidates), dtype='<i4')]))
+        known = cells >= 0
+        cells[known] = ids[cells[known]]
+        blocks = np.concatenate(
+            blocks + [np.empty((0, subdivisions, subdivisions),
+                               dtype='<i4')]).astype('<i4')
+        known = blocks >= 0
+        blocks[known] = ids[blocks[known]]
+
+        header = np.zeros(1, dtype=cls.header_dtype)
+        header['magic'] = cls.magic
+        header['version'] = cls.version
+        header['n_operators'] = len(operators)
+        header['fingerprint'] = store.fingerprint()
+        header['n_lat'] = n_lat
+        header['n_ln'] = n_ln
+        header['cell_size'] = cell_size
+        header['latitude'] = lat_min
+        header['longitude'] = ln_min
+        header['lat_step'] = lat_step
+        header['ln_step'] = ln_step
+        header['operators'][0][:len(operators)] = operators
+        header['candidates'] = candidates
+        header['subdivisions'] = subdivisions
+        header['n_sets'] = len(sets)
+        header['n_blocks'] = len(blocks)
+        return cls(header, cells, sets, blocks, store=store)
+
+    @classmethod
+    def candidate_rows(cls, store, index, operator, lats, lns, lat_step,
+                       ln_step, candidates, split=1):
+        """
+        Get the rows of the towers of an operator that can be the
+        closest one of some point of every cell
+
+        Return:
+        -------
+        numpy.ndarray: array of int32 with shape (cells, candidates)
+        with the rows sorted and padded with -1, or filled with -2 for
+        the cells with more than candidates towers that are worth
+        splitting into split subcells along each side, and with -1 for
+        the other ones
+        """
+        tree, tree_rows = index.trees[operator], index.rows[operator]
+        k = min(candidates + 1, tree.n)
+        _, positions = tree.query(to_unit_vectors(lats, lns), k=k,
+                                  workers=-1)
+        rows = tree_rows[positions.reshape(len(lats), k)]
+        dist = haversine(lats[:, None], lns[:, None],
+                         store.latitudes[rows], store.longitudes[rows])
+
+        # Largest distance between the centre of a cell and any of its
+        # points: the distance to its corners
+        half_diagonal = haversine(lats, lns, lats + lat_step / 2,
+                                  lns + ln_step / 2)
+
+        # By the triangle inequality, a tower further from the centre
+        # than the closest one by more than the cell diagonal is further
+        # from every point of the cell, whatever the precision of the
+        # coordinates of the store using the grid
+        kept = dist <= dist.min(axis=1)[:, None] \
+            + 2 * half_diagonal[:, None] + 2 * cls.tolerance
+        rows = np.where(kept, rows, -1)
+
+        result = np.full((len(lats), candidates), -1, dtype='<i4')
+        result[:, :min(k, candidates)] = \
+            -np.sort(-rows, axis=1)[:, :candidates]
+        # Far from the towers, as on the sea, they are at the same
+        # distances from the subcells as from their cell: only the cells
+        # whose subcells are small beside their closest tower are split
+        overflow = kept.sum(axis=1) > candidates
+        result[overflow] = -1
+        result[overflow & (dist.min(axis=1) < 2 * split * half_diagonal)] \
+            = -2
+        return result
+
+    @staticmethod
+    def unique_rows(array):
+        """
+        Get the unique rows of a 2D array
+
+        Return:
+        -------
+        tuple: (unique rows, id of the unique row of every row)
+        """
+        array = np.ascontiguousarray(array)
+        view = array.view(np.dtype((np.void, array.dtype.itemsize
+                                    * array.shape[1]))).ravel()
+        _, first, ids = np.unique(view, return_index=True,
+                                  return_inverse=True)
+        return array[first], ids.ravel()
+
+    def save(self, path):
+        """
+        Write the grid into a binary file: the header followed by the
+        cells, the sets of towers and the blocks of subcells
+
+        Parameters:
+        -----------
+        path: (str)
+            Path to the binary file
+        """
+        with open(path, 'wb') as file:
+            file.write(self.header.tobytes())
+            for array in (self.cells, self.sets, self.blocks):
+                file.write(np.ascontiguousarray(array, dtype='<i4')
+                           .tobytes())
+
+    @classmethod
+    def load(cls, path, store=None):
+        """
+        Load a grid from a binary file. The arrays are memory-mapped, so
+        only the cells that are used are read from disk.
+
+        Parameters:
+        -----------
+        path: (str)
+            Path to the binary file
+
+        [OPTIONALS]
+        store: (utils.TowerStore)
+            Store the grid refers to
+
+        Return:
+        -------
+        CoverageGrid: the grid of the file
+        """
+        header = np.fromfile(path, dtype=cls.header_dtype, count=1)
+        if len(header) == 0 or header['magic'][0] != cls.magic \
+                or header['version'][0] != cls.version:
+            raise AttributeError("File is not a coverage grid!")
+        subdivisions = int(header['subdivisions'][0])
+        shapes = [(int(header['n_operators'][0]), int(header['n_lat'][0]),
+                   int(header['n_ln'][0])),
+                  (int(header['n_sets'][0]), int(header['candidates'][0])),
+                  (int(header['n_blocks'][0]), subdivisions, subdivisions)]
+
+        arrays = []
+        offset = cls.header_dtype.itemsize
+        for shape in shapes:
+            size = int(np.prod(shape))
+            arrays.append(np.empty(shape, dtype='<i4') if size == 0
+                          else np.memmap(path, dtype='<i4', mode='r',
+                                         shape=shape, offset=offset))
+            offset += 4 * size
+        return cls(header, *arrays, store=store)
+
+    def matches(self, store):
+        """
+        Check that the grid was built from the towers of a store
+        """
+        return self.fingerprint == store.fingerprint()
+
+    def closest_towers(self, latitude, longitude, metric=haversine):
+        """
+        Get the closest tower of every operator for a location, for the
+        operators whose cell of the location knows the towers
+
+        Parameters:
+        -----------
+        Same as utils.TowerIndex.closest_towers()
+
+        Return:
+        -------
+        dict: operator code as key and a tuple (distance, row) as
+        value, without the operators that need the exact search, or
+        None if the location is out of the grid
+        """
+        i, lat_rest = divmod((latitude - self.latitude) / self.lat_step, 1)
+        j, ln_rest = divmod((longitude - self.longitude) / self.ln_step, 1)
+        i, j = int(i), int(j)
+        if not (0 <= i < self.n_lat and 0 <= j < self.n_ln):
+            return None
+
+        ids = np.array(self.cells[:, i, j], dtype=np.int64)
+        split = ids <= -2
+        if split.any():
+            k = min(int(lat_rest * self.subdivisions), self.subdivisions - 1)
+            m = min(int(ln_rest * self.subdivisions), self.subdivisions - 1)
+            ids[split] = self.blocks[-2 - ids[split], k, m]
+        known = np.flatnonzero(ids >= 0)
+        if len(known) == 0:
+            return dict()
+
+        # Score the towers of every operator, keeping the first one of
+        # the database on ties as the index does
+        rows = np.asarray(self.sets[ids[known]], dtype=np.int64)
+        dist = np.where(rows >= 0,
+                        metric(latitude, longitude,
+                               self.store.latitudes[rows],
+                               self.store.longitudes[rows]), np.inf)
+        best = np.lexsort((rows, dist))[:, 0]
+        positions = np.arange(len(known))
+        return {self.operators[op]: (float(d), row) for op, d, row
+                in zip(known, dist[positions, best],
+                       rows[positions, best])}
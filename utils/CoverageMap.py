@@ -0,0 +1,237 @@
+import struct
+import zlib
+import numpy as np
+
+from utils.Locator import france_bounds
+from utils.distances import EARTH_RADIUS, to_unit_vectors
+
+
+class CoverageMap:
+    """
+    Class to hold the coverage of a whole region as rasters. The region
+    is split into cells of the same size and, for the centre of every
+    cell and every operator, the closest tower is searched in the
+    index of a TowerStore, all the centres of a band of cells at once.
+    A cell is covered by a network of an operator when its closest
+    tower provides it, as in the answers of the API: among towers at
+    the same distance, such as the ones sharing a mast, the first one
+    of the database is kept.
+
+    Parameters:
+    -----------
+    operators: (list of int)
+        Code of every operator of the map
+    networks: (list of str)
+        Name of every network of the map
+    flags: (numpy.ndarray)
+        Array of uint8 with shape (operators, latitudes, longitudes),
+        with one bit per network (in the order of networks) set when
+        the closest tower of the cell provides it
+    distances: (numpy.ndarray)
+        Array of float32 with the same shape, with the distance from
+        the centre of every cell to its closest tower, in metres
+    bounds: (tuple)
+        (latitude min, latitude max, longitude min, longitude max) of
+        the region
+    steps: (tuple)
+        (latitude, longitude) size of the cells, in degrees. The first
+        row of cells is the southern one.
+    """
+    def __init__(self, operators, networks, flags, distances, bounds,
+                 steps):
+        self.operators = [int(op) for op in operators]
+        self.networks = [str(net) for net in networks]
+        self.flags = flags
+        self.distances = distances
+        self.bounds = tuple(float(bound) for bound in bounds)
+        self.lat_step, self.ln_step = (float(step) for step in steps)
+
+    @classmethod
+    def build(cls, store, bounds=None, resolution=1000, chunk=256,
+              operators=None, workers=-1):
+        """
+        Build the map of a region
+
+        Parameters:
+        -----------
+        store: (utils.TowerStore)
+            Store with the towers
+
+        [OPTIONALS]
+        bounds: (tuple)
+            (latitude min, latitude max, longitude min, longitude max)
+            of the region. If none are provided, metropolitan France
+            will be used.
+        resolution: (float)
+            Size of the side of a cell, in metres. If none is provided,
+            1000 will be used.
+        chunk: (int)
+            Number of rows of cells computed at once, to bound the
+            memory used by the build.
+        operators: (list of int)
+            Codes of the operators of the map. If none are provided,
+            all of them will be used.
+        workers: (int)
+            Number of threads searching the closest towers, -1 for all
+            the cores.
+
+        Return:
+        -------
+        CoverageMap: the map of the region
+        """
+        if bounds is None:
+            bounds = france_bounds['latitude'] + france_bounds['longitude']
+        lat_min, lat_max, ln_min, ln_max = bounds
+        if lat_min >= lat_max or ln_min >= ln_max or resolution <= 0:
+            raise AttributeError("The region of the map is empty!")
+
+        # Size of the cells in degrees, the longitude one taken at the
+        # middle latitude of the region
+        lat_step = np.degrees(resolution / EARTH_RADIUS)
+        ln_step = lat_step / np.cos(np.radians((lat_min + lat_max) / 2))
+        n_lat = int(np.ceil((lat_max - lat_min) / lat_step))
+        n_ln = int(np.ceil((ln_max - ln_min) / ln_step))
+
+        index = store.index
+        if operators is None:
+            operators = sorted(index.trees)
+        networks = list(store.networks)
+        flags = np.zeros((len(operators), n_lat, n_ln), dtype=np.uint8)
+        distances = np.full((len(operators), n_lat, n_ln), np.inf,
+                            dtype=np.float32)
+
+        # Network bits of every tower, read once for all the cells
+        bits = np.zeros(len(store.operators), dtype=np.uint8)
+        for position, net in enumerate(networks):
+            bits |= (np.asarray(store.networks[net]) == 1).astype(
+                np.uint8) << position
+
+        # Go through the region by bands of rows of cells
+        centre_lns = ln_min + (np.arange(n_ln) + 0.5) * ln_step
+        for start in range(0, n_lat, chunk):
+            stop = min(start + chunk, n_lat)
+            centre_lats = lat_min \
+                + (np.arange(start, stop) + 0.5) * lat_step
+            lats, lns = np.meshgrid(centre_lats, centre_lns,
+                                    indexing='ij')
+            points = to_unit_vectors(lats.ravel(), lns.ravel())
+            for position, operator in enumerate(operators):
+                if operator not in index.trees:
+                    continue
+                tree = index.trees[operator]
+                chords, found = tree.query(points, k=min(2, tree.n),
+                                           workers=workers)
+                chords = chords.reshape(len(points), -1)
+                found = found.reshape(len(points), -1)
+                rows = index.rows[operator][found[:, 0]]
+
+                # The chord of the unit sphere gives the great-circle
+                # distance
+                dist = 2 * EARTH_RADIUS \
+                    * np.arcsin(np.minimum(chords[:, 0] / 2, 1))
+
+                # Towers at the same distance are chosen by the index as
+                # in the answers of the API, keeping the first one
+                ties = np.flatnonzero(chords[:, 0] == chords[:, -1]) \
+                    if chords.shape[1] > 1 else []
+                if len(ties):
+                    tie_dist, tie_rows = index.closest_towers_many(
+                        lats.ravel()[ties], lns.ravel()[ties],
+                        operators=[operator])[operator]
+                    dist[ties], rows[ties] = tie_dist, tie_rows
+
+                flags[position, start:stop] = bits[rows].reshape(
+                    lats.shape)
+                distances[position, start:stop] = dist.reshape(lats.shape)
+
+        return cls(operators, networks, flags, distances, bounds,
+                   (lat_step, ln_step))
+
+    def covered(self, operator, network):
+        """
+        Get the cells covered by a network of an operator
+
+        Parameters:
+        -----------
+        operator: (int)
+            Code of the operator
+        network: (str)
+            Name of the network
+
+        Return:
+        -------
+        numpy.ndarray: array of bool with shape (latitudes, longitudes)
+        """
+        if operator not in self.operators:
+            raise AttributeError("Provided operators are not available!")
+        if network not in self.networks:
+            raise AttributeError("Provided networks are not in the map!")
+        bit = np.uint8(1 << self.networks.index(network))
+        return self.flags[self.operators.index(operator)] & bit != 0
+
+    def save(self, path):
+        """
+        Write the map into a compressed NumPy file (.npz)
+
+        Parameters:
+        -----------
+        path: (str)
+            Path to the file
+        """
+        np.savez_compressed(path, operators=np.array(self.operators),
+                            networks=np.array(self.networks),
+                            flags=self.flags, distances=self.distances,
+                            bounds=np.array(self.bounds),
+                            steps=np.array([self.lat_step, self.ln_step]))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a map from a file written by save()
+
+        Parameters:
+        -----------
+        path: (str)
+            Path to the file
+
+        Return:
+        -------
+        CoverageMap: the map of the file
+        """
+        with np.load(path) as data:
+            return cls(data['operators'], data['networks'], data['flags'],
+                       data['distances'], data['bounds'], data['steps'])
+
+    def save_png(self, path, operator, network):
+        """
+        Write the cells covered by a network of an operator into a
+        black and white PNG image, north up, white for the covered
+        cells
+
+        Parameters:
+        -----------
+        path: (str)
+            Path to the image
+        operator: (int)
+            Code of the operator
+        network: (str)
+            Name of the network
+        """
+        pixels = np.where(self.covered(operator, network)[::-1], 255, 0) \
+            .astype(np.uint8)
+        height, width = pixels.shape
+
+        # Every line of a PNG starts with its filter type, 0 for none
+        lines = np.zeros((height, width + 1), dtype=np.uint8)
+        lines[:, 1:] = pixels
+
+        def block(kind, content):
+            return struct.pack('>I', len(content)) + kind + content \
+                + struct.pack('>I', zlib.crc32(kind + content))
+
+        with open(path, 'wb') as file:
+            file.write(b'\x89PNG\r\n\x1a\n')
+            file.write(block(b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                                  8, 0, 0, 0, 0)))
+            file.write(block(b'IDAT', zlib.compress(lines.tobytes(), 6)))
+            file.write(block(b'IEND', b''))
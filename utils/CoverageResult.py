@@ -0,0 +1,68 @@
+import json
+import math
+
+
+class CoverageResult:
+    """
+    Class to hold the coverage of the closest tower of every operator
+    for a location, read straight from the arrays of a TowerStore. It
+    only keeps flat lists, and is turned into the JSON of the API
+    without building the nested dicts of towers_coverage.
+
+    Parameters:
+    -----------
+    operators: (list of str)
+        Name of every operator
+    distances: (list of float)
+        Distance to the closest tower of every operator, in metres
+    networks: (list of str)
+        Name of every network
+    flags: (list of tuple)
+        1 or 0 for every network of the closest tower of every operator
+
+    A pydantic model, as the batch requests of the API use, is not used
+    here: the answer is built for every request and validating it would
+    cost more than the dicts it replaces.
+    """
+    __slots__ = ('operators', 'distances', 'networks', 'flags')
+
+    # Values of the flags in the answers, read the same from integer,
+    # float or boolean network columns
+    t_f = {1: 'true', 0: 'false'}
+
+    def __init__(self, operators, distances, networks, flags):
+        self.operators = operators
+        self.distances = distances
+        self.networks = networks
+        self.flags = flags
+
+    def to_dict(self):
+        """
+        Get the coverage in the format of TowerManager.towers_coverage
+
+        Return:
+        -------
+        dict: operator name as key and a dict with 'true' or 'false'
+        for every network and the 'distance' as value, None if it is not
+        finite (no tower of the operator provides the networks)
+        """
+        coverage = dict()
+        for operator, dist, flags in zip(self.operators, self.distances,
+                                         self.flags):
+            coverage[operator] = {net: self.t_f[flag] for net, flag
+                                  in zip(self.networks, flags)}
+            # Plain floats, as NumPy scalars are not serialised by json
+            dist = float(dist)
+            coverage[operator]['distance'] = round(dist, 1) \
+                if math.isfinite(dist) else None
+        return coverage
+
+    def to_json(self):
+        """
+        Get the coverage serialised into JSON
+
+        Return:
+        -------
+        bytes: the JSON answer
+        """
+        return json.dumps(self.to_dict()).encode()
@@ -0,0 +1,308 @@
+import numpy as np
+import pandas as pd
+
+from utils.Locator import CachedLocation, GeocodeCache
+
+
+class LocalGeocoder:
+    """
+    Class to geocode French addresses from a local address file, such
+    as the ones of the Base Adresse Nationale (BAN), without any
+    network call. Street and city names are normalised into tokens
+    (lower case, without accents, abbreviations expanded and without
+    articles) and indexed by commune and street, and the numbers of
+    every street are kept sorted in arrays, so a lookup is a couple of
+    dictionary accesses and a binary search. Communes are told apart by
+    their INSEE code, as many of them share their name.
+
+    Parameters:
+    -----------
+    streets: (dict)
+        Commune id as key and, as value, a dict with the normalised
+        street as key and a tuple (start, stop) with its positions in
+        the arrays as value
+    numbers: (numpy.ndarray)
+        Number of every address, -1 if it has none, sorted by street
+    repetitions: (numpy.ndarray)
+        Repetition index of every address ('bis', 'ter', ...), '' if it
+        has none
+    latitudes: (numpy.ndarray)
+        Latitude of every address
+    longitudes: (numpy.ndarray)
+        Longitude of every address
+    cities: (dict)
+        Normalised city as key and the list of the ids of the communes
+        with that name as value
+    postcodes: (dict)
+        Postcode as key and the set of the ids of the communes using it
+        as value
+    """
+    # Columns of the address file, as named in the BAN files. The
+    # repetition and the INSEE code may be missing, the postcode is then
+    # used to tell the communes apart.
+    columns = {'number': 'numero', 'repetition': 'rep',
+               'street': 'nom_voie', 'postcode': 'code_postal',
+               'insee': 'code_insee', 'city': 'nom_commune',
+               'latitude': 'lat', 'longitude': 'lon'}
+    optional_columns = {'repetition', 'insee'}
+
+    # Usual abbreviations of the French addresses
+    abbreviations = {'av': 'avenue', 'ave': 'avenue', 'bd': 'boulevard',
+                     'bld': 'boulevard', 'boul': 'boulevard', 'r': 'rue',
+                     'pl': 'place', 'ch': 'chemin', 'chem': 'chemin',
+                     'rte': 'route', 'imp': 'impasse', 'all': 'allee',
+                     'sq': 'square', 'qu': 'quai', 'crs': 'cours',
+                     'fg': 'faubourg', 'fbg': 'faubourg', 'st': 'saint',
+                     'ste': 'sainte', 'pte': 'porte', 'res': 'residence'}
+
+    # Words ignored in the names
+    stopwords = {'de', 'du', 'des', 'la', 'le', 'les', 'l', 'd', 'et',
+                 'a', 'au', 'aux', 'france', 'bis', 'ter', 'quater'}
+
+    # Repetition indexes written apart from their number
+    repetition_words = {'bis', 'ter', 'quater', 'quinquies'}
+
+    def __init__(self, streets, numbers, repetitions, latitudes, longitudes,
+                 cities, postcodes):
+        self.streets = streets
+        self.numbers = numbers
+        self.repetitions = repetitions
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.cities = cities
+        self.postcodes = postcodes
+
+        # Longest city name, in tokens, to look for it at the end of
+        # the addresses
+        self.city_tokens = max((len(city.split()) for city in cities),
+                               default=0)
+
+    @classmethod
+    def from_csv(cls, path, sep=';'):
+        """
+        Create a LocalGeocoder from an address file
+
+        Parameters:
+        -----------
+        path: (str)
+            Path to the csv file, with the columns of the class
+
+        [OPTIONALS]
+        sep: (str)
+            Separator of the csv file. If none is provided, ';' will be
+            used, as in the BAN files.
+
+        Return:
+        -------
+        LocalGeocoder: geocoder of the addresses of the file
+        """
+        names = set(cls.columns.values())
+        data = pd.read_csv(path, sep=sep, usecols=lambda c: c in names,
+                           dtype={cls.columns[name]: str for name
+                                  in ('postcode', 'insee', 'repetition')})
+        data = data.rename(columns={column: name for name, column
+                                    in cls.columns.items()})
+        missing = set(cls.columns) - cls.optional_columns - set(data.columns)
+        if missing:
+            raise AttributeError("Address file does not contain the "
+                                 "minimum expected columns!")
+        data = data.dropna(subset=['street', 'city', 'latitude',
+                                   'longitude'])
+        return cls.from_data_frame(data)
+
+    @classmethod
+    def from_data_frame(cls, data):
+        """
+        Create a LocalGeocoder from a pandas.DataFrame with the columns
+        'number', 'street', 'postcode', 'city', 'latitude' and
+        'longitude', and optionally 'repetition' and 'insee'
+        """
+        postcodes = data['postcode'].fillna('').astype(str).str.zfill(5)
+        insee = postcodes if 'insee' not in data \
+            else data['insee'].fillna(postcodes).astype(str)
+        repetitions = pd.Series('', index=data.index) \
+            if 'repetition' not in data \
+            else data['repetition'].fillna('').astype(str).str.lower()
+
+        # Communes by INSEE code and name, and streets by normalised
+        # name, so that different names of the same street are merged
+        communes, commune_keys = pd.factorize(insee + '|' + data['city'])
+        codes = dict()
+        for postcode, commune in set(zip(postcodes, communes.tolist())):
+            if postcode.strip('0'):
+                codes.setdefault(postcode, set()).add(commune)
+        streets, street_names = pd.factorize(data['street'])
+        street_keys, street_names = pd.factorize(pd.Index(
+            [cls.normalise(name) for name in street_names]))
+        streets = street_keys[streets]
+        numbers = pd.to_numeric(data['number'], errors='coerce') \
+            .fillna(-1).to_numpy(dtype=np.int32)
+        repetition_codes, _ = pd.factorize(repetitions, sort=True)
+
+        # Sort the addresses by commune, street, number and repetition,
+        # the addresses without repetition first
+        order = np.lexsort((repetition_codes, numbers, streets, communes))
+        communes, streets, numbers = communes[order], streets[order], \
+            numbers[order]
+        repetitions = repetitions.to_numpy(dtype=object)[order]
+        latitudes = data['latitude'].to_numpy(dtype=np.float64)[order]
+        longitudes = data['longitude'].to_numpy(dtype=np.float64)[order]
+
+        # Positions of every street of every commune
+        changes = np.flatnonzero((np.diff(communes) != 0)
+                                 | (np.diff(streets) != 0)) + 1
+        starts = np.concatenate(([0], changes)).tolist() if len(order) \
+            else []
+        stops = np.concatenate((changes, [len(order)])).tolist()
+        index = dict()
+        for start, stop in zip(starts, stops):
+            index.setdefault(int(communes[start]), dict())[
+                street_names[streets[start]]] = (start, stop)
+
+        # Communes of every city name
+        cities = dict()
+        for commune, key in enumerate(commune_keys):
+            cities.setdefault(cls.normalise(key.split('|', 1)[1]),
+                              []).append(commune)
+
+        return cls(index, numbers, repetitions, latitudes, longitudes,
+                   cities, codes)
+
+    @classmethod
+    def tokens(cls, text):
+        """
+        Split a text into normalised tokens, with the abbreviations
+        expanded
+        """
+        return [cls.abbreviations.get(token, token)
+                for token in GeocodeCache.normalise(text).split()]
+
+    @classmethod
+    def normalise(cls, name):
+        """
+        Get the key of a street or city name
+        """
+        return ' '.join(token for token in cls.tokens(name)
+                        if token not in cls.stopwords)
+
+    def geocode(self, address):
+        """
+        Get the location of an address
+
+        Parameters:
+        -----------
+        address: (str)
+            Address to geocode, as '<number> <street> <postcode> <city>'
+            where the number and the postcode are optional
+
+        Return:
+        -------
+        CachedLocation: the location, or None if it can not be found or
+        the street is in several communes with the same name
+        """
+        number, repetition, postcode, words = None, None, None, []
+        for token in self.tokens(address):
+            digits = token.rstrip('abcdefghijklmnopqrstuvwxyz')
+            if len(token) == 5 and token.isdigit() and postcode is None:
+                postcode = token
+            elif digits.isdigit() and number is None and not words:
+                number = int(digits)
+                repetition = token[len(digits):] or None
+            elif number is not None and repetition is None and not words \
+                    and token in self.repetition_words:
+                repetition = token
+            elif token not in self.stopwords:
+                words.append(token)
+
+        # The city is at the end of the address
+        found = []
+        for size in range(min(self.city_tokens, len(words) - 1), 0, -1):
+            communes = [commune for commune
+                        in self.cities.get(' '.join(words[-size:]), ())
+                        if postcode is None
+                        or commune in self.postcodes.get(postcode, ())]
+            found = self.find_streets(communes, words[:-size])
+            if found:
+                break
+
+        # Or only given by the postcode
+        if not found:
+            found = self.find_streets(self.postcodes.get(postcode, ()),
+                                      words)
+
+        # The same street in communes with the same name is ambiguous
+        if len(found) != 1:
+            return None
+        return self.find_number(found[0], number, repetition)
+
+    def find_streets(self, communes, words):
+        """
+        Get the positions of a street in some communes
+
+        Return:
+        -------
+        list of tuple: (start, stop) positions of the street in every
+        commune where it is found
+        """
+        found = [self.find_street(commune, words) for commune in communes]
+        return [positions for positions in found if positions is not None]
+
+    def find_street(self, commune, words):
+        """
+        Get the positions of a street of a commune, looking for the name
+        with the most tokens in common if it is not written exactly
+
+        Return:
+        -------
+        tuple: (start, stop) positions of the street, or None if there
+        is no such street
+        """
+        streets = self.streets.get(commune, {})
+        found = streets.get(' '.join(words))
+        if found is not None or not words:
+            return found
+
+        # Jaccard similarity of the tokens, more than one half
+        tokens = set(words)
+        best, score = None, 0.5
+        for street, positions in streets.items():
+            street_tokens = set(street.split())
+            similarity = len(tokens & street_tokens) \
+                / len(tokens | street_tokens)
+            if similarity > score:
+                best, score = positions, similarity
+        return best
+
+    def find_number(self, positions, number, repetition=None):
+        """
+        Get the location of a number of a street, the closest one if
+        the number is not known, or the middle of the street if no
+        number is given. Among the addresses with the number, the one
+        with the repetition index asked is kept, or the one without any.
+
+        Return:
+        -------
+        CachedLocation: the location
+        """
+        start, stop = positions
+        if number is None:
+            return CachedLocation(
+                float(self.latitudes[start:stop].mean()),
+                float(self.longitudes[start:stop].mean()))
+
+        numbers = self.numbers[start:stop]
+        i = int(np.searchsorted(numbers, number, side='left'))
+        last = int(np.searchsorted(numbers, number, side='right'))
+        if i < last:
+            matches = np.flatnonzero(self.repetitions[start + i:start + last]
+                                     == (repetition or ''))
+            if len(matches):
+                i += int(matches[0])
+        elif i == len(numbers) or (i > 0 and number - numbers[i - 1]
+                                   < numbers[i] - number):
+            i -= 1
+        return CachedLocation(float(self.latitudes[start + i]),
+                              float(self.longitudes[start + i]))
+
+    def __len__(self):
+        return len(self.numbers)
@@ -1,7 +1,582 @@
+import asyncio
+import httpx
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from collections import OrderedDict, namedtuple
 from geopy.geocoders import Nominatim
+from math import isfinite
+
+# Bounding box of metropolitan France, as (minimum, maximum) degrees
+france_bounds = {'latitude': (41.59101, 51.03457),
+                 'longitude': (-4.65, 9.45)}
+
+# Location given back by the cache, with the attributes of a geopy
+# Location that the Locator uses
+CachedLocation = namedtuple('CachedLocation', ['latitude', 'longitude'])
+
+
+class GeocodeCache:
+    """
+    Class to cache the results of a geocoder. Addresses are normalised
+    before being used as keys, so that the same address written in a
+    slightly different way is only geocoded once. Results are kept in
+    memory (least recently used ones are dropped first) and, if a path
+    is provided, in a SQLite database that survives restarts. Addresses
+    that can not be found are cached too.
+
+    Parameters:
+    -----------
+    [OPTIONALS]
+    maxsize: (int)
+        Maximum number of addresses kept in memory. If none is
+        provided, 4096 will be used.
+    ttl: (float)
+        Seconds a found address is kept. If none is provided, a week
+        will be used.
+    negative_ttl: (float)
+        Seconds a not found address is kept. If none is provided, an
+        hour will be used.
+    path: (str)
+        Path of the SQLite database. If none is provided, the cache is
+        only kept in memory.
+    clock: (function)
+        Function giving the current time in seconds
+    """
+    def __init__(self, maxsize=4096, ttl=7 * 24 * 3600,
+                 negative_ttl=3600, path=None, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+
+        # Cached addresses: key -> (expiration time, location or None)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        # Counters of the cache
+        self.hits = 0
+        self.misses = 0
+
+        # Asynchronous geocodes in progress: key -> asyncio.Future
+        self.pending = dict()
+
+        # On disk cache, opened by every process using it (connections
+        # can not be shared by forked processes) and only used by one
+        # thread at a time
+        self.path = path
+        self._connection = None
+        self._connection_pid = None
+        self.disk_lock = threading.Lock()
+
+    @staticmethod
+    def normalise(address):
+        """
+        Get the key of an address: lower case, without accents,
+        punctuation or repeated spaces
+
+        Parameters:
+        -----------
+        address: (str)
+            Address to normalise
+
+        Return:
+        -------
+        str: the normalised address
+        """
+        address = unicodedata.normalize('NFKD', str(address))
+        address = ''.join(c for c in address
+                          if not unicodedata.combining(c))
+        address = re.sub(r'[^\w]+', ' ', address.lower())
+        return address.strip()
+
+    def get(self, address):
+        """
+        Look for an address in the cache
+
+        Parameters:
+        -----------
+        address: (str)
+            Address to look for
+
+        Return:
+        -------
+        tuple: (found, location), where location is None for cached
+        addresses that could not be geocoded
+        """
+        key = self.normalise(address)
+        now = self.clock()
+        with self.lock:
+            entry = self.entries.get(key)
+
+        # The disk is read without holding the memory cache
+        if entry is None and self.path is not None:
+            entry = self.read_disk(key)
+
+        with self.lock:
+            if entry is not None and entry[0] > now:
+                self.entries[key] = entry
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+
+            # Not found or expired
+            self.entries.pop(key, None)
+            self.misses += 1
+            return False, None
+
+    def set(self, address, location):
+        """
+        Store the location of an address
+
+        Parameters:
+        -----------
+        address: (str)
+            Address that was geocoded
+        location: (geopy.Location)
+            Location of the address, or None if it was not found
+        """
+        key = self.normalise(address)
+        if location is None:
+            expires = self.clock() + self.negative_ttl
+        else:
+            location = CachedLocation(location.latitude, location.longitude)
+            expires = self.clock() + self.ttl
+
+        with self.lock:
+            self.entries[key] = (expires, location)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        if self.path is not None:
+            self.write_disk(key, expires, location)
+
+    @property
+    def connection(self):
+        """
+        Connection of the current process to the on disk cache, opened
+        the first time it is requested
+        """
+        if self._connection is None or self._connection_pid != os.getpid():
+            self._connection = sqlite3.connect(self.path,
+                                               check_same_thread=False)
+            self._connection_pid = os.getpid()
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS geocodes (key TEXT PRIMARY KEY,"
+                " latitude REAL, longitude REAL, expires REAL)")
+            self._connection.commit()
+        return self._connection
+
+    def read_disk(self, key):
+        """
+        Read an entry of the on disk cache, None if there is none
+        """
+        with self.disk_lock:
+            row = self.connection.execute(
+                "SELECT expires, latitude, longitude FROM geocodes "
+                "WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        expires, latitude, longitude = row
+        if latitude is None:
+            return expires, None
+        return expires, CachedLocation(latitude, longitude)
+
+    def write_disk(self, key, expires, location):
+        """
+        Write an entry into the on disk cache
+        """
+        latitude = None if location is None else location.latitude
+        longitude = None if location is None else location.longitude
+        with self.disk_lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?)",
+                (key, latitude, longitude, expires))
+            self.connection.commit()
+
+    def geocode(self, address, geocoder):
+        """
+        Get the location of an address, asking the geocoder only when
+        the address is not cached
+
+        Parameters:
+        -----------
+        address: (str)
+            Address to geocode
+        geocoder: (geopy.geocoders.Geocoder)
+            Any object with a geocode(address) method
+
+        Return:
+        -------
+        geopy.Location: the location, or None if it can not be found
+        """
+        found, location = self.get(address)
+        if not found:
+            location = geocoder.geocode(str(address))
+            self.set(address, location)
+        return location
+
+    async def geocode_async(self, address, geocoder):
+        """
+        Same as geocode() for an asynchronous geocoder. Concurrent
+        calls for the same address share a single call to the geocoder.
+
+        Parameters:
+        -----------
+        address: (str)
+            Address to geocode
+        geocoder: (AsyncNominatim)
+            Any object with an async geocode(address) method
+
+        Return:
+        -------
+        geopy.Location: the location, or None if it can not be found
+        """
+        # The on disk cache is read and written out of the event loop
+        loop = asyncio.get_running_loop()
+        if self.path is None:
+            found, location = self.get(address)
+        else:
+            found, location = await loop.run_in_executor(None, self.get,
+                                                         address)
+        if found:
+            return location
+
+        # Wait for the geocode of the same address if there is one
+        key = self.normalise(address)
+        if key in self.pending:
+            return await asyncio.shield(self.pending[key])
+
+        future = loop.create_future()
+        self.pending[key] = future
+        try:
+            location = await geocoder.geocode(str(address))
+            if self.path is None:
+                self.set(address, location)
+            else:
+                await loop.run_in_executor(None, self.set, address, location)
+        except Exception as error:
+            future.set_exception(error)
+            # Retrieve it, as there may be no one else waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(location)
+        finally:
+            # Do not leave anyone waiting if the call was cancelled
+            if not future.done():
+                future.cancel()
+            del self.pending[key]
+        return location
+
+    def stats(self):
+        """
+        Counters of the cache
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.entries)}
 
 
-class Locator:
+class AsyncNominatim:
+    """
+    Asynchronous client of the Nominatim search service. All the
+    requests share a pool of connections and no more than
+    max_concurrency of them are sent at the same time.
+
+    Parameters:
+    -----------
+    [OPTIONALS]
+    user_agent: (str)
+        User agent sent to Nominatim
+    max_concurrency: (int)
+        Maximum number of requests sent at the same time. If none is
+        provided, 4 will be used.
+    timeout: (float)
+        Seconds to wait for an answer. If none is provided, 10 will be
+        used.
+    """
+    url = 'https://nominatim.openstreetmap.org/search'
+
+    def __init__(self, user_agent='JG-papernest', max_concurrency=4,
+                 timeout=10):
+        self.user_agent = user_agent
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+
+        # Connections and limit belong to the event loop using them
+        self.loop = None
+        self.client = None
+        self.semaphore = None
+
+    def session(self):
+        """
+        Get the client and the semaphore of the running event loop,
+        creating them the first time they are needed
+        """
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.client = httpx.AsyncClient(
+                headers={'User-Agent': self.user_agent},
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_concurrency))
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self.client, self.semaphore
+
+    async def geocode(self, address):
+        """
+        Get the location of an address
+
+        Parameters:
+        -----------
+        address: (str)
+            Address to geocode
+
+        Return:
+        -------
+        CachedLocation: the location, or None if it can not be found
+        """
+        client, semaphore = self.session()
+        async with semaphore:
+            response = await client.get(self.url, params={
+                'q': address, 'format': 'json', 'limit': 1})
+        response.raise_for_status()
+        results = response.json()
+        if not results:
+            return None
+        return CachedLocation(float(results[0]['lat']),
+                              float(results[0]['lon']))
+
+    async def close(self):
+        """
+        Close the connections of the client
+        """
+        if self.client is not None:
+            await self.client.aclose()
+            self.loop = None
+            self.client = None
+
+
+class FallbackGeocoder:
+    """
+    Geocoder asking a primary geocoder first and a fallback one only
+    for the addresses the primary one does not find, e.g. a
+    LocalGeocoder backed by Nominatim.
+
+    Parameters:
+    -----------
+    primary: (object)
+        Any object with a geocode(address) method
+
+    [OPTIONALS]
+    fallback: (object)
+        Any object with a geocode(address) method. If none is
+        provided, only the primary geocoder is asked.
+    """
+    def __init__(self, primary, fallback=None):
+        self.primary = primary
+        self.fallback = fallback
+
+    def geocode(self, address):
+        """
+        Get the location of an address
+
+        Return:
+        -------
+        The location, or None if it can not be found
+        """
+        location = self.primary.geocode(address)
+        if location is None and self.fallback is not None:
+            location = self.fallback.geocode(address)
+        return location
+
+
+class AsyncFallbackGeocoder(FallbackGeocoder):
+    """
+    Same as the FallbackGeocoder, with a fallback geocoder that is
+    asynchronous (e.g. AsyncNominatim). The primary geocoder is a
+    synchronous one answering without waiting (e.g. a LocalGeocoder).
+    """
+    async def geocode(self, address):
+        """
+        Same as FallbackGeocoder.geocode()
+        """
+        location = self.primary.geocode(address)
+        if location is None and self.fallback is not None:
+            location = await self.fallback.geocode(address)
+        return location
+
+    async def close(self):
+        """
+        Close the connections of the fallback geocoder
+        """
+        if self.fallback is not None:
+            await self.fallback.close()
+
+
+# Geocoders and cache shared by every Locator of the process. The
+# geocoders are created the first time they are requested, see
+# set_geocoders(). The cache is also kept on disk, and survives
+# restarts, when JG_GEOCODE_CACHE gives the path of its database.
+geocode_cache = GeocodeCache(path=os.environ.get('JG_GEOCODE_CACHE'))
+async_geocoder = None
+_geocoder = None
+_geocoders_lock = threading.RLock()
+
+
+def get_geocoder():
+    """
+    Get the geocoder of the process, created the first time it is
+    requested
+    """
+    if _geocoder is None:
+        with _geocoders_lock:
+            if _geocoder is None:
+                set_geocoders()
+    return _geocoder
+
+
+def get_async_geocoder():
+    """
+    Get the asynchronous geocoder of the process, created the first
+    time it is requested
+    """
+    if async_geocoder is None:
+        with _geocoders_lock:
+            if async_geocoder is None:
+                set_geocoders()
+    return async_geocoder
+
+
+def set_geocoders(address_path=None, fallback=None):
+    """
+    Create the geocoders of the process. With an address file, the
+    addresses are looked for locally by a LocalGeocoder, and only the
+    ones it does not know are sent to Nominatim. Without it, they are
+    all sent to Nominatim.
+
+    Parameters:
+    -----------
+    [OPTIONALS]
+    address_path: (str)
+        Path to a BAN-style address file. If none is provided, the
+        JG_ADDRESS_FILE environment variable will be used, if any.
+    fallback: (bool)
+        If False, addresses that are not in the address file are not
+        sent to Nominatim. If none is provided, the
+        JG_GEOCODER_FALLBACK environment variable will be used, True
+        by default.
+    """
+    global _geocoder, async_geocoder
+    # Imported here, as the LocalGeocoder depends on this module
+    from utils.LocalGeocoder import LocalGeocoder
+
+    address_path = address_path or os.environ.get('JG_ADDRESS_FILE')
+    if fallback is None:
+        fallback = os.environ.get('JG_GEOCODER_FALLBACK', '1') != '0'
+
+    with _geocoders_lock:
+        if not address_path:
+            _geocoder = Nominatim(user_agent='JG-papernest')
+            async_geocoder = AsyncNominatim()
+            return
+
+        local = LocalGeocoder.from_csv(address_path)
+        _geocoder = FallbackGeocoder(
+            local, Nominatim(user_agent='JG-papernest') if fallback else None)
+        async_geocoder = AsyncFallbackGeocoder(
+            local, AsyncNominatim() if fallback else None)
+
+
+async def close_geocoders():
+    """
+    Close the connections of the asynchronous geocoder of the process,
+    if it has been created
+    """
+    if async_geocoder is not None:
+        await async_geocoder.close()
+
+
+class LocationError(AttributeError):
+    """
+    Error raised when a location can not be used. It is an
+    AttributeError, as every other error of the checks, that also gives
+    the HTTP status and the code the API answers it with.
+
+    Parameters:
+    -----------
+    message: (str)
+        Description of the error, for the user
+
+    [OPTIONALS]
+    status: (int)
+        HTTP status of the answer. If none is provided, 400 will be
+        used.
+    code: (str)
+        Short name of the error, for the programs calling the API. If
+        none is provided, 'invalid_request' will be used.
+    """
+    def __init__(self, message, status=400, code='invalid_request'):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+
+
+class Coordinates:
+    """
+    Class to hold a location given by its coordinates, ensuring that
+    they are numbers inside the coordinates of France.
+
+    Parameters:
+    -----------
+    latitude: (float)
+        Latitude of the location
+    longitude: (float)
+        Longitude of the location
+    """
+    def __init__(self, latitude, longitude):
+        self.latitude = latitude
+        self.longitude = longitude
+
+        # Check the coordinates are numbers
+        self.check_coordinates_value()
+
+        # Check the location is in France
+        self.check_location()
+
+    def check_coordinates_value(self):
+        """
+        Method to check that the coordinates are actual numbers
+        """
+        try:
+            self.latitude = float(self.latitude)
+            self.longitude = float(self.longitude)
+        except (TypeError, ValueError):
+            self.latitude = self.longitude = float('nan')
+
+        if not (isfinite(self.latitude) and isfinite(self.longitude)):
+            raise LocationError("Sorry, the coordinates provided are "
+                                "not valid, check the url!",
+                                code='invalid_coordinates')
+
+    def check_location(self):
+        """
+        Method to check if the location is in France
+        """
+        lat_min, lat_max = france_bounds['latitude']
+        ln_min, ln_max = france_bounds['longitude']
+        if self.latitude < lat_min or self.latitude > lat_max \
+                or self.longitude < ln_min or self.longitude > ln_max:
+            raise LocationError("Sorry, your location must be in "
+                                "France to return a precise result",
+                                status=422, code='out_of_france')
+
+
+class Locator(Coordinates):
     """
     Class to generate a Location and ensure that it has the necessary parameters
     when created. Expected to have a non None address, that can be found
@@ -12,13 +587,72 @@ class Locator:
     address: (str)
         An actual address that will be used to create a Locator. It is
         expected to be a real address in France
+
+    [OPTIONALS]
+    geocoder: (geopy.geocoders.Geocoder)
+        Any object with a geocode(address) method. If none is provided,
+        the geocoder of the process will be used, see set_geocoders().
+    cache: (GeocodeCache)
+        Cache in front of the geocoder. If none is provided, the one
+        shared by the process will be used.
     """
-    def __init__(self, address):
+    # Limits of the addresses sent to the geocoder
+    max_address_length = 200
+    max_word_length = 35
+    vowels = set('aeiouy')
+
+    # Countries that end the addresses outside France
+    foreign_countries = {'spain', 'espana', 'espagne', 'germany',
+                         'deutschland', 'allemagne', 'italy', 'italia',
+                         'italie', 'belgium', 'belgique', 'belgie',
+                         'switzerland', 'suisse', 'schweiz', 'svizzera',
+                         'portugal', 'netherlands', 'nederland',
+                         'pays bas', 'united kingdom', 'uk', 'england',
+                         'royaume uni', 'usa', 'united states',
+                         'etats unis', 'canada', 'maroc', 'morocco',
+                         'algerie', 'tunisie'}
+
+    def __init__(self, address, geocoder=None, cache=None):
         self.check_address_value(address)
 
-        # Generate a location from the address
-        geolocator = Nominatim(user_agent='JG-papernest')
-        self.location = geolocator.geocode(str(address))
+        # Generate a location from the address, asking the geocoder
+        # only if the address is not cached
+        geocoder = geocoder or get_geocoder()
+        cache = cache or geocode_cache
+        self.set_location(cache.geocode(str(address), geocoder))
+
+    @classmethod
+    async def locate(cls, address, geocoder=None, cache=None):
+        """
+        Create a Locator without blocking the event loop while the
+        address is geocoded
+
+        Parameters:
+        -----------
+        Same as the Locator, with an asynchronous geocoder. If none is
+        provided, the asynchronous geocoder of the process will be
+        used.
+
+        Return:
+        -------
+        Locator: the Locator of the address
+        """
+        cls.check_address_value(address)
+
+        geocoder = geocoder or get_async_geocoder()
+        cache = cache or geocode_cache
+        location = await cache.geocode_async(str(address), geocoder)
+
+        locator = cls.__new__(cls)
+        locator.set_location(location)
+        return locator
+
+    def set_location(self, location):
+        """
+        Store the geocoded location and its coordinates, ensuring that
+        it exists and that it is in France
+        """
+        self.location = location
 
         # Check the location is not None
         self.check_location_value()
@@ -30,14 +664,38 @@ class Locator:
         # Check the location is in France
         self.check_location()
 
-    @staticmethod
-    def check_address_value(address):
+    @classmethod
+    def check_address_value(cls, address):
         """
-        Check that the address is not None
+        Check that the address is not None and that it may be an
+        address in France, before asking the geocoder. Addresses that
+        are too long, without letters, with words that can not be
+        French or ending with a foreign country are rejected right
+        away.
         """
-        if address is None:
-            raise AttributeError("Sorry, no address has been "
-                                 "recognized, check the url!")
+        words = [] if address is None \
+            else GeocodeCache.normalise(address).split()
+        if not words:
+            raise LocationError("Sorry, no address has been "
+                                "recognized, check the url!",
+                                code='missing_address')
+
+        if len(str(address)) > cls.max_address_length \
+                or not any(c.isalpha() for c in ''.join(words)) \
+                or any(len(word) > cls.max_word_length
+                       or (len(word) >= 6 and word.isalpha()
+                           and not cls.vowels.intersection(word))
+                       for word in words):
+            raise LocationError("Sorry, the address provided is not "
+                                "valid, check the url!", status=422,
+                                code='invalid_address')
+
+        # The country is written after the last comma
+        country = GeocodeCache.normalise(str(address).rsplit(',', 1)[-1])
+        if ',' in str(address) and country in cls.foreign_countries:
+            raise LocationError("Sorry, your location must be in "
+                                "France to return a precise result",
+                                status=422, code='out_of_france')
 
     def check_location_value(self):
         """
@@ -45,15 +703,7 @@ class Locator:
         and it is not None
         """
         if self.location is None:
-            raise AttributeError("Sorry, we were not able to "
-                                 "find your address, please "
-                                 "try another closer one")
-
-    def check_location(self):
-        """
-        Method to check if the location is in France
-        """
-        if self.latitude < 41.59101 or self.latitude > 51.03457 \
-                or self.longitude < -4.65 or self.longitude > 9.45:
-            raise AttributeError("Sorry, your location must be in "
-                                 "France to return a precise result")
+            raise LocationError("Sorry, we were not able to "
+                                "find your address, please "
+                                "try another closer one",
+                                status=404, code='address_not_found')
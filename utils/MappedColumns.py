@@ -0,0 +1,76 @@
+import numpy as np
+
+
+class CodedColumn:
+    """
+    Class to read a column stored as the positions of its values in a
+    small table, such as the operators of a binary TowerStore. The
+    positions stay in the memory-mapped file, so every process reading
+    it shares them, and only the rows that are read are decoded.
+
+    Parameters:
+    -----------
+    positions: (numpy.ndarray)
+        Position of the value of every row in values
+    values: (numpy.ndarray)
+        Distinct values of the column
+    """
+    def __init__(self, positions, values):
+        self.positions = positions
+        self.values = values
+        self.dtype = values.dtype
+        self.shape = positions.shape
+
+    def __getitem__(self, key):
+        return self.values[self.positions[key]]
+
+    def __eq__(self, value):
+        # Compare the positions, without decoding the column
+        found = np.flatnonzero(self.values == value)
+        if len(found) == 0:
+            return np.zeros(self.shape, dtype=bool)
+        return self.positions == found[0]
+
+    def __ne__(self, value):
+        return ~(self == value)
+
+    # Compared element-wise, as a numpy.ndarray
+    __hash__ = None
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __array__(self, dtype=None, copy=None):
+        column = self.values[self.positions]
+        return column if dtype is None else column.astype(dtype)
+
+
+class BitColumn:
+    """
+    Class to read a column of 0 and 1 stored as one bit of a column of
+    bytes, such as the networks of a binary TowerStore. The bytes stay
+    in the memory-mapped file, so every process reading it shares them,
+    and only the rows that are read are decoded.
+
+    Parameters:
+    -----------
+    flags: (numpy.ndarray)
+        Bytes holding the bit of every row
+    bit: (int)
+        Position of the bit of the column in the bytes
+    """
+    def __init__(self, flags, bit):
+        self.flags = flags
+        self.bit = bit
+        self.dtype = flags.dtype
+        self.shape = flags.shape
+
+    def __getitem__(self, key):
+        return (self.flags[key] >> self.bit) & 1
+
+    def __len__(self):
+        return len(self.flags)
+
+    def __array__(self, dtype=None, copy=None):
+        column = (np.asarray(self.flags) >> self.bit) & 1
+        return column if dtype is None else column.astype(dtype)
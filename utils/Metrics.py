@@ -0,0 +1,228 @@
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+
+# Seconds limiting the buckets of the histograms
+default_buckets = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01,
+                   0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class Counter:
+    """
+    Class to count events, optionally split by the value of a label.
+    Instead of being increased, its values can be read from a callback
+    when the metrics are exported.
+
+    Parameters:
+    -----------
+    registry: (MetricsRegistry)
+        Registry the counter belongs to
+    name: (str)
+        Name of the counter
+    description: (str)
+        Text describing the counter
+
+    [OPTIONALS]
+    label: (str)
+        Name of the label splitting the values
+    callback: (function)
+        Function returning a dict with the label value as key and the
+        count as value
+    """
+    kind = 'counter'
+
+    def __init__(self, registry, name, description, label=None,
+                 callback=None):
+        self.registry = registry
+        self.name = name
+        self.description = description
+        self.label = label
+        self.callback = callback
+        self.values = dict()
+        self.lock = threading.Lock()
+
+    def inc(self, label=None, value=1):
+        """
+        Increase the count of a label value
+        """
+        if not self.registry.enabled:
+            return
+        with self.lock:
+            self.values[label] = self.values.get(label, 0) + value
+
+    def samples(self):
+        """
+        Get the current values of the counter
+
+        Return:
+        -------
+        list of tuple: (suffix, labels, value) of every sample
+        """
+        values = self.callback() if self.callback else dict(self.values)
+        return [('', self.labels(label), value)
+                for label, value in values.items()]
+
+    def labels(self, label, **others):
+        """
+        Format the labels of a sample
+        """
+        labels = OrderedDict()
+        if self.label is not None:
+            labels[self.label] = label
+        labels.update(others)
+        return labels
+
+
+class Histogram(Counter):
+    """
+    Class to measure how long something takes, optionally split by the
+    value of a label. Same parameters as the Counter, plus:
+
+    Parameters:
+    -----------
+    [OPTIONALS]
+    buckets: (tuple of float)
+        Upper limits of the buckets, in seconds
+    """
+    kind = 'histogram'
+
+    def __init__(self, registry, name, description, label=None,
+                 buckets=default_buckets):
+        super().__init__(registry, name, description, label=label)
+        self.buckets = buckets
+
+    def observe(self, seconds, label=None):
+        """
+        Add a measure of a label value
+        """
+        if not self.registry.enabled:
+            return
+        with self.lock:
+            # Value of a label: [count per bucket, sum, count]
+            value = self.values.get(label)
+            if value is None:
+                value = self.values[label] = [[0] * len(self.buckets),
+                                              0.0, 0]
+            for i, limit in enumerate(self.buckets):
+                if seconds <= limit:
+                    value[0][i] += 1
+            value[1] += seconds
+            value[2] += 1
+
+    def time(self, label=None):
+        """
+        Get a context manager measuring its block, which does nothing
+        when the registry is disabled
+        """
+        if not self.registry.enabled:
+            return nullcontext()
+        return self.timer(label)
+
+    @contextmanager
+    def timer(self, label):
+        """
+        Context manager measuring its block
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, label=label)
+
+    def samples(self):
+        """
+        Same as Counter.samples(), with the buckets, sum and count of
+        every label value
+        """
+        with self.lock:
+            values = {label: (list(counts), total, count) for label,
+                      (counts, total, count) in self.values.items()}
+        samples = []
+        for label, (counts, total, count) in values.items():
+            for limit, bucket in zip(self.buckets, counts):
+                samples.append(('_bucket',
+                                self.labels(label, le=repr(limit)), bucket))
+            samples.append(('_bucket', self.labels(label, le='+Inf'), count))
+            samples.append(('_sum', self.labels(label), total))
+            samples.append(('_count', self.labels(label), count))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Class to hold the metrics of the process and export them in the
+    Prometheus text format.
+
+    Parameters:
+    -----------
+    [OPTIONALS]
+    enabled: (bool)
+        If False, metrics are not recorded. If none is provided, True
+        will be used.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.metrics = OrderedDict()
+
+    def counter(self, name, description, label=None, callback=None):
+        """
+        Create a Counter in the registry
+        """
+        self.metrics[name] = Counter(self, name, description, label=label,
+                                     callback=callback)
+        return self.metrics[name]
+
+    def histogram(self, name, description, label=None,
+                  buckets=default_buckets):
+        """
+        Create a Histogram in the registry
+        """
+        self.metrics[name] = Histogram(self, name, description,
+                                       label=label, buckets=buckets)
+        return self.metrics[name]
+
+    def render(self):
+        """
+        Export the metrics
+
+        Return:
+        -------
+        str: the metrics in the Prometheus text format
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines.append('# HELP {} {}'.format(metric.name,
+                                               metric.description))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            for suffix, labels, value in metric.samples():
+                text = ','.join('{}="{}"'.format(
+                    key, str(label).replace('\\', '\\\\')
+                    .replace('"', '\\"').replace('\n', '\\n'))
+                    for key, label in labels.items())
+                lines.append('{}{}{} {}'.format(
+                    metric.name, suffix, '{' + text + '}' if text else '',
+                    value))
+        return '\n'.join(lines) + '\n'
+
+
+# Registry of the process and the metrics shared by the modules,
+# disabled when JG_METRICS is 0
+registry = MetricsRegistry(enabled=os.environ.get('JG_METRICS', '1') != '0')
+stage_seconds = registry.histogram(
+    'jg_stage_seconds', "Seconds spent in every stage of a request",
+    label='stage')
+requests_total = registry.counter(
+    'jg_requests_total', "Requests received", label='endpoint')
+errors_total = registry.counter(
+    'jg_errors_total', "Requests answered with an error", label='message')
+grid_lookups_total = registry.counter(
+    'jg_grid_lookups_total',
+    "Closest tower searches of an operator answered, or not, by the "
+    "coverage grid",
+    label='result')
+tower_store_reloads_total = registry.counter(
+    'jg_tower_store_reloads_total',
+    "Reloads of the tower database, by result", label='result')
@@ -0,0 +1,229 @@
+import threading
+import numpy as np
+
+from scipy.spatial import cKDTree
+from utils.distances import EARTH_RADIUS, haversine, to_unit_vectors
+
+
+class TowerIndex:
+    """
+    Class to index the towers of a TowerStore in order to find the
+    closest tower of every operator without going through the whole
+    database. One KD-tree is built for each operator, over the towers
+    placed on the unit sphere so that the closest towers in the tree
+    are the closest ones on the Earth's surface. Searches restricted
+    to the towers providing some networks use trees of their own,
+    built the first time they are needed.
+
+    Parameters:
+    -----------
+    store: (utils.TowerStore)
+        Store with the towers to index
+
+    [OPTIONALS]
+    candidates: (int)
+        Number of closest towers of the tree that are scored with the
+        metric before choosing the closest one. If none is provided,
+        8 will be used.
+    """
+    def __init__(self, store, candidates=8):
+        self.store = store
+        self.candidates = candidates
+
+        # Build a tree for every operator, keeping the rows of the
+        # store each tree refers to
+        self.trees = {}
+        self.rows = {}
+        for operator in np.unique(store.operators):
+            rows = np.flatnonzero(store.operators == operator)
+            points = to_unit_vectors(store.latitudes[rows],
+                                     store.longitudes[rows])
+            self.trees[int(operator)] = cKDTree(points)
+            self.rows[int(operator)] = rows
+
+        # Trees of the towers providing some networks:
+        # (operator, networks) -> (tree, rows)
+        self.partitions = {}
+        self.lock = threading.Lock()
+
+    def partition(self, operator, networks=None):
+        """
+        Get the tree of the towers of an operator that provide every
+        one of some networks
+
+        Parameters:
+        -----------
+        operator: (int)
+            Code of the operator
+
+        [OPTIONALS]
+        networks: (list of strings)
+            Networks the towers must provide. If none are provided, all
+            the towers of the operator are kept.
+
+        Return:
+        -------
+        tuple: (tree, rows) with the rows of the store the tree refers
+        to, or None if there is no such tower
+        """
+        if operator not in self.trees:
+            return None
+        if not networks:
+            return self.trees[operator], self.rows[operator]
+
+        key = (operator, tuple(sorted(networks)))
+        with self.lock:
+            if key not in self.partitions:
+                rows = self.rows[operator]
+                provided = np.ones(len(rows), dtype=bool)
+                for net in networks:
+                    provided &= self.store.networks[net][rows] == 1
+                rows = rows[provided]
+                self.partitions[key] = None if len(rows) == 0 else (
+                    cKDTree(to_unit_vectors(self.store.latitudes[rows],
+                                            self.store.longitudes[rows])),
+                    rows)
+            return self.partitions[key]
+
+    def closest_towers(self, latitude, longitude, metric=haversine,
+                       operators=None, networks=None):
+        """
+        Get the closest tower of every operator for a location
+
+        Parameters:
+        -----------
+        latitude: (float)
+            Latitude of the location
+        longitude: (float)
+            Longitude of the location
+
+        [OPTIONALS]
+        metric: (function)
+            Distance function from utils.distances used to score the
+            candidates. If none is provided, haversine will be used.
+        operators: (list of int)
+            Codes of the operators searched. If none are provided, all
+            of them will be searched.
+        networks: (list of strings)
+            Networks the towers must provide, see partition()
+
+        Return:
+        -------
+        dict: operator code as key and a tuple (distance, row) as
+        value, where distance is in metres and row is the position of
+        the tower in the store. Operators without any tower providing
+        the networks are left out.
+        """
+        closest = self.closest_towers_many(
+            np.array([latitude]), np.array([longitude]), metric=metric,
+            operators=operators, networks=networks)
+        return {operator: (float(dist[0]), rows[0])
+                for operator, (dist, rows) in closest.items()}
+
+    def closest_towers_many(self, latitudes, longitudes, metric=haversine,
+                            operators=None, networks=None):
+        """
+        Get the closest tower of every operator for many locations at
+        once
+
+        Parameters:
+        -----------
+        latitudes: (numpy.ndarray)
+            Latitudes of the locations
+        longitudes: (numpy.ndarray)
+            Longitudes of the locations
+
+        [OPTIONALS]
+        metric, operators, networks: same as closest_towers()
+
+        Return:
+        -------
+        dict: operator code as key and a tuple (distances, rows) of
+        arrays as value, with one element per location
+        """
+        points = to_unit_vectors(latitudes, longitudes)
+        closest = dict()
+        for operator in self.trees if operators is None else operators:
+            part = self.partition(operator, networks)
+            if part is None:
+                continue
+            tree, tree_rows = part
+
+            # Get a few candidates from the tree for every location and
+            # score all of them at once with the metric
+            k = min(self.candidates, tree.n)
+            _, positions = tree.query(points, k=k)
+            positions = positions.reshape(len(points), k)
+            rows = tree_rows[positions]
+            dist = metric(latitudes[:, None], longitudes[:, None],
+                          self.store.latitudes[rows],
+                          self.store.longitudes[rows])
+
+            # On ties keep the first tower of the database, as a
+            # full scan would do
+            best = np.lexsort((rows, dist))[:, 0]
+            locations = np.arange(len(points))
+            closest[operator] = (dist[locations, best],
+                                 rows[locations, best])
+        return closest
+
+    def nearest_towers(self, latitude, longitude, k=None, radius=None,
+                       metric=haversine, operators=None, networks=None):
+        """
+        Get the k nearest towers of every operator for a location, or
+        all of them within a radius, with a single query to each tree
+
+        Parameters:
+        -----------
+        latitude: (float)
+            Latitude of the location
+        longitude: (float)
+            Longitude of the location
+
+        [OPTIONALS]
+        k: (int)
+            Maximum number of towers of every operator. At least one of
+            k and radius must be provided.
+        radius: (float)
+            Maximum distance to the towers, in metres
+        metric, operators, networks: same as closest_towers()
+
+        Return:
+        -------
+        dict: operator code as key and a tuple (distances, rows) of
+        arrays as value, sorted from the nearest tower
+        """
+        point = to_unit_vectors(np.array([latitude]),
+                                np.array([longitude]))[0]
+        if radius is not None:
+            # Straight distance on the unit sphere of the radius, a bit
+            # wider so other metrics than haversine do not miss towers
+            angle = min(radius * 1.01 / EARTH_RADIUS, np.pi)
+            chord = 2 * np.sin(angle / 2)
+
+        nearest = dict()
+        for operator in self.trees if operators is None else operators:
+            part = self.partition(operator, networks)
+            if part is None:
+                continue
+            tree, tree_rows = part
+
+            if radius is None:
+                count = min(k + self.candidates, tree.n)
+                _, positions = tree.query(point, k=count)
+                positions = np.atleast_1d(positions)
+            else:
+                positions = np.array(tree.query_ball_point(point, chord),
+                                     dtype=np.intp)
+            rows = tree_rows[positions]
+            dist = metric(latitude, longitude, self.store.latitudes[rows],
+                          self.store.longitudes[rows])
+
+            # Sort by distance, and by row on ties as closest_towers()
+            order = np.lexsort((rows, dist))
+            if radius is not None:
+                order = order[dist[order] <= radius]
+            if k is not None:
+                order = order[:k]
+            nearest[operator] = (dist[order], rows[order])
+        return nearest
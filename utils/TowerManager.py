@@ -1,9 +1,11 @@
-import os
-import pandas as pd
+import numpy as np
 
-from math import sqrt
-from databases.datascripts import csv_name, operator_code
-from utils.Locator import Locator
+from databases.datascripts import operator_code
+from utils.CoverageResult import CoverageResult
+from utils.Locator import Coordinates
+from utils.Metrics import grid_lookups_total, stage_seconds
+from utils.TowerStore import TowerStore, get_tower_store
+from utils.distances import EARTH_RADIUS, haversine, metrics
 
 
 class TowerManager:
@@ -13,25 +15,47 @@ class TowerManager:
 
     Parameters:
     -----------
-    location: (utils.Locator)
-        A geolocation to manage the towers around the location
+    location: (utils.Coordinates)
+        A geolocation to manage the towers around the location, either
+        a Locator or just its Coordinates
 
     [OPTIONALS]
     database: (pandas.DataFrame)
         A database filled with towers in a particular way. A minimal
         column check is run to ensure proper behaviour. Find more about
         the restrictions at check_database(). If no database is given,
-        the one located on the database directory will be used.
+        the one of the shared TowerStore of the process will be used.
     network: (list of strings)
         Networks that will be found on the coverage search process. If
         none are provided, the string: ['2G', '3G', '4G'] will be used
+    metric: (str)
+        Name of the distance used to find the closest towers, one of
+        utils.distances.metrics. If none is provided, 'haversine' will
+        be used.
+    operators: (list)
+        Operators searched, by name or code of operator_code. If none
+        are provided, all of them will be searched.
+    required_networks: (list of strings)
+        Networks the towers searched must provide, so the closest tower
+        providing them is found for every operator. If none are
+        provided, every tower will be searched.
     """
-    def __init__(self, location, database=None, networks=None):
+    # Maximum number of towers of every operator of a nearby search
+    max_nearby = 100
+
+    # Half side, in degrees, of the first box of reduced_database() and
+    # maximum number of times it is doubled
+    search_area = 0.02
+    max_expansions = 12
+
+    def __init__(self, location, database=None, networks=None,
+                 metric='haversine', operators=None, required_networks=None):
         # Check location and store it
         self.location = location
         self.check_location()
 
         # Check database and store it
+        self.tower_store = None
         self.database = database
         self.check_database()
 
@@ -39,16 +63,48 @@ class TowerManager:
         self.networks = networks
         self.check_networks()
 
+        # Check metric and store it
+        self.metric = metric
+        self.check_metric()
+
+        # Check operators and required networks and store them
+        self.operators = operators
+        self.check_operators()
+        self.required_networks = required_networks
+        self.check_required_networks()
+
         # Attributes
         self.tower_indexes = {}
+        self.tower_rows = {}
+        self.tower_distances = {}
         self.towers_coverage = {}
+        self.nearby_towers = {}
+        self.nearby_rows = {}
+        self.nearby_coverage = {}
+        self.expansions = 0
+
+    @property
+    def database(self):
+        """
+        Database of the towers. The DataFrame of the shared TowerStore
+        is only built if it is asked for, as the searches only use the
+        arrays of the store.
+        """
+        if self._database is None and self.tower_store is not None:
+            return self.tower_store.database
+        return self._database
+
+    @database.setter
+    def database(self, database):
+        self._database = database
 
     def check_location(self):
         """
         Check for the location
         """
-        # Check that the location is an object from the Locator class
-        if not isinstance(self.location, Locator):
+        # Check that the location is an object from the Coordinates
+        # class, as the Locator is
+        if not isinstance(self.location, Coordinates):
             raise AttributeError("The location provided "
                                  "is not a Locator!")
 
@@ -56,19 +112,21 @@ class TowerManager:
         """
         Checks for the database
         """
-        # Check if database exists, if not, provide the local one
-        if self.database is None:
-            # CAUTION! this path is assumed to be launched only from the
-            # JG_API_papernest file!
-            db_dir = os.path.join(os.getcwd(), 'databases')
-            db_path = os.path.join(db_dir, csv_name)
-            self.database = pd.read_csv(db_path, sep=";")
+        # Check if database exists, if not, provide the shared one,
+        # which is only read from disk once per process
+        if self._database is None:
+            self.tower_store = get_tower_store()
+            self.columns = set(TowerStore.base_columns) \
+                | set(self.tower_store.networks)
+        else:
+            self.tower_store = None
+            self.columns = set(self._database.columns)
 
         # Ensure database has the minimal expected columns
         expected_columns = {'Operateur',
                             'Latitude', 'Longitude',
                             '2G', '3G', '4G'}
-        if not expected_columns.issubset(self.database.columns):
+        if not expected_columns.issubset(self.columns):
             raise AttributeError("Database does not contain the"
                                  " minimum expected columns!")
 
@@ -86,86 +144,368 @@ class TowerManager:
                                  " list!")
 
         # Check that networks are database columns
-        if not set(self.networks).issubset(self.database.columns):
+        if not set(self.networks).issubset(self.columns):
             raise AttributeError("Provided networks are not in the "
                                  "database!")
 
-    def location_coverage(self):
-        # Reduce the database to a more handleable amount
-        self.database = self.reduced_database()
+    def check_metric(self):
+        """
+        Check for the metric
+        """
+        if self.metric not in metrics:
+            raise AttributeError("Provided metric is not available!")
+
+    def check_operators(self):
+        """
+        Check for the operators
+        """
+        # Check if operators exists, if not, search all of them
+        if self.operators is None:
+            self.operators = list(operator_code)
+
+        # Check that operators is a list for further use
+        if not isinstance(self.operators, list):
+            raise AttributeError("operators provided is expected to be a"
+                                 " list!")
+
+        # Keep the codes of the operators, given by name or code
+        codes = {name: code for code, name in operator_code.items()}
+        codes.update({code: code for code in operator_code})
+        if not all(isinstance(op, (int, str)) and op in codes
+                   for op in self.operators):
+            raise AttributeError("Provided operators are not available!")
+        self.operators = list(dict.fromkeys(codes[op]
+                                            for op in self.operators))
+
+    def check_required_networks(self):
+        """
+        Check for the required networks
+        """
+        if self.required_networks is None:
+            self.required_networks = []
 
+        # Check that required networks is a list of database columns
+        if not isinstance(self.required_networks, list):
+            raise AttributeError("required_networks provided is expected "
+                                 "to be a list!")
+        if not set(self.required_networks).issubset(self.columns):
+            raise AttributeError("Provided networks are not in the "
+                                 "database!")
+
+    def check_nearby(self, k, radius):
+        """
+        Check for the parameters of a nearby search
+        """
+        if k is None and radius is None:
+            raise AttributeError("Either k or radius must be provided!")
+
+        # Check that k is a positive number of towers
+        if k is not None and (not isinstance(k, int) or isinstance(k, bool)
+                              or not 0 < k <= self.max_nearby):
+            raise AttributeError("k must be a number of towers between 1 "
+                                 "and {}!".format(self.max_nearby))
+
+        # Check that the radius is a positive distance
+        if radius is not None and (not isinstance(radius, (int, float))
+                                   or isinstance(radius, bool)
+                                   or not radius > 0):
+            raise AttributeError("radius must be a positive distance in "
+                                 "metres!")
+
+    def location_coverage_result(self):
+        """
+        Same as location_coverage(), giving back a CoverageResult
+        instead of filling towers_coverage
+        """
+        with stage_seconds.time('locate_closest_towers'):
+            self.locate_closest_towers()
+        return self.coverage_result()
+
+    def location_coverage(self):
         # Find the closest towers
-        self.locate_closest_towers()
+        with stage_seconds.time('locate_closest_towers'):
+            self.locate_closest_towers()
 
         # Find coverage of the closest towers
-        self.find_towers_coverage()
+        with stage_seconds.time('find_towers_coverage'):
+            self.find_towers_coverage()
 
-    def reduced_database(self, area=1):
+    def reduced_database(self, area=None):
         """
         Method to reduce the database around the specific location
-        provided
+        provided. A box around the location is doubled until it holds a
+        tower of every operator searched providing the required
+        networks, and then widened to the distance of the furthest of
+        those towers, so that no closer tower is left out. Only the
+        towers of the box are read, found by a binary search over the
+        latitudes of the TowerStore. The number of times the box was
+        doubled is kept in expansions.
+
+        It is not used to answer the API, which searches the index of
+        the TowerStore, but to reduce a database before working on it.
 
         Parameters:
         -----------
-        area: (int)
-            Distance to square around the location to look for towers.
+        [OPTIONALS]
+        area: (float)
+            Half side, in degrees, of the first box around the location.
+            If none is provided, search_area will be used.
+
         return:
         -------
-        pandas.DataFrame: a reduction of the given database
-        """
-        ret = self.database.loc[(self.database['Latitude'] > (self.location.latitude - area))
-                                & (self.database['Latitude'] < (self.location.latitude + area))
-                                & (self.database['Longitude'] > (self.location.longitude - area))
-                                & (self.database['Longitude'] < (self.location.longitude + area))]
-        if len(set(ret['Operateur'])) < 4:
-            return self.reduced_database(area=area + 1)
-        else:
-            return ret
+        pandas.DataFrame: a reduction of the given database, with the
+        closest tower of every operator searched providing the required
+        networks. The whole database if the box was doubled
+        max_expansions times without finding them.
+        """
+        self.check_tower_store()
+        store = self.tower_store
+        latitude = self.location.latitude
+        longitude = self.location.longitude
+        area = self.search_area if area is None else area
+
+        self.expansions = 0
+        while True:
+            rows = store.rows_in_box(latitude - area, latitude + area,
+                                     longitude - area, longitude + area)
+
+            # Towers that could be the closest ones
+            found = rows[np.isin(store.operators[rows], self.operators)]
+            for net in self.required_networks:
+                found = found[store.networks[net][found] == 1]
+            if set(self.operators).issubset(store.operators[found].tolist()):
+                break
+            if self.expansions == self.max_expansions:
+                return self.database
+            area *= 2
+            self.expansions += 1
+
+        # Distance to the furthest of the closest towers of every
+        # operator, with a margin for the other metrics
+        dist = haversine(latitude, longitude, store.latitudes[found],
+                         store.longitudes[found])
+        operators = store.operators[found]
+        furthest = max(dist[operators == operator].min()
+                       for operator in self.operators) * 1.01
+
+        # Box holding every location closer than that distance
+        lat_area = np.degrees(furthest / EARTH_RADIUS)
+        ln_area = lat_area / np.cos(np.radians(min(abs(latitude) + lat_area,
+                                                   89.0)))
+        lat_area, ln_area = max(area, lat_area), max(area, ln_area)
+        rows = store.rows_in_box(latitude - lat_area, latitude + lat_area,
+                                 longitude - ln_area, longitude + ln_area)
+        return self.database.iloc[np.sort(rows)]
 
     def locate_closest_towers(self):
         """
         Get the database index of the closest towers for the location
         """
+        self.check_tower_store()
 
-        # Set all saved distances to 100 in order to be able to find a
-        # closer one by comparison.
-        minimums = dict()
-        for op in set(self.database['Operateur']):
-            minimums[op] = (100.0, 0)
+        # Ask the precomputed grid for the closest tower of every
+        # operator. It is built with the haversine distance, so the
+        # index is asked instead for other metrics, and for the
+        # operators the grid does not know the answer of. It only knows
+        # the closest towers among all of them, so it cannot answer for
+        # required networks.
+        closest = dict()
+        if self.metric == 'haversine' and not self.required_networks \
+                and self.tower_store.grid is not None:
+            closest = self.tower_store.grid.closest_towers(
+                self.location.latitude, self.location.longitude) or dict()
+            hits = len(set(closest) & set(self.operators))
+            grid_lookups_total.inc('hit', hits)
+            grid_lookups_total.inc('miss', len(self.operators) - hits)
+        missing = [op for op in self.operators if op not in closest]
+        if missing:
+            closest.update(self.tower_store.index.closest_towers(
+                self.location.latitude, self.location.longitude,
+                metric=metrics[self.metric], operators=missing,
+                networks=self.required_networks))
 
-        # Compare distance between location and all towers
-        # on the database
-        for index, row in self.database.iterrows():
-            # Get the distance between the two points
-            dist_lat = self.location.latitude - row['Latitude']
-            dist_ln = self.location.longitude - row['Longitude']
-            dist = sqrt((dist_lat ** 2) + (dist_ln ** 2))
+        # Fill the dictionaries for each operator searched with the
+        # database index of the closest tower and its distance in metres
+        for operator, (dist, row) in closest.items():
+            if operator not in self.operators:
+                continue
+            self.tower_indexes[operator] = int(self.tower_store.labels[row])
+            self.tower_rows[operator] = int(row)
+            self.tower_distances[operator] = dist
 
-            # Check if distance is shorter than the previous one saved
-            if dist < minimums[int(row['Operateur'])][0]:
-                minimums[int(row['Operateur'])] = (dist, index)
+    def check_tower_store(self):
+        """
+        Ensure the TowerStore searched holds the current database
+        """
+        # The index is built over a store of the current database. The
+        # shared one is reused unless the database has been replaced
+        # (e.g. by a reduced one).
+        if self._database is not None and (
+                self.tower_store is None
+                or self.tower_store.database is not self._database):
+            self.tower_store = TowerStore.from_data_frame(self._database)
+
+    def location_nearby_coverage(self, k=None, radius=None):
+        """
+        Get the coverage of the k nearest towers of every operator, or
+        of all of them within a radius
+
+        Parameters:
+        -----------
+        [OPTIONALS]
+        k: (int)
+            Maximum number of towers of every operator, up to
+            max_nearby. At least one of k and radius must be provided.
+        radius: (float)
+            Maximum distance to the towers, in metres
+        """
+        self.check_nearby(k, radius)
+
+        # Find the nearby towers
+        with stage_seconds.time('locate_nearby_towers'):
+            self.locate_nearby_towers(k=k, radius=radius)
+
+        # Find coverage of the nearby towers
+        with stage_seconds.time('find_nearby_coverage'):
+            self.find_nearby_coverage()
+
+    def locate_nearby_towers(self, k=None, radius=None):
+        """
+        Get the database indexes of the nearby towers for the location,
+        from the nearest one. Same parameters as
+        location_nearby_coverage().
+        """
+        self.check_tower_store()
+
+        # Without k, the number of towers is bounded anyway
+        nearest = self.tower_store.index.nearest_towers(
+            self.location.latitude, self.location.longitude,
+            k=k or self.max_nearby, radius=radius,
+            metric=metrics[self.metric], operators=self.operators,
+            networks=self.required_networks)
+
+        # Fill the dictionaries for each operator with a list of tuples
+        # (database index, distance in metres), and the rows of the
+        # towers in the store
+        # Operators without any tower providing the required networks
+        # are answered without towers, as when none is in the radius
+        nothing = (np.empty(0), np.empty(0, dtype=np.int64))
+        for operator in self.operators:
+            dist, rows = nearest.get(operator, nothing)
+            self.nearby_towers[operator] = list(zip(
+                self.tower_store.labels[rows].tolist(), dist.tolist()))
+            self.nearby_rows[operator] = rows
+
+    def find_nearby_coverage(self):
+        """
+        Function that provides the coverage of the nearby towers. The
+        networks of every operator are true if any of its nearby towers
+        provides them, and every tower is listed under 'towers'.
+        """
+        t_f = CoverageResult.t_f
+
+        for operator, towers in self.nearby_towers.items():
+            # Networks of the towers, read from the arrays of the store
+            rows = self.nearby_rows[operator]
+            flags = list(zip(*[self.tower_store.networks[net][rows].tolist()
+                               for net in self.networks]))
+
+            coverage = {net: 'false' for net in self.networks}
+            coverage['towers'] = []
+            for (_, dist), tower_flags in zip(towers, flags):
+                tower = {net: t_f[flag]
+                         for net, flag in zip(self.networks, tower_flags)}
+                tower['distance'] = round(dist, 1)
+                coverage['towers'].append(tower)
 
-        # Fill the dictionary for each operator with the database index
-        # of the closest tower
-        for operator, values in minimums.items():
-            self.tower_indexes[operator] = values[1]
+                # A network is covered if any tower provides it
+                for net in self.networks:
+                    if tower[net] == 'true':
+                        coverage[net] = 'true'
+            self.nearby_coverage[operator_code[operator]] = coverage
 
     def find_towers_coverage(self):
         """
         Function that provides the coverage of a set of given towers
         """
-        # Dictionary to convert 1 into true and 0 into false to avoid
-        # unnecessary ifs for expected output
-        t_f = {1: 'true', 0: 'false'}
-
-        # Loop that goes through the dictionary of the closest tower
-        # of each operator.
-        for operator, index in self.tower_indexes.items():
-            # Create an empty dictionary for every operator
-            self.towers_coverage[operator_code[operator]] = dict()
-
-            # Fill those dictionaries with the networks and true or
-            # false as a value depending on their coverage in the
-            # database
-            for net in self.networks:
-                self.towers_coverage[operator_code[operator]][net] = t_f[self.database.at[index, net]]
+        self.towers_coverage.update(self.coverage_result().to_dict())
+
+    def coverage_result(self):
+        """
+        Get the coverage of the closest towers found by
+        locate_closest_towers(), read from the arrays of the
+        TowerStore instead of the database
+
+        Return:
+        -------
+        CoverageResult: the coverage of every operator searched. The
+        operators without any tower providing the required networks
+        are not covered by any network, at an infinite distance.
+        """
+        operators = list(self.tower_rows)
+        rows = [self.tower_rows[operator] for operator in operators]
+        columns = [self.tower_store.networks[net][rows].tolist()
+                   for net in self.networks]
+        flags = list(zip(*columns)) if columns else [()] * len(rows)
+        distances = [self.tower_distances[operator]
+                     for operator in operators]
+
+        missing = [op for op in self.operators if op not in self.tower_rows]
+        operators += missing
+        flags += [(0,) * len(self.networks)] * len(missing)
+        distances += [float('inf')] * len(missing)
+        return CoverageResult(
+            [operator_code[operator] for operator in operators],
+            distances, self.networks, flags)
+
+    @staticmethod
+    def batch_coverage(locations, networks=None, metric='haversine'):
+        """
+        Get the coverage of many locations with a single query to the
+        index of the shared TowerStore
+
+        Parameters:
+        -----------
+        locations: (list of utils.Coordinates)
+            Locations already checked
+
+        [OPTIONALS]
+        networks: (list of strings)
+            Same as for the TowerManager
+        metric: (str)
+            Same as for the TowerManager
+
+        Return:
+        -------
+        list of dict: coverage of every location, in the same format
+        as towers_coverage
+        """
+        if metric not in metrics:
+            raise AttributeError("Provided metric is not available!")
+        store = get_tower_store()
+        networks = networks or ['2G', '3G', '4G']
+        if not set(networks).issubset(store.networks):
+            raise AttributeError("Provided networks are not in the "
+                                 "database!")
+
+        coverages = [dict() for _ in locations]
+        if not locations:
+            return coverages
+
+        # Closest towers of all the locations at once
+        latitudes = np.array([loc.latitude for loc in locations])
+        longitudes = np.array([loc.longitude for loc in locations])
+        closest = store.index.closest_towers_many(
+            latitudes, longitudes, metric=metrics[metric])
+
+        # Fill the coverage of every location, as find_towers_coverage()
+        t_f = CoverageResult.t_f
+        for operator, (dist, rows) in closest.items():
+            flags = {net: store.networks[net][rows].tolist()
+                     for net in networks}
+            dist = np.round(dist, 1).tolist()
+            for i, coverage in enumerate(coverages):
+                coverage[operator_code[operator]] = {
+                    net: t_f[flags[net][i]] for net in networks}
+                coverage[operator_code[operator]]['distance'] = dist[i]
+        return coverages
@@ -0,0 +1,556 @@
+import os
+import threading
+import zlib
+import numpy as np
+import pandas as pd
+
+from databases.datascripts import binary_name, csv_name, grid_name
+from utils.CoverageGrid import CoverageGrid
+from utils.MappedColumns import BitColumn, CodedColumn
+from utils.Metrics import stage_seconds, tower_store_reloads_total
+from utils.TowerIndex import TowerIndex
+
+
+class TowerStore:
+    """
+    Class to hold an immutable snapshot of a tower database. It is
+    meant to be loaded once per process and shared between every
+    TowerManager, which only receive read-only views of its columns.
+    It can be created from a pandas.DataFrame, a csv file or a compact
+    binary file that is memory-mapped.
+
+    Parameters:
+    -----------
+    operators: (numpy.ndarray)
+        Operator code of every tower
+    latitudes: (numpy.ndarray)
+        Latitude of every tower
+    longitudes: (numpy.ndarray)
+        Longitude of every tower
+    networks: (dict)
+        Network name (e.g. '2G', '3G', '4G') as key and an array with
+        1 for the towers offering it, 0 otherwise, as value
+
+    [OPTIONALS]
+    labels: (numpy.ndarray)
+        Label of every tower in the database. If none are provided,
+        their positions will be used.
+    database: (pandas.DataFrame)
+        The database the columns come from, if there is one
+    source: (str)
+        Path of the file the database was read from. Used to know if
+        the store is outdated and needs to be reloaded.
+    """
+    base_columns = ['Operateur', 'Latitude', 'Longitude']
+
+    # Binary format: a header followed by the columns latitudes and
+    # longitudes (float32), operators (uint8 position in the header
+    # operators) and networks (uint8, one bit per header network)
+    magic = b'JGTW'
+    version = 1
+    header_dtype = np.dtype([('magic', 'S4'),
+                             ('version', '<u2'),
+                             ('n_operators', 'u1'),
+                             ('n_networks', 'u1'),
+                             ('rows', '<u4'),
+                             ('operators', '<u4', (8,)),
+                             ('networks', 'S8', (8,))])
+
+    def __init__(self, operators, latitudes, longitudes, networks,
+                 labels=None, database=None, source=None):
+        # Store where the towers come from
+        self.source = source
+        self.mtime = self.source_mtime()
+        self._database = database
+
+        # Read-only views of the columns of the database
+        if labels is None:
+            labels = np.arange(len(operators))
+        self.labels = self.read_only(labels)
+        self.operators = self.read_only(operators)
+        self.latitudes = self.read_only(latitudes)
+        self.longitudes = self.read_only(longitudes)
+        self.networks = {net: self.read_only(column)
+                         for net, column in networks.items()}
+
+        # Spatial index and coverage grid, only loaded when they are
+        # first needed
+        self._index = None
+        self._index_lock = threading.Lock()
+        self._grid = None
+        self._grid_loaded = False
+        self._latitude_order = None
+        self.ready = False
+
+    @classmethod
+    def from_data_frame(cls, database, source=None):
+        """
+        Create a TowerStore from a pandas.DataFrame
+
+        Parameters:
+        -----------
+        database: (pandas.DataFrame)
+            A database filled with towers. It must contain, at least,
+            the columns: 'Operateur', 'Latitude' and 'Longitude'. Any
+            other column is considered a network.
+
+        [OPTIONALS]
+        source: (str)
+            Path of the file the database was read from
+
+        Return:
+        -------
+        TowerStore: store with the towers of the database
+        """
+        cls.check_database(database)
+        return cls(database['Operateur'], database['Latitude'],
+                   database['Longitude'],
+                   {net: database[net] for net in database.columns
+                    if net not in cls.base_columns},
+                   labels=database.index, database=database, source=source)
+
+    @classmethod
+    def from_csv(cls, path):
+        """
+        Create a TowerStore from a semicolon separated csv file
+
+        Parameters:
+        -----------
+        path: (str)
+            Path to the csv file
+
+        Return:
+        -------
+        TowerStore: store with the towers of the file
+        """
+        return cls.from_data_frame(pd.read_csv(path, sep=";"), source=path)
+
+    @classmethod
+    def from_binary(cls, path):
+        """
+        Create a TowerStore from a binary file written by
+        save_binary(). Every column is memory-mapped, so every process
+        loading the same file shares them: the operators and networks
+        are only decoded for the rows that are read.
+
+        Parameters:
+        -----------
+        path: (str)
+            Path to the binary file
+
+        Return:
+        -------
+        TowerStore: store with the towers of the file
+        """
+        if not cls.is_binary(path):
+            raise AttributeError("File is not a tower database!")
+        header = np.fromfile(path, dtype=cls.header_dtype, count=1)
+        if len(header) == 0 or header['version'][0] != cls.version:
+            raise AttributeError("File is not a tower database!")
+        rows = int(header['rows'][0])
+
+        # Map every column of the file
+        columns = dict()
+        offset = cls.header_dtype.itemsize
+        for name, dtype in [('latitudes', '<f4'), ('longitudes', '<f4'),
+                            ('operators', 'u1'), ('networks', 'u1')]:
+            columns[name] = np.memmap(path, dtype=dtype, mode='r',
+                                      shape=(rows,), offset=offset)
+            offset += rows * np.dtype(dtype).itemsize
+
+        # Operators and networks are decoded from the mapped bytes
+        n_operators = int(header['n_operators'][0])
+        codes = header['operators'][0][:n_operators].astype(np.int64)
+        n_networks = int(header['n_networks'][0])
+        names = [net.decode() for net in header['networks'][0][:n_networks]]
+        networks = {net: BitColumn(columns['networks'], bit)
+                    for bit, net in enumerate(names)}
+        return cls(CodedColumn(columns['operators'], codes),
+                   columns['latitudes'], columns['longitudes'], networks,
+                   source=path)
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Create a TowerStore from a binary or a csv file
+        """
+        if cls.is_binary(path):
+            return cls.from_binary(path)
+        return cls.from_csv(path)
+
+    @classmethod
+    def is_binary(cls, path):
+        """
+        Check if a file is a binary tower database
+        """
+        with open(path, 'rb') as file:
+            return file.read(len(cls.magic)) == cls.magic
+
+    def save_binary(self, path):
+        """
+        Write the store into a compact binary file
+
+        Parameters:
+        -----------
+        path: (str)
+            Path to the binary file
+        """
+        codes, operators = np.unique(self.operators, return_inverse=True)
+        if len(codes) > 8 or len(self.networks) > 8:
+            raise AttributeError("Database has too many operators or "
+                                 "networks for the binary format!")
+        networks = np.zeros(len(self), dtype='u1')
+        for bit, net in enumerate(self.networks):
+            networks |= (np.asarray(self.networks[net]) != 0).astype('u1') \
+                << bit
+
+        header = np.zeros(1, dtype=self.header_dtype)
+        header['magic'] = self.magic
+        header['version'] = self.version
+        header['n_operators'] = len(codes)
+        header['n_networks'] = len(self.networks)
+        header['rows'] = len(self)
+        header['operators'][0][:len(codes)] = codes
+        header['networks'][0][:len(self.networks)] = \
+            [net.encode() for net in self.networks]
+        with open(path, 'wb') as file:
+            file.write(header.tobytes())
+            for column in [self.latitudes.astype('<f4'),
+                           self.longitudes.astype('<f4'),
+                           operators.astype('u1'), networks]:
+                file.write(column.tobytes())
+
+    @staticmethod
+    def read_only(column):
+        """
+        Get a numpy view of a column that can not be written
+
+        Parameters:
+        -----------
+        column: (pandas.Series, pandas.Index or numpy.ndarray)
+            Column to get the view from
+
+        Return:
+        -------
+        numpy.ndarray: read-only view of the column, or the column
+        itself if it is read from a binary file
+        """
+        if isinstance(column, (BitColumn, CodedColumn)):
+            return column
+        view = np.asarray(column).view()
+        view.flags.writeable = False
+        return view
+
+    @property
+    def database(self):
+        """
+        pandas.DataFrame with the towers of the store, only built if
+        the store was not created from one
+        """
+        if self._database is None:
+            columns = {'Operateur': np.asarray(self.operators),
+                       'Latitude': self.latitudes,
+                       'Longitude': self.longitudes}
+            columns.update({net: np.asarray(column)
+                            for net, column in self.networks.items()})
+            self._database = pd.DataFrame(columns, index=self.labels)
+        return self._database
+
+    @property
+    def index(self):
+        """
+        TowerIndex of the store, built the first time it is requested
+        """
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    self._index = TowerIndex(self)
+        return self._index
+
+    @property
+    def grid(self):
+        """
+        CoverageGrid stored next to the source file of the store, None
+        if there is none or it was built for other towers
+        """
+        if not self._grid_loaded:
+            with self._index_lock:
+                if not self._grid_loaded:
+                    self._grid = self.load_grid()
+                    self._grid_loaded = True
+        return self._grid
+
+    @property
+    def latitude_order(self):
+        """
+        Rows of the store sorted by latitude, with their latitudes and
+        longitudes in the same order, built the first time they are
+        requested
+        """
+        if self._latitude_order is None:
+            with self._index_lock:
+                if self._latitude_order is None:
+                    order = np.argsort(self.latitudes, kind='stable')
+                    self._latitude_order = (
+                        order, self.read_only(self.latitudes[order]),
+                        self.read_only(self.longitudes[order]))
+        return self._latitude_order
+
+    def rows_in_box(self, lat_min, lat_max, ln_min, ln_max):
+        """
+        Get the rows of the towers strictly inside a box. The band of
+        latitudes is found with a binary search, so only the towers of
+        the band are read.
+
+        Parameters:
+        -----------
+        lat_min, lat_max: (float)
+            Latitudes of the box, in degrees
+        ln_min, ln_max: (float)
+            Longitudes of the box, in degrees
+
+        Return:
+        -------
+        numpy.ndarray: rows of the towers, sorted by latitude
+        """
+        order, latitudes, longitudes = self.latitude_order
+        start = np.searchsorted(latitudes, lat_min, side='right')
+        stop = np.searchsorted(latitudes, lat_max, side='left')
+        longitudes = longitudes[start:stop]
+        inside = (longitudes > ln_min) & (longitudes < ln_max)
+        return order[start:stop][inside]
+
+    def warm_up(self):
+        """
+        Build everything a request needs (the index and the grid) so
+        that the first one does not wait for it. The DataFrame of the
+        store is not needed by the searches, so it is not built.
+
+        Return:
+        -------
+        TowerStore: the store itself
+        """
+        self.index
+        self.grid
+        self.ready = True
+        return self
+
+    def load_grid(self):
+        """
+        Load the CoverageGrid of the store from disk
+
+        Return:
+        -------
+        CoverageGrid: the grid, or None if it can not be used
+        """
+        if self.source is None:
+            return None
+        path = os.path.join(os.path.dirname(self.source), grid_name)
+        if not os.path.exists(path):
+            return None
+        # Grids of an older version are ignored until they are built
+        # again
+        try:
+            grid = CoverageGrid.load(path, store=self)
+        except AttributeError:
+            return None
+        return grid if grid.matches(self) else None
+
+    def fingerprint(self):
+        """
+        Checksum of the towers of the store, used to know if a file
+        built from a store still refers to the same towers. It is
+        computed with the precision of the binary format, so a csv
+        file and its binary version share it.
+        """
+        checksum = zlib.crc32(np.asarray(self.operators, dtype='<i8')
+                              .tobytes())
+        checksum = zlib.crc32(self.latitudes.astype('<f4').tobytes(),
+                              checksum)
+        return zlib.crc32(self.longitudes.astype('<f4').tobytes(), checksum)
+
+    def __len__(self):
+        return len(self.labels)
+
+    @classmethod
+    def check_database(cls, database):
+        """
+        Check that the database has the minimal expected columns
+        """
+        if not set(cls.base_columns).issubset(database.columns):
+            raise AttributeError("Database does not contain the"
+                                 " minimum expected columns!")
+
+    def source_mtime(self):
+        """
+        Get the last modification time of the source file, None if
+        the store does not come from a file
+        """
+        if self.source is None or not os.path.exists(self.source):
+            return None
+        return os.path.getmtime(self.source)
+
+    def is_outdated(self):
+        """
+        Check if the source file has changed since it was loaded
+        """
+        return self.source_mtime() != self.mtime
+
+
+# Shared store of the process, the lock that protects its loading and
+# the one that runs its reloads one at a time
+_tower_store = None
+_tower_store_lock = threading.Lock()
+_reload_lock = threading.Lock()
+
+# Functions called with the new store every time it is replaced, e.g.
+# to drop the caches computed from the previous one
+tower_store_listeners = []
+
+
+def default_database_path():
+    """
+    Path of the database used when none is provided: the binary file
+    if it has been built after the csv one, the csv file otherwise.
+    CAUTION! this path is assumed to be launched only from the
+    JG_API_papernest file!
+    """
+    db_dir = os.path.join(os.getcwd(), 'databases')
+    csv_path = os.path.join(db_dir, csv_name)
+    binary_path = os.path.join(db_dir, binary_name)
+    if os.path.exists(binary_path) and (
+            not os.path.exists(csv_path)
+            or os.path.getmtime(binary_path) >= os.path.getmtime(csv_path)):
+        return binary_path
+    return csv_path
+
+
+def get_tower_store():
+    """
+    Get the shared TowerStore of the process, loading it the first
+    time it is requested
+
+    Return:
+    -------
+    TowerStore: the shared store
+    """
+    if _tower_store is None:
+        with _tower_store_lock:
+            if _tower_store is None:
+                load_tower_store()
+    return _tower_store
+
+
+def warm_tower_store():
+    """
+    Load the shared TowerStore and build everything a request needs,
+    see TowerStore.warm_up()
+
+    Return:
+    -------
+    TowerStore: the shared store
+    """
+    return get_tower_store().warm_up()
+
+
+def tower_store_ready():
+    """
+    Check, without loading it, if the shared TowerStore is warm
+    """
+    store = _tower_store
+    return store is not None and store.ready
+
+
+def load_tower_store(path=None):
+    """
+    (Re)load the shared TowerStore from a file. Managers created
+    before the call keep the store they were given.
+
+    Parameters:
+    -----------
+    [OPTIONALS]
+    path: (str)
+        Path to the csv or binary file. If none is provided, the one
+        located on the database directory will be used.
+
+    Return:
+    -------
+    TowerStore: the new shared store
+    """
+    with stage_seconds.time('load_tower_store'):
+        store = TowerStore.from_file(path or default_database_path())
+    set_tower_store(store)
+    return store
+
+
+def set_tower_store(store):
+    """
+    Replace the shared TowerStore at once and notify the listeners
+
+    Parameters:
+    -----------
+    store: (TowerStore)
+        The new shared store
+    """
+    global _tower_store
+    _tower_store = store
+    for listener in tower_store_listeners:
+        listener(store)
+
+
+def tower_store_update():
+    """
+    Check if the shared TowerStore should be reloaded: the default file
+    is not the one it was loaded from, or it has changed since
+
+    Return:
+    -------
+    tuple: (path, modification time) of the default file, or None if
+    the store is up to date or not loaded
+    """
+    store = _tower_store
+    path = default_database_path()
+    if store is None or not os.path.exists(path):
+        return None
+    mtime = os.path.getmtime(path)
+    if path == store.source and mtime == store.mtime:
+        return None
+    return path, mtime
+
+
+def reload_tower_store(path=None, force=False):
+    """
+    Reload the shared TowerStore without stopping the requests. The new
+    store is loaded and warmed while the current one keeps answering,
+    and then swapped in at once. Requests already running finish with
+    the store they started with.
+
+    Parameters:
+    -----------
+    [OPTIONALS]
+    path: (str)
+        Path to the csv or binary file. If none is provided, the
+        default one will be used.
+    force: (bool)
+        If True, the file is loaded even if the store already comes
+        from it and it has not changed.
+
+    Return:
+    -------
+    TowerStore: the shared store, new or not
+    """
+    with _reload_lock:
+        store = get_tower_store()
+        path = path or default_database_path()
+        if not force and path == store.source and not store.is_outdated():
+            return store
+
+        try:
+            with stage_seconds.time('reload_tower_store'):
+                store = TowerStore.from_file(path).warm_up()
+        except Exception:
+            tower_store_reloads_total.inc('error')
+            raise
+        set_tower_store(store)
+        tower_store_reloads_total.inc('success')
+        return store
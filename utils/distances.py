@@ -0,0 +1,84 @@
+import numpy as np
+
+# Mean radius of the Earth in metres
+EARTH_RADIUS = 6371008.8
+
+
+def haversine(latitude, longitude, latitudes, longitudes):
+    """
+    Great-circle distance between a location and a set of points,
+    computed in a single array operation
+
+    Parameters:
+    -----------
+    latitude: (float)
+        Latitude of the location, in degrees
+    longitude: (float)
+        Longitude of the location, in degrees
+    latitudes: (numpy.ndarray)
+        Latitudes of the points, in degrees
+    longitudes: (numpy.ndarray)
+        Longitudes of the points, in degrees
+
+    Return:
+    -------
+    numpy.ndarray: distance to every point, in metres
+    """
+    lat_1 = np.radians(latitude)
+    lat_2 = np.radians(latitudes)
+    half_lat = (lat_2 - lat_1) / 2
+    half_ln = np.radians(np.subtract(longitudes, longitude)) / 2
+    a = np.sin(half_lat) ** 2 \
+        + np.cos(lat_1) * np.cos(lat_2) * np.sin(half_ln) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def equirectangular(latitude, longitude, latitudes, longitudes):
+    """
+    Fast approximation of the great-circle distance between a location
+    and a set of points. Precise enough for the few kilometres that
+    separate a location from its closest towers.
+
+    Parameters:
+    -----------
+    Same as haversine()
+
+    Return:
+    -------
+    numpy.ndarray: distance to every point, in metres
+    """
+    lat_1 = np.radians(latitude)
+    lat_2 = np.radians(latitudes)
+    dist_ln = np.radians(np.subtract(longitudes, longitude)) \
+        * np.cos((lat_1 + lat_2) / 2)
+    return EARTH_RADIUS * np.hypot(lat_2 - lat_1, dist_ln)
+
+
+def to_unit_vectors(latitudes, longitudes):
+    """
+    Convert locations into points of the unit sphere. The straight
+    distance between two of those points grows with the great-circle
+    distance, so a KD-tree built over them finds the closest points
+    on the Earth's surface.
+
+    Parameters:
+    -----------
+    latitudes: (numpy.ndarray)
+        Latitudes of the locations, in degrees
+    longitudes: (numpy.ndarray)
+        Longitudes of the locations, in degrees
+
+    Return:
+    -------
+    numpy.ndarray: (n, 3) array with the x, y, z coordinates
+    """
+    lat = np.radians(latitudes)
+    ln = np.radians(longitudes)
+    return np.column_stack((np.cos(lat) * np.cos(ln),
+                            np.cos(lat) * np.sin(ln),
+                            np.sin(lat)))
+
+
+# Metrics that can be used by the TowerManager
+metrics = {'haversine': haversine,
+           'equirectangular': equirectangular}